@@ -15,31 +15,139 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import hashlib
+import itertools
 import json
-import random
-from collections import deque
+from collections import deque, OrderedDict
 
 from .hazards.hazard import Hazard
 
 
-class Changeset:
+def get_path_shape(path):
+    """
+    The given path as a tuple, with array indexes replaced by None.
+    """
+    return tuple(None if isinstance(key, (int, long)) else key
+                 for key in path)
+
+
+class BranchIndex(object):
+    """
+    Index of the path shapes touched by a run of unaccounted changesets,
+    such as a branch which diverged while a client was offline. Finding the
+    changesets which can touch a given changeset then only costs as much as
+    the changesets found, instead of a check against every changeset in the
+    run.
+    """
+    # Shorter runs are quicker to check one by one.
+    MIN_CHANGESETS = 32
+    # How many of the most recently used indexes are kept.
+    MAX_CACHED = 8
+    # id of a run's tuple -> its index. Each index holds on to its tuple, so
+    # the id is not reused by another tuple while the index is kept.
+    _cache = OrderedDict()
+
+    @classmethod
+    def get_index(cls, css):
+        """
+        Get the index of the run in the tuple css, building it only if it is
+        not one of the most recently used. Changesets sharing the tuple then
+        share one index, whichever of them asks first.
+        """
+        cache = cls._cache
+        index = cache.pop(id(css), None)
+        if index is None:
+            index = cls(css)
+            if len(cache) >= cls.MAX_CACHED:
+                cache.popitem(last=False)
+        cache[id(css)] = index
+        return index
+
+    def __init__(self, css):
+        self.css = css
+        # Commutative ops are left out, since they never transform anything.
+        # shape -> positions in css of changesets with an op at that shape
+        self.by_shape = {}
+        # shape -> positions in css of changesets with an op at or below it
+        self.by_prefix = {}
+        for i, cs in enumerate(css):
+            for shape in cs.get_path_shapes(past=True):
+                self.by_shape.setdefault(shape, []).append(i)
+            for prefix in cs.get_path_prefixes(past=True):
+                self.by_prefix.setdefault(prefix, []).append(i)
+
+    def find_changesets(self, cs):
+        """
+        Get the changesets in the run whose paths are not disjoint from the
+        paths of cs, in their original order.
+        """
+        positions = set()
+        for shape in cs.get_path_shapes():
+            positions.update(self.by_prefix.get(shape, ()))
+        for prefix in cs.get_path_prefixes():
+            positions.update(self.by_shape.get(prefix, ()))
+        css = self.css
+        return [css[i] for i in sorted(positions)]
+
+
+class Changeset(object):
+    # Source of unique ids for the chains in the ancestry index.
+    _chain_ids = itertools.count()
+
+    __slots__ = ('doc_id', 'user', 'id_', 'ops', 't_ops', '_split_at',
+                 '_hazard_pieces', 'preceding_changesets',
+                 'dependencies', 'children', 'parents', 'collected_parent_ids',
+                 '_is_rebased_root', 'hazard_holders',
+                 '_has_full_dependency_info', '_is_snapshot_cache',
+                 'snapshot_cache', 'snapshot_cache_is_valid', '_chain',
+                 '_chain_pos', '_chain_reach', '_is_chain_tail',
+                 '_path_shapes', '_path_prefixes')
+
     def __init__(self, doc_id, user, dependencies):
         self.doc_id = doc_id
         self.user = user
         self.id_ = None
         self.ops = []
+        # The ops as they are applied to the document. Transforming can split
+        # an op in two, and then this holds the pieces too. See split_op.
+        self.t_ops = self.ops
+        self._split_at = {}
+        self._hazard_pieces = None
         self.preceding_changesets = None
         self.dependencies = dependencies
         self.children = []
         self.parents = dependencies[:]
+        # ids of parents which were dropped when the document's history was
+        # compacted. They are still part of this changeset's dependency ids.
+        self.collected_parent_ids = []
+        self._is_rebased_root = False
+        # Ops holding a Hazard or deletion edge made while transforming this
+        # changeset, so they can be found when it is transformed again.
+        self.hazard_holders = set([])
         self._has_full_dependency_info = False
-        self.set_as_snapshot_cache()
-        self._is_ancestor_cache = False
-        self.set_as_ancestor_cache()
+        self.set_as_snapshot_cache(False)
+        # Ancestry index. Filled in once the whole ancestry is known. See
+        # _index_ancestry.
+        self._chain = None
+        self._chain_pos = None
+        self._chain_reach = None
+        self._is_chain_tail = False
+        # Summary of the paths the ops touch. See get_path_shapes.
+        self._path_shapes = None
+        self._path_prefixes = None
 
     def is_empty(self):
         return len(self.ops) == 0
 
+    def is_commutative(self):
+        """
+        Determine if every op in this changeset is commutative, so the
+        changeset can be applied out of order.
+        """
+        for op in self.ops:
+            if not op.is_commutative():
+                return False
+        return True
+
     def get_parents(self):
         return self.parents[:]
 
@@ -66,28 +174,16 @@ class Changeset:
     def is_snapshot_cache(self):
         return self._is_snapshot_cache
 
-    def set_as_snapshot_cache(self, boolean=None):
-        # if not specified, this changeset should be randomly assigned
-        # to be a snapshot cache.
-        if boolean == None:
-            boolean = random.random() < 0.01
+    def set_as_snapshot_cache(self, boolean=True):
+        """
+        Mark if this changeset holds a snapshot cache. Which changesets do is
+        decided by the document's CheckpointPolicy. Unmarking it drops any
+        cached snapshot so the memory can be freed.
+        """
         self._is_snapshot_cache = boolean
-        if boolean:
-            self.snapshot_cache_is_valid = False
-
-    def set_as_ancestor_cache(self, boolean=None):
-        # if not specified, this changeset should be randomly assigned
-        # to be a cache. If it has multiple parents it should be far
-        # more likely to be a cache, in order to best reduce
-        # complexity. If it has one parent, low chance of being a
-        # cache
-        if boolean == None:
-            x = random.random()
-            boolean = True if len(self.get_parents()) > 1 else x < 0.1
-        self._is_ancestor_cache = boolean
-        if boolean:
-            self._has_valid_ancestor_cache = False
-            self.ancestor_cache = None
+        self.snapshot_cache_is_valid = False
+        if not boolean:
+            self.snapshot_cache = None
 
     def set_snapshot_cache(self, snapshot):
         self.snapshot_cache = snapshot
@@ -105,46 +201,106 @@ class Changeset:
         """
         Get a set of all this Changeset's ancestors back to the root changeset.
 
-        For changesets which hold caches of their ancestors, return it if it is
-        already set, and save it if it needs to be calculated.
-
         :returns: All ancestors of this changeset
         :rtype: set of :class:`Changesets`
         """
         if not self.has_full_dependency_info():
             raise Exception("Cannot get ancestor list without full dependency info.")
 
-        # just return the cache if able
-        if self._is_ancestor_cache and self._has_valid_ancestor_cache:
-            return self.ancestor_cache
-
-        # otherwise, recursively find all ancestors
         still_to_check = deque(self.parents)
         ancestors = set([])
         while still_to_check:
             cs = still_to_check.popleft()
+            if cs in ancestors:
+                continue
             ancestors.add(cs)
-            if cs._is_ancestor_cache and cs._has_valid_ancestor_cache:
-                ancestors.update(cs.get_ancestors())
-            else:
-                still_to_check.extend(cs.get_parents())
-
-        # make sure this list is full and accurate before cacheing it
-        if self._is_ancestor_cache:
-            self._has_valid_ancestor_cache = True
-            self.ancestor_cache = ancestors
+            still_to_check.extend(cs.get_parents())
         return ancestors
 
     def has_ancestor(self, ancestor):
+        """
+        Determine if ancestor is somewhere in this Changeset's history.
+
+        Once the full ancestry is known this is answered from the ancestry
+        index in constant time. Until then, walk up through the parents.
+        """
         if ancestor in self.parents:
             return True
-        if self._is_ancestor_cache and self.ancestor_cache != None:
-            return ancestor in self.get_ancestors()
+        if self._index_ancestry():
+            if not isinstance(ancestor, Changeset) or ancestor._chain is None:
+                return False
+            if ancestor._chain == self._chain:
+                return ancestor._chain_pos < self._chain_pos
+            return self._chain_reach.get(ancestor._chain, -1) >= \
+                ancestor._chain_pos
         for parent in self.parents:
-            if parent.has_ancestor(ancestor):
+            if isinstance(parent, Changeset) and parent.has_ancestor(ancestor):
                 return True
         return False
 
+    def _index_ancestry(self):
+        """
+        Make sure this Changeset, and all its ancestors, are in the ancestry
+        index. Returns False when that is not possible yet because some
+        ancestor is only known by id.
+
+        The index splits the dependency graph into chains. A changeset
+        continues the chain of its first parent which has no other child on
+        that chain yet, otherwise it starts a new chain. Each changeset
+        knows its chain, its position along the chain, and for every other
+        chain the highest position it can reach. Ancestry is then one
+        comparison. Changesets in a run along one chain share the same reach
+        dict, so a linear history costs almost nothing.
+        """
+        if self._chain is not None:
+            return True
+        to_index = [self]
+        while to_index:
+            cs = to_index[-1]
+            if cs._chain is not None:
+                to_index.pop()
+                continue
+            if not cs.has_full_dependency_info():
+                return False
+            unindexed = [p for p in cs.parents if p._chain is None]
+            if unindexed:
+                to_index.extend(unindexed)
+                continue
+            to_index.pop()
+            cs._add_to_ancestry_index()
+        return True
+
+    def _add_to_ancestry_index(self):
+        """
+        Place this Changeset in the ancestry index. All parents must already
+        be indexed.
+        """
+        chain_parent = None
+        for parent in self.parents:
+            if parent._is_chain_tail:
+                chain_parent = parent
+                break
+        if chain_parent:
+            chain_parent._is_chain_tail = False
+            self._chain = chain_parent._chain
+            self._chain_pos = chain_parent._chain_pos + 1
+        else:
+            self._chain = next(Changeset._chain_ids)
+            self._chain_pos = 0
+        self._is_chain_tail = True
+
+        if chain_parent and len(self.parents) == 1:
+            self._chain_reach = chain_parent._chain_reach
+            return
+        reach = {}
+        for parent in self.parents:
+            for chain, pos in parent._chain_reach.items():
+                if reach.get(chain, -1) < pos:
+                    reach[chain] = pos
+            if reach.get(parent._chain, -1) < parent._chain_pos:
+                reach[parent._chain] = parent._chain_pos
+        self._chain_reach = reach
+
     def has_full_dependency_info(self):
         """
         Determine if each dependency has all it's info, or if any of the
@@ -165,11 +321,12 @@ class Changeset:
                 dep_ids.append(dep.get_id())
             else:
                 dep_ids.append(dep)
+        dep_ids.extend(self.collected_parent_ids)
         dep_ids.sort()
         return dep_ids
 
     def get_ops(self):
-        return self.ops[:]
+        return self.t_ops[:]
 
     def get_doc_id(self):
         """
@@ -203,8 +360,24 @@ class Changeset:
             raise Exception("Can't add same op object multiple times.")
         op.set_changeset(self)
         self.ops.append(op)
+        self._path_shapes = None
+        self._path_prefixes = None
         return True
 
+    def compose_op(self, op):
+        """
+        Try to merge op into the last opperation of this changeset instead
+        of adding it. Like add_op, this can only be done before the
+        changeset is closed.
+
+        :returns: True if op was merged into the last opperation
+        """
+        if self.id_:
+            raise Exception("Can't add op. Changeset is already closed.")
+        if not self.ops:
+            return False
+        return self.ops[-1].compose(op)
+
     def relink_changesets(self, all_known_changesets):
         """
         From the dictionary of all_known_changesets, relink this
@@ -214,7 +387,7 @@ class Changeset:
         The given all_known_changesets is a dict, where keys are cs id
         strings, and values are {'obj':<cs object>, 'active':boolean}
         """
-        for parent in iter(self.parents):
+        for parent in self.parents[:]:
             if not isinstance(parent, Changeset):
                 if parent in all_known_changesets:
                     self.parents.remove(parent)
@@ -236,6 +409,45 @@ class Changeset:
                 self.parents.remove(parent)
                 break
 
+    def forget_collected_changesets(self, css):
+        """
+        The changesets in css were dropped when the document's history was
+        compacted. Stop linking to any of them as parents, but keep their ids
+        so this changeset's dependency ids do not change.
+        """
+        # index ancestry while the full history is still linked up
+        self._index_ancestry()
+        for parent in self.parents[:]:
+            if parent in css:
+                self.parents.remove(parent)
+                self.collected_parent_ids.append(parent.get_id())
+        self.dependencies = [dep for dep in self.dependencies
+                             if not dep in css]
+        self.hazard_holders = set([op for op in self.hazard_holders
+                                   if not op.get_changeset() in css])
+
+    def rebase_as_root(self, op):
+        """
+        Make this changeset the root of its document, after all the history
+        before it was compacted away. The given 'set' op, which sets the
+        snapshot as it was right after this changeset, replaces its ops, and
+        it no longer has any parents. It keeps its id, so it gets sent along
+        with its dict.
+        """
+        self._index_ancestry()
+        op.set_changeset(self)
+        self.ops = [op]
+        self.t_ops = self.ops
+        self._hazard_pieces = None
+        self.parents = []
+        self.dependencies = []
+        self.collected_parent_ids = []
+        self.preceding_changesets = ()
+        self.hazard_holders = set([])
+        self._path_shapes = None
+        self._path_prefixes = None
+        self._is_rebased_root = True
+
     def is_singly_linked_with_parent(self):
         parents = self.parents
         if len(parents) != 1:
@@ -249,8 +461,18 @@ class Changeset:
         """
         Sometimes the changesets could be calculated elsewhere. Just
         stick it in.
+
+        They are stored as a tuple. It is never changed in place, so
+        changesets with the same unaccounted changesets can share it instead
+        of each holding a copy.
         """
-        self.preceding_changesets = css
+        self.preceding_changesets = tuple(css)
+
+    def share_unaccounted_changesets(self, cs):
+        """
+        Use the same unaccounted changesets as cs, without copying them.
+        """
+        self.preceding_changesets = cs.preceding_changesets
 
     def get_unaccounted_changesets(self):
         """
@@ -259,7 +481,7 @@ class Changeset:
         """
         if self.preceding_changesets == None:
             raise Exception("Preceding Changesets not yet known")
-        return self.preceding_changesets[:]
+        return list(self.preceding_changesets)
 
     def add_to_unaccounted_changesets(self, cs, index, ordered_changesets):
         """
@@ -267,7 +489,8 @@ class Changeset:
         order, but it did not know about. The given cs is the
         changeset which was just inserted into the documents
         ordered_changesets, and for cnvenience, index is where it was
-        inserted. ordered_changeset is the doc's ordered_changest.
+        inserted. ordered_changeset is the doc's OrderedChangesets, which
+        can find the position of any changeset in O(log n).
 
         Determine where the given cs should go in this Changeset's
         ordered list of unaccounted changesets.
@@ -278,25 +501,28 @@ class Changeset:
         if len(self.get_parents()) == 1:
             parent = self.get_parents()[0]
             if len(parent.get_children()) == 1:
-                self.preceding_changesets = parent.get_unaccounted_changesets()
+                self.share_unaccounted_changesets(parent)
                 return
 
         # when the preceding changesets have not been calculated yet,
         # or is empty, just insert the changeset and return.
-        if self.preceding_changesets in [None, []]:
-            self.preceding_changesets = [cs]
+        if not self.preceding_changesets:
+            self.preceding_changesets = (cs,)
             return
-        i = index
-        preceding_css = set(self.preceding_changesets)
-        while i < len(ordered_changesets):
-            if ordered_changesets[i] == self:
-                self.preceding_changesets.append(cs)
-                break
-            if ordered_changesets[i] in preceding_css:
-                insertion_point = self.preceding_changesets.index(ordered_changesets[i])
-                self.preceding_changesets.insert(insertion_point, cs)
-                break
-            i += 1
+        # The preceding changesets are in the same order as the ordered
+        # changesets, so binary search for the first one which comes after
+        # the given cs. They may be shared, so build a new tuple rather than
+        # inserting in place.
+        preceding_css = self.preceding_changesets
+        low, high = 0, len(preceding_css)
+        while low < high:
+            mid = (low + high) // 2
+            if ordered_changesets.index(preceding_css[mid]) < index:
+                low = mid + 1
+            else:
+                high = mid
+        self.preceding_changesets = preceding_css[:low] + (cs,) + \
+            preceding_css[low:]
 
     def alert_preceding_changesets_of_deletion(self, conflict_op, self_op,
                                                val_shift):
@@ -322,17 +548,150 @@ class Changeset:
         determined. Loop through those, using them to transform this
         changeset.
         """
+        self.t_ops = self.ops
+        self._hazard_pieces = None
         for op in self.ops:
             op.reset_transformations()
         # those 'preceding_changesets' need to be used to transform
-        # this changeset's operations.
-        for pc in self.preceding_changesets:
-            for op in self.ops:
-                op.ot(pc)
+        # this changeset's operations. An op split off along the way comes
+        # right after the op it was split from, so it is transformed next.
+        for pc in self.get_relevant_unaccounted_changesets():
+            i = 0
+            while i < len(self.t_ops):
+                op = self.t_ops[i]
+                op.ot(pc, self._split_at.pop(op, None))
+                i += 1
+
+    def split_op(self, op, piece, past_op):
+        """
+        Transforming op by past_op split it in two. The piece split off is
+        applied right after op, and has already been transformed by past_op
+        and everything before it, so it is only transformed by what is left.
+        """
+        if self.t_ops is self.ops:
+            self.t_ops = self.ops[:]
+        piece.set_changeset(self)
+        self.t_ops.insert(self.t_ops.index(op) + 1, piece)
+        self._split_at[piece] = past_op
+
+    def add_hazard_piece(self, op, piece, conflict_cs):
+        """
+        Transforming conflict_cs by op needs op to be two ops for anything
+        which knows about conflict_cs. The piece is that second op. It is a
+        noop, so the document never sees it, and conflict_cs gives it hazards
+        making it what those ops need. It is dropped when conflict_cs is
+        transformed again.
+        """
+        if self.t_ops is self.ops:
+            self.t_ops = self.ops[:]
+        if self._hazard_pieces is None:
+            self._hazard_pieces = {}
+        piece.set_changeset(self)
+        piece.noop = True
+        self.t_ops.insert(self.t_ops.index(op) + 1, piece)
+        self._hazard_pieces[piece] = conflict_cs
+
+    def remove_hazard_pieces(self, css):
+        """
+        Drop the hazard pieces added while transforming the changesets in
+        css. See add_hazard_piece.
+        """
+        if not self._hazard_pieces:
+            return
+        for piece, conflict_cs in self._hazard_pieces.items():
+            if conflict_cs in css:
+                self.t_ops.remove(piece)
+                del self._hazard_pieces[piece]
+
+    def get_relevant_unaccounted_changesets(self):
+        """
+        Get the unaccounted changesets whose paths are not disjoint from this
+        changeset's, in order. Only those can transform this changeset.
+
+        A long run of unaccounted changesets, like a branch which diverged
+        while a client was offline, gets a BranchIndex. Every changeset
+        along one branch shares its unaccounted changesets tuple, and the
+        index is looked up by that tuple, so it is built once for the whole
+        branch.
+        """
+        pcs = self.preceding_changesets
+        if len(pcs) >= BranchIndex.MIN_CHANGESETS:
+            return BranchIndex.get_index(pcs).find_changesets(self)
+        return [pc for pc in pcs if not self.paths_are_disjoint(pc)]
+
+    def get_path_shapes(self, past=False):
+        """
+        Get the shapes of the paths (and string move destinations) of this
+        changeset's ops. A shape is the path as a tuple, with every array
+        index replaced by None. Transforming only ever shifts array indexes,
+        so the shape of an op's path never changes. Every transformation
+        first checks that one op's path starts with the other's, which can
+        only happen if one shape starts with the other.
+
+        With past set, leave out the commutative ops, which never transform
+        a future op.
+        """
+        if self._path_shapes is None:
+            summaries = []
+            for ops in [self.ops,
+                        [op for op in self.ops if not op.is_commutative()]]:
+                shapes = set()
+                for op in ops:
+                    shapes.add(get_path_shape(op.path))
+                    if op.dest_path is not None:
+                        shapes.add(get_path_shape(op.dest_path))
+                prefixes = set()
+                for shape in shapes:
+                    for i in xrange(len(shape) + 1):
+                        prefixes.add(shape[:i])
+                summaries.append((shapes, prefixes))
+            # indexed by past
+            self._path_shapes = (summaries[0][0], summaries[1][0])
+            self._path_prefixes = (summaries[0][1], summaries[1][1])
+        return self._path_shapes[past]
+
+    def get_path_prefixes(self, past=False):
+        """
+        Get every prefix of this changeset's path shapes, including the
+        shapes themselves.
+        """
+        self.get_path_shapes()
+        return self._path_prefixes[past]
+
+    def paths_are_disjoint(self, cs):
+        """
+        Determine if no op in cs could ever transform an op in this
+        changeset, or be changed by transforming it, because neither
+        touches a path leading to anything the other touches.
+        """
+        shapes = self.get_path_shapes()
+        other_shapes = cs.get_path_shapes(past=True)
+        prefixes = self.get_path_prefixes()
+        other_prefixes = cs.get_path_prefixes(past=True)
+        for shape in shapes:
+            if shape in other_prefixes:
+                return False
+        for shape in other_shapes:
+            if shape in prefixes:
+                return False
+        return True
 
     def remove_old_hazards(self, css):
-        for op in self.ops:
+        for op in self.t_ops:
             op.remove_old_hazards(css)
+        self.remove_hazard_pieces(css)
+
+    def add_hazard_holder(self, op):
+        self.hazard_holders.add(op)
+
+    def pop_hazard_holders(self):
+        """
+        Get the ops holding hazards or deletion edges made while transforming
+        this changeset, and forget them.
+        """
+        holders = self.hazard_holders
+        self.hazard_holders = set([])
+        return holders
 
     def to_jsonable(self):
         """
@@ -358,6 +717,9 @@ class Changeset:
              'user': self.user,
              'dep_ids': self.get_dependency_ids(),
              'ops': [op.to_dict() for op in self.ops]}
+        # the id of a rebased root can't be worked out from its new ops
+        if self._is_rebased_root:
+            d['id'] = self.get_id()
         return d
 
     def get_id(self):
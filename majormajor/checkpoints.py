@@ -0,0 +1,230 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+
+
+DEFAULT_MEMORY_BUDGET = 32 * 1024 * 1024
+
+
+def estimate_size(data):
+    """
+    Roughly estimate how many bytes a snapshot, or part of one, takes up. This
+    does not need to be accurate, it only needs to grow with the data so
+    checkpoints can be compared against a memory budget.
+    """
+    if isinstance(data, dict):
+        return 64 + sum(estimate_size(k) + estimate_size(v)
+                        for k, v in data.items())
+    if isinstance(data, list):
+        return 64 + sum(estimate_size(v) for v in data)
+    if isinstance(data, basestring):
+        return 40 + len(data)
+    return 24
+
+
+def estimate_op_work(op):
+    """
+    Roughly estimate how much work replaying the given Op costs. Ops which
+    carry data (inserts and sets) cost about as much as that data.
+    """
+    if op.t_action in ['si', 'ai', 'oi', 'set']:
+        return estimate_size(op.t_val)
+    return 24
+
+
+class CheckpointPolicy(object):
+    """
+    Decides which changesets hold snapshot checkpoints, and keeps the memory
+    those checkpoints use within a budget.
+
+    While a Document replays ops to rebuild its snapshot, after each changeset
+    it asks the policy if that changeset should hold a copy of the snapshot.
+    When the snapshot is rebuilt later, replaying can start from the nearest
+    checkpoint instead of from the root. This base policy never asks for new
+    checkpoints. Subclasses decide where checkpoints go by overriding
+    wants_checkpoint and keep_checkpoint.
+
+    Once the checkpoints take up more than memory_budget, the least recently
+    used ones are dropped. Each Document needs its own policy instance.
+    """
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        # changeset -> (size, index), in least recently used order
+        self.checkpoints = OrderedDict()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.ops_since_checkpoint = 0
+        self.work_since_checkpoint = 0
+
+    def replayed(self, cs):
+        """
+        Record that the ops in cs were just applied to the snapshot.
+        """
+        for op in cs.get_ops():
+            self.ops_since_checkpoint += 1
+            self.work_since_checkpoint += estimate_op_work(op)
+
+    def wants_checkpoint(self, index, head_index):
+        """
+        Determine if the changeset at index should hold a checkpoint of the
+        snapshot as it is right after that changeset was replayed.
+
+        :param index: Index of the changeset in the ordered changesets
+        :param head_index: Index of the last ordered changeset
+        :rtype: bool
+        """
+        return False
+
+    def keep_checkpoint(self, index, head_index):
+        """
+        Determine if an existing checkpoint at index is still worth keeping
+        now that the last ordered changeset is at head_index.
+        """
+        return True
+
+    def get_checkpoints(self):
+        """
+        Get the changesets holding checkpoints, least recently used first.
+        """
+        return list(self.checkpoints.keys())
+
+    def save(self, cs, snapshot, index, head_index, size=None):
+        """
+        Store the snapshot in cs, then drop any checkpoints which are no
+        longer wanted or which do not fit in the memory budget. The snapshot
+        must be a copy nothing else changes, like one from
+        Snapshot.get_snapshot_copy. When size is not given, it is estimated
+        from the whole snapshot.
+        """
+        self.discard(cs)
+        if size is None:
+            size = estimate_size(snapshot)
+        cs.set_as_snapshot_cache(True)
+        cs.set_snapshot_cache(snapshot)
+        cs.set_snapshot_cache_is_valid(True)
+        self.checkpoints[cs] = (size, index)
+        self.memory_used += size
+        self.reset_counters()
+        self.prune(head_index)
+        self.evict(keep=cs)
+
+    def restore(self, cs):
+        """
+        Get the snapshot held by cs, to replay from. It must not be changed,
+        so hand it to Snapshot.set_snapshot_copy.
+        """
+        if cs in self.checkpoints:
+            self.checkpoints[cs] = self.checkpoints.pop(cs)
+        self.reset_counters()
+        return cs.get_snapshot_cache()
+
+    def peek(self, cs):
+        """
+        Get the snapshot held by cs without counting it as used, for reading
+        an old snapshot outside of a rebuild. Like restore, it must not be
+        changed.
+        """
+        return cs.get_snapshot_cache()
+
+    def discard(self, cs):
+        """
+        Drop the checkpoint held by cs, if any.
+        """
+        if cs in self.checkpoints:
+            size, index = self.checkpoints.pop(cs)
+            self.memory_used -= size
+        if cs.is_snapshot_cache():
+            cs.set_as_snapshot_cache(False)
+
+    def shift(self, offset):
+        """
+        offset changesets were dropped from the start of the ordered
+        changesets, so move the remembered indexes back to match.
+        """
+        for cs, (size, index) in list(self.checkpoints.items()):
+            self.checkpoints[cs] = (size, index - offset)
+
+    def prune(self, head_index):
+        for cs, (size, index) in list(self.checkpoints.items()):
+            if not self.keep_checkpoint(index, head_index):
+                self.discard(cs)
+
+    def evict(self, keep=None):
+        """
+        Drop least recently used checkpoints until they fit within the memory
+        budget. The checkpoint held by keep is never dropped.
+        """
+        if self.memory_budget is None:
+            return
+        for cs in list(self.checkpoints.keys()):
+            if self.memory_used <= self.memory_budget:
+                break
+            if cs is not keep:
+                self.discard(cs)
+
+
+class EveryNOpsCheckpointPolicy(CheckpointPolicy):
+    """
+    Checkpoint once at least n ops have been replayed since the last
+    checkpoint.
+    """
+    def __init__(self, n=100, memory_budget=DEFAULT_MEMORY_BUDGET):
+        CheckpointPolicy.__init__(self, memory_budget)
+        self.n = n
+
+    def wants_checkpoint(self, index, head_index):
+        return self.ops_since_checkpoint >= self.n
+
+
+class ReplayWorkCheckpointPolicy(CheckpointPolicy):
+    """
+    Checkpoint once roughly k bytes worth of ops have been replayed since the
+    last checkpoint.
+    """
+    def __init__(self, k=64 * 1024, memory_budget=DEFAULT_MEMORY_BUDGET):
+        CheckpointPolicy.__init__(self, memory_budget)
+        self.k = k
+
+    def wants_checkpoint(self, index, head_index):
+        return self.work_since_checkpoint >= self.k
+
+
+class LogSpacedCheckpointPolicy(CheckpointPolicy):
+    """
+    Keep checkpoints dense near the head and sparse further back. Changesets
+    within 2 * spacing of the head are checkpointed every spacing
+    changesets. Further back the gap doubles each time the distance to the
+    head doubles, so there are only a logarithmic number of checkpoints.
+
+    Indexes are remembered from when each checkpoint was saved, so spacing is
+    approximate once changesets get inserted before them.
+    """
+    def __init__(self, spacing=16, memory_budget=DEFAULT_MEMORY_BUDGET):
+        CheckpointPolicy.__init__(self, memory_budget)
+        self.spacing = spacing
+
+    def get_step(self, distance):
+        n = max(distance, 0) // self.spacing
+        return self.spacing << max(n.bit_length() - 1, 0)
+
+    def wants_checkpoint(self, index, head_index):
+        return index > 0 and index % self.get_step(head_index - index) == 0
+
+    def keep_checkpoint(self, index, head_index):
+        return self.wants_checkpoint(index, head_index)
@@ -15,12 +15,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import difflib
-import random
 import uuid
+from collections import deque
 from datetime import datetime
 
 from .changeset import Changeset
+from .checkpoints import EveryNOpsCheckpointPolicy
 from .ops.op import Op
+from .op_columns import OpColumns
+from .ordered_changesets import OrderedChangesets
 from .snapshot import Snapshot
 from .utils import build_changeset_from_dict
 
@@ -29,18 +32,42 @@ class Document:
 
     # Each document needs an ID so that changesets can be associated
     # with it. If one is not supplied, make a random 5 character ID at
-    # start
-    def __init__(self, id_=None, user=None, snapshot=None):
+    # start. Snapshot checkpoints are placed by the given CheckpointPolicy, or
+    # every 100 ops if none is given. With persistent_snapshot, checkpoints
+    # share unchanged data with the snapshot instead of copying all of it.
+    def __init__(self, id_=None, user=None, snapshot=None,
+                 checkpoint_policy=None, persistent_snapshot=False):
         self.id_ = id_ if id_ else uuid.uuid4()
         self.user = user if user else str(uuid.uuid4())
-        self.ordered_changesets = []
-        self.ordered_changesets_set_cache = set([])
+        self.checkpoint_policy = checkpoint_policy if checkpoint_policy \
+            else EveryNOpsCheckpointPolicy()
+        self.ordered_changesets = OrderedChangesets()
         self.all_known_changesets = {}
         self.missing_changesets = set([])
         self.send_queue = []
         self.pending_new_changesets = []
+        # Index of the pending changesets. For each changeset id, the pending
+        # changesets waiting on it, and for each pending changeset, how many
+        # of its parents are not yet in ordered_changesets. Changesets which
+        # are not waiting on anything are queued up in ready_changesets.
+        self.pending_waiting_on = {}
+        self.pending_unmet_counts = {}
+        self.ready_changesets = deque()
+        # The dependency ids each peer last reported, by user id, the ids of
+        # changesets dropped by compact_history, and the ids of changesets
+        # rejected for being built on dropped changesets.
+        self.peer_dependencies = {}
+        self.collected_changeset_ids = set([])
+        self.stale_changeset_ids = set([])
+        # Column oriented copy of the ordered ops, made when first asked for,
+        # and which ordered changesets it needs to redo from.
+        self.op_columns = None
+        self.op_columns_stale_from = 0
+        # How pulling in pending changesets changed the snapshot, while
+        # pull_change_events is collecting it.
+        self.change_events = None
         self.open_changeset = None
-        self.snapshot = Snapshot()
+        self.snapshot = Snapshot(persistent_snapshot)
         self.root_changeset = None
         self.dependencies = []
         # set initial snapshot if called upon
@@ -74,7 +101,7 @@ class Document:
 
         :returns: List of ordered, active changesets
         """
-        return self.ordered_changesets[:]
+        return list(self.ordered_changesets)
 
     def get_dependencies(self):
         """
@@ -166,7 +193,7 @@ class Document:
         return self.time_of_last_received_cs
 
     def get_changesets_in_ranges(self, start_ids, end_ids):
-        return self.ordered_changesets[:]
+        return list(self.ordered_changesets)
         cs_in_range = []
         start_reached = False if start_ids else True
         for cs in self.ordered_changesets:
@@ -206,6 +233,41 @@ class Document:
         """
         return self.snapshot.get_snapshot()
 
+    def get_snapshot_copy(self):
+        """
+        Get a copy of the document data which later changes to the document
+        do not touch. It must not be changed itself.
+        """
+        return self.snapshot.get_snapshot_copy()
+
+    def get_op_columns(self):
+        """
+        Get an OpColumns holding every op in the ordered changesets, brought
+        up to date with any changes since it was last asked for.
+        """
+        columns = self.op_columns
+        if columns is None or columns.source is not self.ordered_changesets:
+            columns = OpColumns(self.ordered_changesets)
+            self.op_columns = columns
+            self.op_columns_stale_from = 0
+        columns.refresh(self.op_columns_stale_from)
+        self.op_columns_stale_from = len(self.ordered_changesets)
+        return columns
+
+    def shift_positions(self, positions, cs):
+        """
+        Bring positions in strings, like the cursors of other users, up to
+        date. positions maps each string's path, as a tuple, to the
+        positions in it as they were right after the ordered changeset cs.
+        Returns the same mapping, with each position moved through every op
+        ordered after cs.
+        """
+        columns = self.get_op_columns()
+        index = self.ordered_changesets.index(cs)
+        start = columns.get_changeset_rows(index)[1]
+        return dict((path, columns.shift_positions(path, p, start))
+                    for path, p in positions.items())
+
     def get_changesets(self):
         return self.changesets
 
@@ -226,11 +288,139 @@ class Document:
 
         """
         request_css = [dep for dep in remote_dep_ids
-                       if not self.knows_changeset(dep)]
+                       if not self.knows_changeset(dep) and
+                       not dep in self.collected_changeset_ids and
+                       not dep in self.stale_changeset_ids]
         send_css = [cs for cs in self.dependencies
                     if not cs.get_id() in remote_dep_ids]
         return request_css, send_css
 
+    def set_peer_dependencies(self, user_id, dep_ids):
+        """
+        Record the dependency ids a remote user reported for their copy of
+        this document. Everything up to those changesets is acknowledged by
+        that user, which compact_history uses to decide what history is safe
+        to drop.
+        """
+        self.peer_dependencies[user_id] = list(dep_ids)
+
+    def has_peer_dependencies(self):
+        """
+        Check if any remote user has reported their dependencies yet.
+        """
+        return bool(self.peer_dependencies)
+
+    def depends_on_collected_history(self, cs):
+        """
+        Check if cs has a parent which compact_history dropped, or which was
+        itself rejected for that. Such a changeset was made by a peer who
+        had not acknowledged the frontier, and is concurrent with history
+        which is gone, so it can never be transformed.
+        """
+        for dep in cs.get_parents():
+            if not isinstance(dep, Changeset) and \
+                    (dep in self.collected_changeset_ids or
+                     dep in self.stale_changeset_ids):
+                return True
+        return False
+
+    def get_stable_frontier(self, peer_ids=None):
+        """
+        Find the newest changeset which history can be compacted up to.
+
+        It must be known by this document and every peer, so every
+        dependency of this document and every peer's reported dependency
+        must be it or descend from it. It must also split the ordered
+        changesets in two. Every changeset before it is its ancestor, so it
+        has no unaccounted changesets, and every changeset after it descends
+        from it, so none of them have anything before it as an unaccounted
+        changeset. Nothing after it ever needs the changesets before it for
+        OT.
+
+        Every user which has ever reported dependencies must have
+        acknowledged it, even one which is no longer connected, since it can
+        still send changesets built on anything it has acknowledged.
+
+        :param peer_ids: Other users which must have acknowledged the
+            frontier, such as connected users which have not reported yet.
+        :returns: The frontier Changeset, or None if there is none, or the
+            state of some peer is not known.
+        """
+        if self.pending_new_changesets:
+            return None
+        peer_ids = set(self.peer_dependencies.keys()).union(peer_ids or [])
+        heads = self.get_dependencies()
+        for peer_id in peer_ids:
+            if not peer_id in self.peer_dependencies:
+                return None
+            for dep_id in self.peer_dependencies[peer_id]:
+                dep = self.get_changeset_by_id(dep_id)
+                if dep is None or not dep in self.ordered_changesets:
+                    return None
+                heads.append(dep)
+
+        # walk back from the newest changeset, collecting every changeset
+        # which comes after the candidate but does not know about it.
+        ocs = self.ordered_changesets
+        unaccounted_by_later = set([])
+        seen = set([])
+        for cs in ocs.iter_reversed_from(len(ocs) - 1):
+            if cs is self.root_changeset:
+                return None
+            if not cs in unaccounted_by_later and \
+                    not cs.get_unaccounted_changesets() and \
+                    all(h is cs or h.has_ancestor(cs) for h in heads):
+                return cs
+            # changesets often share their unaccounted changesets
+            if not id(cs.preceding_changesets) in seen:
+                seen.add(id(cs.preceding_changesets))
+                unaccounted_by_later.update(cs.preceding_changesets)
+        return None
+
+    def compact_history(self, peer_ids=None):
+        """
+        Drop all history before the stable frontier (see
+        get_stable_frontier), and rebase the document on the frontier.
+
+        The frontier becomes the new root changeset. Like the root made by
+        set_initial_snapshot, its only op sets the snapshot, which is the
+        snapshot as it was right after the frontier. Every changeset before
+        it, with all their ops, hazards and snapshot caches, is forgotten.
+        Changesets after it are untouched, so no OT needs to be redone.
+
+        A user which never reported its dependencies may still send
+        changesets built on the dropped history. Those can't be transformed,
+        so receive_changeset rejects them, along with any changeset built on
+        them, and that user needs to load the document again.
+
+        :param peer_ids: Other users which must have acknowledged the
+            frontier, besides every user with reported dependencies.
+        :returns: If any history was dropped
+        :rtype: bool
+        """
+        frontier = self.get_stable_frontier(peer_ids)
+        if frontier is None:
+            return False
+        index = self.ordered_changesets.index(frontier)
+        snapshot = self.get_snapshot_at(index)
+
+        collected_css = set(self.ordered_changesets[:index])
+        policy = self.checkpoint_policy
+        for cs in collected_css:
+            del self.all_known_changesets[cs.get_id()]
+            self.collected_changeset_ids.add(cs.get_id())
+            policy.discard(cs)
+        policy.discard(frontier)
+        policy.shift(index)
+
+        self.ordered_changesets = OrderedChangesets(
+            self.ordered_changesets.iter_from(index))
+        for cs in self.ordered_changesets.iter_from(1):
+            cs.forget_collected_changesets(collected_css)
+        frontier.rebase_as_root(Op('set', [], val=snapshot))
+        self.root_changeset = frontier
+        return True
+
     def request_ancestors(self, cs_ids, dep_ids):
         """
         Return a list of Changesets (given by cs_ids) and some number of their
@@ -250,7 +440,7 @@ class Document:
         MAX_CHANGESETS = 100
         for dep_id in dep_ids:
             dep = self.get_changeset_by_id(dep_id)
-            if dep and dep in self.ordered_changesets_set_cache:
+            if dep and dep in self.ordered_changesets:
                 css = dep.get_children()
                 while css and len(response_css) < MAX_CHANGESETS:
                     cs = css.pop()
@@ -290,8 +480,7 @@ class Document:
         cs = self.close_changeset()
         self.clear_send_queue()
         self.root_changeset = cs
-        self.ordered_changesets = [cs]
-        self.ordered_changesets_set_cache = set([cs])
+        self.ordered_changesets = OrderedChangesets([cs])
 
     def set_snapshot(self, snapshot, deps):
         """
@@ -338,15 +527,17 @@ class Document:
 
         If there is no open changeset, one will be opened with correct
         dependencies and the given op. If a changeset is already started, the
-        given op is just added on. The given op is then immediatly applied to
-        this Document.
+        given op is just added on, or when it continues the last op (like
+        typing or backspacing a run of characters), merged into that op. The
+        given op is then immediatly applied to this Document.
 
         :param op: the locally created Op to apply to this Document
         """
         if self.open_changeset is None:
             self.open_changeset = Changeset(self.id_, self.user,
                                             self.get_dependencies())
-        self.open_changeset.add_op(op)
+        if not self.open_changeset.compose_op(op):
+            self.open_changeset.add_op(op)
         self.apply_op(op)
 
     def close_changeset(self):
@@ -374,22 +565,157 @@ class Document:
         cs = self.open_changeset
         self.add_to_known_changesets(cs)
         self.ordered_changesets.append(cs)
-        self.ordered_changesets_set_cache.update([cs])
         self.open_changeset = None
         cs.set_unaccounted_changesets([])
-        if cs._is_ancestor_cache:
-            cs.get_ancestors()
         # clean out old dependencies, since this should be the only
         # one now
         self.dependencies = [cs]
         self.send_queue.append(cs)
-        # randomly select if if this changeset should be a cache
-        if random.random() < 0.1:
-            cs.set_as_snapshot_cache(True)
-            cs.set_snapshot_cache(self.snapshot.get_snapshot_copy())
-            cs.set_snapshot_cache_is_valid(True)
+        self.wake_pending_changesets(cs)
+        # the local ops were already applied
+        index = len(self.ordered_changesets) - 1
+        self.op_columns_stale_from = min(self.op_columns_stale_from, index)
+        self.checkpoint_last_changeset(cs, index)
         return cs
 
+    def checkpoint_last_changeset(self, cs, index):
+        """
+        The last ordered changeset, cs at index, was just applied to the
+        snapshot, so let the checkpoint policy decide if this snapshot should
+        be cached.
+        """
+        policy = self.checkpoint_policy
+        policy.replayed(cs)
+        if index > 0 and policy.wants_checkpoint(index, index):
+            policy.save(cs, self.snapshot.get_snapshot_copy(), index, index,
+                        self.snapshot.get_copy_size())
+
+    def can_fast_forward(self, cs):
+        """
+        Determine if cs builds on exactly this document's current state. Its
+        parents are all of the dependencies, so every ordered changeset is one
+        of its ancestors and it has nothing to be transformed against.
+        """
+        if self.open_changeset:
+            return False
+        parents = cs.get_parents()
+        return len(parents) == len(self.dependencies) and \
+            set(parents) == set(self.dependencies)
+
+    def fast_forward_changeset(self, cs):
+        """
+        Add a pending changeset for which can_fast_forward is True. It goes
+        at the end of the ordered changesets and its ops apply straight to
+        the snapshot, without OT of any other changeset or a rebuild.
+        """
+        self.pending_unmet_counts.pop(cs, None)
+        index = len(self.ordered_changesets)
+        self.ordered_changesets.append(cs)
+        cs.set_unaccounted_changesets([])
+        self.dependencies = [cs]
+        # only resets its ops, in case they were transformed before
+        self.ot(index)
+        self.apply_changeset_ops(cs)
+        self.wake_pending_changesets(cs)
+        self.checkpoint_last_changeset(cs, index)
+
+    def can_apply_out_of_order(self, cs, index):
+        """
+        Determine if cs, which was just inserted at index, can be applied
+        straight to the snapshot. Every op in it must be commutative, and no
+        later changeset may touch the paths leading to its values, so its
+        ops land in the same place at the end as they would at index.
+        """
+        if not cs.is_commutative():
+            return False
+        for later_cs in self.ordered_changesets.iter_from(index + 1):
+            if not cs.paths_are_disjoint(later_cs):
+                return False
+        return True
+
+    def apply_out_of_order(self, cs, index):
+        """
+        Transform and apply cs, for which can_apply_out_of_order is True.
+        Commutative ops never transform anything, so the changesets after it
+        keep their transformations, and the snapshot is not rebuilt.
+        """
+        self.op_columns_stale_from = min(self.op_columns_stale_from, index)
+        cs.ot()
+        self.apply_changeset_ops(cs)
+        # snapshot caches from index onwards are missing cs
+        for later_cs in self.ordered_changesets.iter_from(index):
+            if later_cs.is_snapshot_cache():
+                later_cs.set_snapshot_cache_is_valid(False)
+
+    def apply_changeset_ops(self, cs):
+        """
+        Apply the transformed ops of cs straight to the snapshot. While change
+        events are being collected, each op is one.
+        """
+        for op in cs.get_ops():
+            applied = self.snapshot.apply_op(op) is None
+            if applied and self.change_events is not None and \
+                    not op.is_noop():
+                self.change_events.append(op.to_change_event())
+
+    def transform_and_rebuild(self, index, activated):
+        """
+        Transform the ordered changesets from index on and rebuild the
+        snapshot from there, after the changesets in activated were inserted.
+        While change events are being collected, the ops from index on are
+        compared as they were applied before and as they are now, so only the
+        parts of the snapshot they touch are looked at.
+        """
+        if self.change_events is None:
+            self.ot(index)
+            self.rebuild_snapshot(index)
+            return
+        s = self.snapshot
+        old_events = self.get_change_events_from(index, activated)
+        self.ot(index)
+        new_events = self.get_change_events_from(index)
+        old_lengths = s.get_lengths([event[1] for event in
+                                     old_events + new_events])
+        old_values = s.get_key_values(old_events + new_events)
+        if self.rebuild_snapshot(index):
+            # the lengths cannot be worked out from the ops
+            old_lengths = None
+        self.change_events.extend(
+            s.get_change_events(old_events, new_events, old_lengths,
+                                old_values))
+
+    def get_change_events_from(self, index, skip=()):
+        """
+        Get the change events of the ops in the ordered changesets from index
+        on, leaving out noops and the changesets in skip.
+        """
+        return [op.to_change_event()
+                for cs in self.ordered_changesets.iter_from(index)
+                if not cs in skip
+                for op in cs.get_ops() if not op.is_noop()]
+
+    def pull_change_events(self):
+        """
+        Incorporate pending changesets like pull_from_pending_list, and get
+        how that changed the snapshot, as a list of change events (see
+        Op.to_change_event). Applying them in order to the snapshot from
+        before gives the snapshot now. Returns None if nothing changed.
+
+        The events come from the transformed ops themselves, so getting them
+        takes time in proportion to the changes, not to the document.
+        """
+        if not self.ready_changesets:
+            # nothing to pull in
+            self.close_changeset()
+            return None
+        self.change_events = []
+        try:
+            was_changed = self.pull_from_pending_list()
+            events = self.change_events
+        finally:
+            self.change_events = None
+        return events if was_changed else None
+
     def receive_changesets(self, css):
         for cs in css:
             self.receive_changeset(cs)
@@ -405,13 +731,20 @@ class Document:
 
         if self.knows_changeset(cs.get_id()):
             return False
+        # already compacted away
+        if cs.get_id() in self.collected_changeset_ids:
+            return False
+        # built on history which was compacted away. See compact_history.
+        if self.depends_on_collected_history(cs):
+            self.stale_changeset_ids.add(cs.get_id())
+            return False
 
         self.add_to_known_changesets(cs)
 
         if cs.get_id() in self.missing_changesets:
             self.missing_changesets.remove(cs.get_id())
 
-        self.pending_new_changesets.append(cs)
+        self.add_to_pending_changesets(cs)
         dep_ids = self.get_missing_dependency_ids(cs)
         self.missing_changesets.update(dep_ids)
 
@@ -433,11 +766,6 @@ class Document:
         changesets.
         """
 
-        # this is the first time a changeset's ancestors can be
-        # accuratly determined, so cache it if need be.
-        if cs._is_ancestor_cache:
-            cs.get_ancestors()
-
         index = self.insert_changeset_into_ordered_list(cs)
         self.update_unaccounted_changesets(cs, index=index)
 
@@ -448,42 +776,122 @@ class Document:
         self.dependencies.append(cs)
         return index
 
+    def add_to_pending_changesets(self, cs):
+        """
+        Put cs in the list of pending changesets, and index it by each parent
+        which is not yet in the ordered changesets. If it is not waiting on
+        any parent, it is ready to be activated.
+        """
+        self.pending_new_changesets.append(cs)
+        unmet = 0
+        for parent in cs.get_parents():
+            if parent in self.ordered_changesets:
+                continue
+            p_id = parent.get_id() if isinstance(parent, Changeset) \
+                else parent
+            self.pending_waiting_on.setdefault(p_id, []).append(cs)
+            unmet += 1
+        self.pending_unmet_counts[cs] = unmet
+        if unmet == 0:
+            self.ready_changesets.append(cs)
+
+    def set_pending_changesets(self, css):
+        """
+        Replace the pending changesets with css and rebuild their index.
+        """
+        self.pending_new_changesets = []
+        self.pending_waiting_on = {}
+        self.pending_unmet_counts = {}
+        self.ready_changesets = deque()
+        for cs in css:
+            self.add_to_pending_changesets(cs)
+
+    def wake_pending_changesets(self, cs):
+        """
+        cs was just put into the ordered changesets. Any pending changesets
+        waiting on it have one less unmet parent, and those with none left
+        are ready.
+        """
+        for waiting_cs in self.pending_waiting_on.pop(cs.get_id(), []):
+            if not waiting_cs in self.pending_unmet_counts:
+                continue
+            self.pending_unmet_counts[waiting_cs] -= 1
+            if self.pending_unmet_counts[waiting_cs] == 0:
+                self.ready_changesets.append(waiting_cs)
+
     def pull_from_pending_list(self, cs=None):
         """
-        Go through the list of pending changesets and try again to
-        incorporatet them into this document. As long as the list of
-        pending changests shrinks, it loops through again.
+        Incorporate every pending changeset whose parents are all in the
+        ordered changesets. Activating a changeset wakes up the pending
+        changesets waiting on it, so changesets get pulled in topological
+        order without rescanning the whole pending list.
+
+        When cs is given, only try to incorporate that changeset.
         """
         self.close_changeset()
         # keep track of lowest index for start point for ot
         index = len(self.ordered_changesets)
-        one_inserted = False
+        activated = set([])
+        # fast forwarded, or applied out of order
+        applied = set([])
 
         if cs:
             if not self.has_needed_dependencies(cs):
                 return False
-            i = self.activate_changeset_in_document(cs)
+            if self.can_fast_forward(cs):
+                self.fast_forward_changeset(cs)
+                self.pending_new_changesets.remove(cs)
+                return True
+            i = self.activate_pending_changeset(cs)
             self.pending_new_changesets.remove(cs)
-            self.ot(i)
-            self.rebuild_snapshot()
+            if self.can_apply_out_of_order(cs, i):
+                self.apply_out_of_order(cs, i)
+                return True
+            self.transform_and_rebuild(i, set([cs]))
             return True
 
-        l = -1  # flag for when looping is done
-        while not l == len(self.pending_new_changesets):
-            l = len(self.pending_new_changesets)
-            for cs in iter(self.pending_new_changesets):
-                if self.has_needed_dependencies(cs):
-                    i = self.activate_changeset_in_document(cs)
-                    index = min(i, index)
-                    self.pending_new_changesets.remove(cs)
-                    one_inserted = True
-        if not one_inserted:
+        while self.ready_changesets:
+            cs = self.ready_changesets.popleft()
+            if not cs in self.pending_unmet_counts:
+                continue
+            # parents which were only known by id are known now
+            cs.relink_changesets(self.all_known_changesets)
+            # until some changeset needs OT, each one can be fast forwarded
+            if not activated and self.can_fast_forward(cs):
+                self.fast_forward_changeset(cs)
+                applied.add(cs)
+                index = len(self.ordered_changesets)
+                continue
+            i = self.activate_pending_changeset(cs)
+            if not activated and self.can_apply_out_of_order(cs, i):
+                self.apply_out_of_order(cs, i)
+                applied.add(cs)
+                index = len(self.ordered_changesets)
+                continue
+            index = min(i, index)
+            activated.add(cs)
+        if not activated and not applied:
             return False
 
-        self.ot(index)
-        self.rebuild_snapshot()
+        self.pending_new_changesets = [pcs for pcs in
+                                       self.pending_new_changesets
+                                       if not (pcs in activated or
+                                               pcs in applied)]
+        if activated:
+            self.transform_and_rebuild(index, activated)
         return True
 
+    def activate_pending_changeset(self, cs):
+        """
+        Activate a pending changeset in this document, then wake up the
+        pending changesets waiting on it. Returns the index it was inserted
+        at.
+        """
+        self.pending_unmet_counts.pop(cs, None)
+        i = self.activate_changeset_in_document(cs)
+        self.wake_pending_changesets(cs)
+        return i
+
     def rebuild_historical_document(self, css):
         self.dependencies = [self.root_changeset]
         keep_css = set(css)
@@ -498,11 +906,10 @@ class Document:
             if cs in keep_css:
                 hold_css.remove(cs)
 
-        self.pending_new_changesets = list(keep_css)
-        self.ordered_changesets = [self.root_changeset]
-        self.ordered_changesets_set_cache = set([self.root_changeset])
+        self.ordered_changesets = OrderedChangesets([self.root_changeset])
+        self.set_pending_changesets(list(keep_css))
         self.pull_from_pending_list()
-        self.pending_new_changesets = list(hold_css)
+        self.set_pending_changesets(list(hold_css))
         self.ot()
         self.rebuild_snapshot()
 
@@ -521,8 +928,8 @@ class Document:
 
         self.set_snapshot(snapshot, new_css)
         if [self.root_changeset] == self.dependencies:
-            self.ordered_changesets = [self.root_changeset]
-            self.ordered_changesets_set_cache = set([self.root_changeset])
+            self.ordered_changesets = OrderedChangesets([self.root_changeset])
+            self.set_pending_changesets(self.pending_new_changesets)
 
     def receive_history(self, cs_dicts):
         for cs in cs_dicts:
@@ -532,10 +939,12 @@ class Document:
                 self.root_changeset = hcs
             self.add_to_known_changesets(hcs)
         self.relink_changesets()
-        self.ordered_changesets = self.tree_to_list()
-        self.ordered_changesets_set_cache = set(self.ordered_changesets)
+        self.ordered_changesets = OrderedChangesets(self.tree_to_list())
         for i, cs in enumerate(self.ordered_changesets):
             self.update_unaccounted_changesets(cs, i)
+        self.set_pending_changesets([cs for cs in self.pending_new_changesets
+                                     if not cs in
+                                     self.ordered_changesets])
 
     def relink_changesets(self):
         for cs in self.all_known_changesets.values():
@@ -562,24 +971,38 @@ class Document:
         """
         Perform opperational transformation on all changesets from
         start onwards.
+
+        Changesets before start only ever transform against changesets which
+        come before them, so their transformations, and the hazards they
+        created, are still valid. Only changesets from start onwards need to
+        be reset and transformed again. The root changeset never needs
+        transforming.
         """
         i = max(start, 1)
-        i = 0
-        # any hazards past start point are not invalid.
+        # any hazards from start onwards are invalid.
         self.remove_old_hazards(i)
+        self.op_columns_stale_from = min(self.op_columns_stale_from, i)
 
-        while i < len(self.ordered_changesets):
-            self.ordered_changesets[i].ot()
-            i += 1
+        for cs in self.ordered_changesets.iter_from(i):
+            cs.ot()
 
     def remove_old_hazards(self, index=0):
         """
         All changesets from index forward need to be recalculated so any
-        hazards based off them are invalid.
+        hazards based off them are invalid. Hazards and deletion edges created
+        by changesets before index are kept. Each changeset knows which ops
+        hold hazards made by it, so only those ops need cleaning. Hazard
+        pieces made by them are dropped too.
         """
-        css = set(self.ordered_changesets[index:])
-        for cs in self.ordered_changesets:
-            cs.remove_old_hazards(css)
+        css = set(self.ordered_changesets.iter_from(index))
+        holders = set([])
+        for cs in css:
+            holders.update(cs.pop_hazard_holders())
+        for op in holders:
+            op.remove_old_hazards(css)
+            holder_cs = op.get_changeset()
+            if not holder_cs in css:
+                holder_cs.remove_hazard_pieces(css)
 
     def has_needed_dependencies(self, cs):
         """
@@ -591,34 +1014,90 @@ class Document:
             return False
         deps = cs.get_parents()
         for dep in deps:
-            if not dep in self.ordered_changesets_set_cache:
+            if not dep in self.ordered_changesets:
                 return False
         return True
 
-    def rebuild_snapshot(self, ignore_cache=False):
+    def rebuild_snapshot(self, start=0, ignore_cache=False):
         """
-        Start from an empty {} document and rebuild it from each op in
-        each changeset.
+        Rebuild the snapshot by replaying the ops of the ordered changesets.
+
+        Only changesets from start onwards have changed, so replaying begins
+        at the nearest valid snapshot cache before start. When there is no
+        such cache, or ignore_cache is set, start from an empty {} document
+        and replay every changeset. Snapshot caches from start onwards are
+        invalid, and get refreshed as the ops are replayed. The document's
+        CheckpointPolicy may add new caches along the way.
+
+        :param start: Index of the first changeset which may have changed
+        :type start: int
+        :param ignore_cache: Replay the full history, ignoring any caches
+        :type ignore_cache: bool
+        :returns: How many ops from start onwards reached past the end of a
+            string or array, see Snapshot.clipped_ops
         """
-        index = 0
         s = self.snapshot
         ocs = self.ordered_changesets
-        if not ignore_cache:
-            while index > 0 and not ocs[index].has_valid_snapshot_cache():
-                index -= 1
-        if index == 0:
+        policy = self.checkpoint_policy
+        for cs in ocs.iter_from(start):
+            if cs.is_snapshot_cache():
+                cs.set_snapshot_cache_is_valid(False)
+
+        index = 0 if ignore_cache else min(start, len(ocs)) - 1
+        for cs in ocs.iter_reversed_from(index):
+            if index <= 0 or cs.has_valid_snapshot_cache():
+                break
+            index -= 1
+        if index <= 0:
+            index = 0
             s.set_snapshot({})
+            policy.reset_counters()
         else:
-            s.set_snapshot(ocs[index].get_snapshot_cache())
+            s.set_snapshot_copy(policy.restore(ocs[index]))
             index += 1
-        while index < len(self.ordered_changesets):
-            cs = ocs[index]
+        head_index = len(ocs) - 1
+        clipped_ops = None
+        for cs in ocs.iter_from(index):
+            if clipped_ops is None and index >= start:
+                clipped_ops = s.clipped_ops
             for op in cs.get_ops():
                 s.apply_op(op)
-            if cs.is_snapshot_cache():
-                cs.set_snapshot_cache(self.snapshot.get_snapshot_copy())
-                cs.set_snapshot_cache_is_valid(True)
+            policy.replayed(cs)
+            if not cs.has_valid_snapshot_cache() and \
+                    (cs.is_snapshot_cache() or
+                     (index > 0 and
+                      policy.wants_checkpoint(index, head_index))):
+                policy.save(cs, s.get_snapshot_copy(), index, head_index,
+                            s.get_copy_size())
             index += 1
+        if clipped_ops is None:
+            return 0
+        return s.clipped_ops - clipped_ops
+
+    def get_snapshot_at(self, index):
+        """
+        Build the snapshot as it was right after the ordered changeset at
+        index, starting from the nearest valid snapshot cache. The current
+        snapshot is not touched.
+        """
+        s = Snapshot(self.snapshot.persistent)
+        ocs = self.ordered_changesets
+        start = index
+        for cs in ocs.iter_reversed_from(index):
+            if start <= 0 or cs.has_valid_snapshot_cache():
+                break
+            start -= 1
+        if start > 0:
+            # this is not a rebuild, so the policy's counters are left alone
+            s.set_snapshot_copy(self.checkpoint_policy.peek(ocs[start]))
+            start += 1
+        for cs in ocs.iter_from(start):
+            if start > index:
+                break
+            for op in cs.get_ops():
+                s.apply_op(op)
+            start += 1
+        return s.get_snapshot()
 
     def update_unaccounted_changesets(self, cs, index=None):
         """
@@ -627,35 +1106,39 @@ class Document:
         changeset to each subsequent changeset which needs it. (all?)
         """
         unaccounted_css = []
+        shared_cs = None
         deps = cs.get_parents()
         pos_of_cs = index
         if index is None:
             pos_of_cs = self.ordered_changesets.index(cs)
-        i = pos_of_cs - 1
-        while deps and i > 0:
-            old_cs = self.ordered_changesets[i]
+        for old_cs in self.ordered_changesets.iter_reversed_from(pos_of_cs - 1):
+            if not deps or old_cs is self.root_changeset:
+                break
             if old_cs in deps:
                 if len(deps) == 1:
                     # if this is the last dep, then cs (generally)
                     # shares it's unknown dependencies
-                    rev_ucs = reversed(old_cs.get_unaccounted_changesets())
-                    ucss = [ucs for ucs in rev_ucs if not cs.has_ancestor(ucs)]
+                    old_ucs = old_cs.get_unaccounted_changesets()
+                    ucss = [ucs for ucs in reversed(old_ucs)
+                            if not cs.has_ancestor(ucs)]
+                    if not unaccounted_css and len(ucss) == len(old_ucs):
+                        # exactly the same, so share them instead of copying
+                        shared_cs = old_cs
                     unaccounted_css.extend(ucss)
                     break
                 deps.remove(old_cs)
             elif not cs.has_ancestor(old_cs) and not old_cs in unaccounted_css:
                 unaccounted_css.append(old_cs)
-            i -= 1
         unaccounted_css.reverse()
-        cs.set_unaccounted_changesets(unaccounted_css)
+        if shared_cs:
+            cs.share_unaccounted_changesets(shared_cs)
+        else:
+            cs.set_unaccounted_changesets(unaccounted_css)
 
         # now add the given cs to all subsequent changesets which need it
-        i = pos_of_cs + 1
-        while i < len(self.ordered_changesets):
-            future_cs = self.ordered_changesets[i]
+        for future_cs in self.ordered_changesets.iter_from(pos_of_cs + 1):
             future_cs.add_to_unaccounted_changesets(cs,pos_of_cs,
                                                     self.ordered_changesets)
-            i += 1
 
     def insert_changeset_into_ordered_list(self, cs):
         """
@@ -666,7 +1149,6 @@ class Document:
 
         i = self.get_insertion_point_into_ordered_changesets(cs)
         self.ordered_changesets.insert(i, cs)
-        self.ordered_changesets_set_cache.update([cs])
         return i
 
     def get_insertion_point_into_ordered_changesets(self, cs,
@@ -676,20 +1158,18 @@ class Document:
 
         # first get the most recent dependency
         deps = cs.get_parents()
-        i = len(ordered_list) - 1
-        while not ordered_list[i] in deps:
-            i -= 1
+        i = max(ordered_list.index(dep) for dep in deps)
 
         last_dep = ordered_list[i]
 
         i += 1
-        while i < len(ordered_list):
-            if ordered_list[i].has_ancestor(cs):
+        for next_cs in ordered_list.iter_from(i):
+            if next_cs.has_ancestor(cs):
                 break
-            if last_dep in ordered_list[i].get_parents():
-                if cs.get_id() < ordered_list[i].get_id():
+            if last_dep in next_cs.get_parents():
+                if cs.get_id() < next_cs.get_id():
                     break
-            elif not ordered_list[i].has_ancestor(last_dep):
+            elif not next_cs.has_ancestor(last_dep):
                 break
             i += 1
 
@@ -702,7 +1182,7 @@ class Document:
         correct ordered list.
         """
         cs = self.root_changeset
-        tree_list = []
+        tree_list = OrderedChangesets()
         tree_set_cache = set([])
         children = cs.get_children()
         divergence_queue = []
@@ -735,7 +1215,7 @@ class Document:
                 if children:
                     divergence_queue += children[1:]
 
-        return tree_list
+        return list(tree_list)
 
     def _cs_cannot_be_inserted(self, cs, tree_set_cache):
         return (cs is None or
@@ -15,7 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-class Hazard:
+class Hazard(object):
     """
     When two branches diverge for multiple opperations, those opperations could
     be considered to be applied to two different documents. A hazard is created
@@ -27,6 +27,14 @@ class Hazard:
     order to bring it in line for a future op's opperational transformation.
 
     """
+    # There can be many hazards per op, so they have no __dict__. What kind
+    # of hazard this is follows from which shifts are set.
+    __slots__ = ('base_op', 'conflict_op', 'interbranch_op', 'path_shift',
+                 'offset_shift', 'val_shift', 'noop_shift', 'conflict_cs',
+                 'interbranch_cs')
+
+    _is_between_branches = False
+
     def __init__(self, base_op, conflict_op, interbranch_op=None,
                  path_shift=None, offset_shift=None, val_shift=None,
                  noop_shift=False):
@@ -38,18 +46,14 @@ class Hazard:
         self.val_shift = val_shift
         self.noop_shift = noop_shift
 
-        self.base_cs = base_op.get_changeset()
         self.conflict_cs = conflict_op.get_changeset()
         self.interbranch_cs = None
         if interbranch_op:
             self.interbranch_cs = interbranch_op.get_changeset()
 
-        self._is_path_hazard = not path_shift is None
-        self._is_offset_hazard = not offset_shift is None
-        self._is_val_hazard = not val_shift is None
-        self._is_between_branches = False
-        self._is_activatied = False
-        self._is_interbranch_hazard = not interbranch_op is None
+    @property
+    def base_cs(self):
+        return self.base_op.get_changeset()
 
     def get_conflict_op(self):
         return self.conflict_op
@@ -58,7 +62,7 @@ class Hazard:
         return self.interbranch_op
 
     def get_interbranch_conflict_ops(self):
-        if self._is_interbranch_hazard:
+        if self.is_interbranch_hazard():
             return [self.interbranch_op, self.conflict_op]
         else:
             return [self.conflict_op]
@@ -82,19 +86,19 @@ class Hazard:
         return self._is_array_hazard
 
     def is_path_hazard(self):
-        return self._is_path_hazard
+        return not self.path_shift is None
 
     def is_offset_hazard(self):
-        return self._is_offset_hazard
+        return not self.offset_shift is None
 
     def is_val_hazard(self):
-        return self._is_val_hazard
+        return not self.val_shift is None
 
     def is_noop_hazard(self):
         return self.noop_shift
 
     def is_interbranch_hazard(self):
-        return self._is_interbranch_hazard
+        return not self.interbranch_op is None
 
     def __str__(self):
         s = "<Hazard base_cs: "
@@ -14,7 +14,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import copy
 import uuid
 from datetime import datetime
 import random
@@ -47,6 +46,7 @@ class MajorMajor:
         GObject.timeout_add(500, self.pull_from_pending_lists)
         GObject.timeout_add(2000, self.retry_request_changesets)
         GObject.timeout_add(5000, self.sync_documents)
+        GObject.timeout_add(60000, self.compact_documents)
         self.big_insert = False
         self.drop_random_css = False
 
@@ -89,15 +89,16 @@ class MajorMajor:
         When the MajorMajor flag HAS_EVENT_LOOP is set to False, this is not
         called on a timer. Instead, changesets are applied immediately when
         they are received.
+
+        The 'receive-changeset' callbacks get the change events (see
+        Op.to_change_event) which bring the snapshot from before the pull up
+        to date. Documents with nothing ready to pull in are skipped.
         """
-        # TODO: Document should keep a flag if a pull attempt is even needed
         for doc in self.documents:
-            old_state = copy.deepcopy(doc.get_snapshot())
-            was_changed = doc.pull_from_pending_list()
-            if was_changed:
-                opcodes = doc.get_diff_opcode(old_state)
+            events = doc.pull_change_events()
+            if events:
                 for callback in self.signal_callbacks['receive-changeset']:
-                    callback(opcodes)
+                    callback(events)
 
             css = doc.get_send_queue()
             if css:
@@ -216,6 +217,25 @@ class MajorMajor:
             return True
         return msg
 
+    def compact_documents(self):
+        """
+        Drop the history of each open document which every known remote
+        user has already acknowledged.
+
+        This is periodically called on a timer. Users report their
+        document's dependencies while syncing, so history is only dropped
+        once every known user, and every user who ever reported, has synced
+        past it. Until some user has reported, nothing is known to be
+        acknowledged. A user who connects for the first time after history
+        was dropped could still send changesets built on it, and those are
+        rejected (see Document.compact_history).
+        """
+        for doc in self.documents:
+            if not doc.has_peer_dependencies():
+                continue
+            doc.compact_history(peer_ids=list(self.remote_users.keys()))
+        return True
+
     def sync_document(self, remote_msg=None, doc=None, user=None):
         """
         Create and send a 'sync' message with relevant information to further
@@ -256,6 +276,10 @@ class MajorMajor:
         request_css, send_css = [], []
         synced = False
         if remote_msg:
+            # everything up to the remote user's dependencies is
+            # acknowledged by them.
+            doc.set_peer_dependencies(remote_msg.from_user, remote_msg.dep_ids)
+
             # if there wasa message, and it was synced, quit
             if remote_msg.synced is True:
                 return
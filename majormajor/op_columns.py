@@ -0,0 +1,243 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Actions stored in the action column, by code.
+ACTIONS = ('set', 'bn', 'na', 'si', 'sd', 'sm', 'ai', 'ad', 'am', 'oi', 'od')
+ACTION_CODES = dict((action, code) for code, action in enumerate(ACTIONS))
+
+
+class OpColumns(object):
+    """
+    A column oriented copy of every Op in a Document's ordered changesets,
+    with one row per op in the order they are applied. Each column holds
+    one transformed value for every op:
+
+      * action: code of the op's action, see ACTIONS
+      * path: id of the op's path, see get_path_id
+      * offset: the offset, or -1 for ops without a numeric offset
+      * length: how many characters or items are inserted or deleted
+      * noop: 1 if the op became a noop
+
+    Columns are arrays of machine ints, so they take little memory and,
+    when NumPy is installed, get_column hands them out as NumPy arrays and
+    the queries here run as array operations. Without NumPy the same
+    queries loop over the arrays.
+
+    The Document keeps the columns up to date lazily: after OT changes its
+    ordered changesets from some index, only the rows from that index on
+    are rebuilt, the next time the columns are asked for.
+    """
+    column_types = (('action', 'b'), ('path', 'l'), ('offset', 'l'),
+                    ('length', 'l'), ('noop', 'b'))
+
+    def __init__(self, ordered_changesets):
+        self.source = ordered_changesets
+        self.columns = dict((name, array(typecode))
+                            for name, typecode in self.column_types)
+        self.ops = []
+        # row of the first op of each ordered changeset
+        self.cs_starts = array('l')
+        self.paths = []
+        self.path_ids = {}
+
+    def __len__(self):
+        return len(self.ops)
+
+    def refresh(self, start=0):
+        """
+        Rebuild the rows for the ordered changesets from index start on.
+        """
+        start = min(start, len(self.cs_starts))
+        row = self.cs_starts[start] if start < len(self.cs_starts) \
+            else len(self.ops)
+        for column in self.columns.values():
+            del column[row:]
+        del self.ops[row:]
+        del self.cs_starts[start:]
+        for cs in self.source.iter_from(start):
+            self.cs_starts.append(len(self.ops))
+            for op in cs.get_ops():
+                self.add_op(op)
+
+    def add_op(self, op):
+        c = self.columns
+        c['action'].append(ACTION_CODES[op.t_action])
+        c['path'].append(self.get_path_id(op.t_path))
+        offset = op.t_offset
+        c['offset'].append(offset if isinstance(offset, (int, long)) else -1)
+        val = op.t_val
+        if op.t_action in ('si', 'ai'):
+            length = len(val)
+        elif op.t_action in ('sd', 'ad', 'sm'):
+            length = val
+        else:
+            length = 0
+        c['length'].append(length)
+        c['noop'].append(1 if op.is_noop() else 0)
+        self.ops.append(op)
+
+    def get_path_id(self, path):
+        """
+        Get the id standing in for path in the path column, giving it a new
+        one if it has none yet.
+        """
+        key = tuple(path)
+        path_id = self.path_ids.get(key)
+        if path_id is None:
+            path_id = len(self.paths)
+            self.path_ids[key] = path_id
+            self.paths.append(key)
+        return path_id
+
+    def get_path(self, path_id):
+        return list(self.paths[path_id])
+
+    def get_column(self, name):
+        """
+        Get a column, as a NumPy array if NumPy is installed. The array
+        shares memory with the column, so it must not be changed, and is
+        only good until the columns are next refreshed.
+        """
+        column = self.columns[name]
+        if numpy is None:
+            return column
+        if not column:
+            return numpy.zeros(0, dtype=column.typecode)
+        return numpy.frombuffer(column, dtype=column.typecode)
+
+    def get_op(self, row):
+        return self.ops[row]
+
+    def get_changeset_rows(self, index):
+        """
+        Get the range of rows holding the ops of the ordered changeset at
+        index.
+        """
+        stop = self.cs_starts[index + 1] if index + 1 < len(self.cs_starts) \
+            else len(self.ops)
+        return self.cs_starts[index], stop
+
+    def find_rows(self, path, actions=None, below=False):
+        """
+        Get the rows of the ops which changed the value at path, skipping
+        noops. When below is True, ops on anything within that value count
+        too. actions limits the rows to ops with one of those actions.
+        """
+        path = tuple(path)
+        n = len(path)
+        path_ids = [i for i, p in enumerate(self.paths)
+                    if p == path or (below and p[:n] == path)]
+        codes = [ACTION_CODES[a] for a in actions] if actions else None
+        c = self.columns
+        if numpy is not None:
+            mask = numpy.in1d(self.get_column('path'), path_ids)
+            mask &= self.get_column('noop') == 0
+            if codes is not None:
+                mask &= numpy.in1d(self.get_column('action'), codes)
+            return [int(row) for row in numpy.flatnonzero(mask)]
+        path_ids = set(path_ids)
+        codes = set(codes) if codes is not None else None
+        return [row for row, path_id in enumerate(c['path'])
+                if path_id in path_ids and not c['noop'][row] and
+                (codes is None or c['action'][row] in codes)]
+
+    def find_ops(self, path, actions=None, below=False):
+        return [self.ops[row] for row in
+                self.find_rows(path, actions, below)]
+
+    def count_actions(self):
+        """
+        Count how many ops of each action there are, noops included.
+        """
+        column = self.columns['action']
+        if numpy is not None:
+            counts = numpy.bincount(self.get_column('action'),
+                                    minlength=len(ACTIONS))
+        else:
+            counts = [0] * len(ACTIONS)
+            for code in column:
+                counts[code] += 1
+        return dict((action, int(counts[code]))
+                    for code, action in enumerate(ACTIONS) if counts[code])
+
+    def shift_positions(self, path, positions, start=0, stop=None):
+        """
+        Shift positions in the string at path, such as cursors, through the
+        string inserts and deletes in rows start up to stop, so they point
+        at the same places in the text afterwards. Text inserted at a
+        position goes before it, and a position within deleted text moves to
+        the start of the deletion. String moves are not followed.
+
+        With NumPy, positions can be an array and each op shifts all of them
+        at once. Returns a NumPy array, or a list without NumPy.
+        """
+        stop = len(self.ops) if stop is None else stop
+        path_id = self.path_ids.get(tuple(path))
+        if numpy is not None:
+            positions = numpy.array(positions, dtype=numpy.int_)
+        else:
+            positions = list(positions)
+        if path_id is None or not len(positions):
+            return positions
+        si = ACTION_CODES['si']
+        offsets = self.columns['offset']
+        lengths = self.columns['length']
+        actions = self.columns['action']
+        for row in self._find_string_rows(path_id, start, stop):
+            offset, length = offsets[row], lengths[row]
+            if actions[row] == si:
+                if numpy is not None:
+                    positions[positions >= offset] += length
+                else:
+                    positions = [p + length if p >= offset else p
+                                 for p in positions]
+            else:
+                end = offset + length
+                if numpy is not None:
+                    positions = numpy.where(positions >= end,
+                                            positions - length,
+                                            numpy.minimum(positions, offset))
+                else:
+                    positions = [p - length if p >= end else min(p, offset)
+                                 for p in positions]
+        return positions
+
+    def _find_string_rows(self, path_id, start, stop):
+        """
+        Get the rows from start up to stop of string inserts and deletes at
+        the path with path_id. Noops are skipped, and so are negative offsets,
+        which count back from the end of a string of unknown length.
+        """
+        codes = (ACTION_CODES['si'], ACTION_CODES['sd'])
+        if numpy is not None:
+            window = slice(start, stop)
+            mask = self.get_column('path')[window] == path_id
+            mask &= self.get_column('noop')[window] == 0
+            mask &= self.get_column('offset')[window] >= 0
+            mask &= numpy.in1d(self.get_column('action')[window], codes)
+            return [int(row) + start for row in numpy.flatnonzero(mask)]
+        c = self.columns
+        return [row for row in xrange(start, stop)
+                if c['path'][row] == path_id and not c['noop'][row] and
+                c['offset'][row] >= 0 and c['action'][row] in codes]
@@ -17,15 +17,21 @@
 
 from ..hazards.hazard import Hazard
 from .op import Op
+from .array_move_op import get_target_gap, get_target_index
 
 
 class ArrayDeleteOp(Op):
+    __slots__ = ()
+
     def is_array_delete(self):
         return True
 
     def set_value_to_nil(self):
         self.t_val = 0
 
+    def compose(self, op):
+        return self._compose_delete(op, op.is_array_delete())
+
     def string_insert_transform(self, op):
         """
         This is being transformed by a past String Insert. There is no way for
@@ -96,7 +102,7 @@ class ArrayDeleteOp(Op):
         elif past_t_path == self.t_path[:len(past_t_path)]:
             # path may need to shift at one point
             if past_t_offset <= self.t_path[len(past_t_path)]:
-                self.t_path[len(past_t_path)] += len(past_t_val)
+                self._shift_t_path(len(past_t_path), len(past_t_val))
         return hazard
 
     def array_delete_transform(self, op):
@@ -127,7 +133,7 @@ class ArrayDeleteOp(Op):
             elif self.t_path[len(past_t_path)] > past_t_offset:
                 # along this path was an array that had elements deleted and
                 # that point in the path needs to shift back.
-                self.t_path[len(past_t_path)] -= past_t_val
+                self._shift_t_path(len(past_t_path), -past_t_val)
         elif self.t_path == past_t_path:
             # if the paths are identical, only delete ranges need to be
             # considered, just like overlapping string deletes.
@@ -135,3 +141,81 @@ class ArrayDeleteOp(Op):
                                                               past_t_offset,
                                                               past_t_val)
         return hazard
+
+    def array_move_transform(self, op):
+        """
+        A previously unknown op moved an element. When it was in the same
+        array, this still deletes just the elements it meant to, wherever
+        they are now. That takes two delete ranges when the past move took an
+        element out of this range, or put one into the middle of it, so the
+        second range is split off into a new op. The past move gets a hazard
+        for where its element and destination are once this delete is done,
+        or a noop hazard if this deletes its element.
+        """
+        past_t_path, past_t_offset, past_t_val = \
+            op.past_t_path, op.past_t_offset, op.past_t_val
+
+        if len(past_t_path) > len(self.t_path):
+            return self._get_path_hazard_for_past_op(op)
+        if not past_t_path == self.t_path:
+            return Op.array_move_transform(self, op)
+
+        start, stop = self.t_offset, self.t_offset + self.t_val
+        if start <= past_t_offset < stop:
+            hazard = Hazard(op, self, noop_shift=True)
+            self.add_undo_hazards_to_common_prev_ops(op, op)
+            deletes_element = True
+            # the rest of the range once the element is taken out
+            stop -= 1
+        else:
+            # where the past move's element and destination are once this
+            # delete is done
+            offset = past_t_offset
+            if offset >= stop:
+                offset -= self.t_val
+            gap = get_target_gap(past_t_offset, past_t_val)
+            if gap >= stop:
+                gap -= self.t_val
+            elif gap > start:
+                gap = start
+            offset_shift = offset - past_t_offset
+            val_shift = get_target_index(offset, gap) - past_t_val
+            hazard = False
+            if offset_shift or val_shift:
+                hazard = Hazard(op, self, offset_shift=offset_shift,
+                                val_shift=val_shift)
+            deletes_element = False
+            # the range once the element is taken out
+            if past_t_offset < start:
+                start -= 1
+                stop -= 1
+
+        # the range, and the piece to split off, once the element is put
+        # back in at past_t_val
+        piece = None
+        if deletes_element:
+            if start == stop:
+                start, stop = past_t_val, past_t_val + 1
+            elif start <= past_t_val <= stop:
+                stop += 1
+            elif past_t_val < start:
+                start += 1
+                stop += 1
+                piece = (past_t_val, 1)
+            else:
+                piece = (past_t_val - (stop - start), 1)
+        elif past_t_val <= start:
+            start += 1
+            stop += 1
+        elif past_t_val < stop:
+            # the element splits the range, and is at start once the first
+            # part is deleted
+            piece = (start + 1, stop - past_t_val)
+            stop = past_t_val
+
+        self.t_offset, self.t_val = start, stop - start
+        if piece and self.changeset:
+            offset, val = piece
+            self.changeset.split_op(self, Op('ad', self.t_path, val=val,
+                                             offset=offset), op)
+        return hazard
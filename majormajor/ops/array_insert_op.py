@@ -16,15 +16,22 @@
 
 from ..hazards.hazard import Hazard
 from .op import Op
+from .array_move_op import move_gap, get_target_gap, get_target_index
 
 
 class ArrayInsertOp(Op):
+    __slots__ = ()
+
     def is_array_insert(self):
         return True
 
     def set_value_to_nil(self):
         self.t_val = []
 
+    def compose(self, op):
+        return self._compose_insert(op, op.is_array_insert(),
+                                    op.is_array_delete())
+
     def string_insert_transform(self, op):
         """
         This is being transformed by a past String Insert. There is no way for
@@ -86,7 +93,7 @@ class ArrayInsertOp(Op):
         # otherwise the path may need to shift
         elif past_t_path == self.t_path[:len(past_t_path)]:
             if past_t_offset <= self.t_path[len(past_t_path)]:
-                self.t_path[len(past_t_path)] += len(past_t_val)
+                self._shift_t_path(len(past_t_path), len(past_t_val))
         return hazard
 
     def array_delete_transform(self, op):
@@ -114,10 +121,41 @@ class ArrayInsertOp(Op):
                 self.noop = True
             # or the path needs to shift
             elif self.t_path[len(past_t_path)] > past_t_offset:
-                self.t_path[len(past_t_path)] -= past_t_val
+                self._shift_t_path(len(past_t_path), -past_t_val)
         # lastly, if they have the same path, offsets may need to shift
         elif past_t_path == self.t_path:
             hazard = self.transform_insert_by_previous_delete(op,
                                                               past_t_offset,
                                                               past_t_val)
         return hazard
+
+    def array_move_transform(self, op):
+        """
+        A previously unknown op moved an element. When it was in the same
+        array, this insert's offset follows the elements around it. The past
+        move gets a hazard for where its element and destination are once
+        this insert is done.
+        """
+        past_t_path, past_t_offset, past_t_val = \
+            op.past_t_path, op.past_t_offset, op.past_t_val
+
+        if len(past_t_path) > len(self.t_path):
+            return self._get_path_hazard_for_past_op(op)
+        if not past_t_path == self.t_path:
+            return Op.array_move_transform(self, op)
+
+        size = len(self.t_val)
+        offset = past_t_offset
+        if offset >= self.t_offset:
+            offset += size
+        gap = get_target_gap(past_t_offset, past_t_val)
+        if gap >= self.t_offset:
+            gap += size
+        offset_shift = offset - past_t_offset
+        val_shift = get_target_index(offset, gap) - past_t_val
+
+        self.t_offset = move_gap(self.t_offset, past_t_offset, past_t_val)
+        if offset_shift or val_shift:
+            return Hazard(op, self, offset_shift=offset_shift,
+                          val_shift=val_shift)
+        return False
@@ -0,0 +1,293 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from ..hazards.hazard import Hazard
+from .op import Op
+
+
+def move_index(index, from_index, to_index):
+    """
+    Find where the element at index ends up after the element at from_index
+    is moved to to_index.
+    """
+    if index == from_index:
+        return to_index
+    if index > from_index:
+        index -= 1
+    if index >= to_index:
+        index += 1
+    return index
+
+
+def move_gap(gap, from_index, to_index, after=False):
+    """
+    Find where an insertion point (the gap right before the element at gap)
+    ends up after the element at from_index is moved to to_index. Anything
+    inserted right where the element lands goes before it, unless after is
+    set.
+    """
+    if from_index == to_index:
+        return gap
+    if gap > from_index:
+        gap -= 1
+    if gap > to_index or (after and gap == to_index):
+        gap += 1
+    return gap
+
+
+def get_target_gap(from_index, to_index):
+    """
+    The destination of a move is an index into the array once the element
+    is taken out. Get the insertion point it stands for in the array before
+    the move.
+    """
+    return to_index if to_index <= from_index else to_index + 1
+
+
+def get_target_index(from_index, gap):
+    """
+    The opposite of get_target_gap.
+    """
+    return gap if gap <= from_index else gap - 1
+
+
+class ArrayMoveOp(Op):
+    """
+    Move the element at index offset of the array at path so that it ends up
+    at index val. This is one op, instead of an array delete and an array
+    insert, so the element's value is never copied and only one op needs to
+    be transformed.
+    """
+    __slots__ = ()
+
+    def is_array_move(self):
+        return True
+
+    def set_value_to_nil(self):
+        # leave the element in place, which moves nothing
+        self.t_val = self.t_offset
+
+    def _get_path_hazard_for_past_op(self, op):
+        """
+        Construct and return the path Hazard this Op creates when this is being
+        transformed by the given Op. A past op within the moved array's
+        elements gets its path shifted to where its element is moved. If no
+        Hazard is needed, return False.
+
+        :param op: Previous :class:`Op` this op is being transformed by
+        :returns: path :class:`Hazard` or False
+        """
+        past_t_path = op.past_t_path[:]
+        if len(past_t_path) <= len(self.t_path) or \
+           not self.t_path == past_t_path[:len(self.t_path)]:
+            return False
+        index = past_t_path[len(self.t_path)]
+        new_index = move_index(index, self.t_offset, self.t_val)
+        if new_index == index:
+            return False
+        past_t_path[len(self.t_path)] = new_index
+        return Hazard(op, self, path_shift=past_t_path)
+
+    def set_transform(self, op):
+        Op.set_transform(self, op)
+        return self._get_path_hazard_for_past_op(op)
+
+    def string_insert_transform(self, op):
+        return self._get_path_hazard_for_past_op(op)
+
+    def string_delete_transform(self, op):
+        return self._get_path_hazard_for_past_op(op)
+
+    def object_insert_transform(self, op):
+        Op.object_insert_transform(self, op)
+        return self._get_path_hazard_for_past_op(op)
+
+    def object_delete_transform(self, op):
+        Op.object_delete_transform(self, op)
+        return self._get_path_hazard_for_past_op(op)
+
+    def array_insert_transform(self, op):
+        """
+        A previously unknown op did an array insert. When it was into the same
+        array, the moved element and its destination may need to shift up.
+        The past insert gets a hazard for where its offset is once this move
+        is done.
+        """
+        past_t_path, past_t_offset, past_t_val = \
+            op.past_t_path, op.past_t_offset, op.past_t_val
+
+        if len(past_t_path) > len(self.t_path):
+            return self._get_path_hazard_for_past_op(op)
+        if not past_t_path == self.t_path:
+            return Op.array_insert_transform(self, op)
+
+        hazard = False
+        new_gap = move_gap(past_t_offset, self.t_offset, self.t_val)
+        if new_gap != past_t_offset:
+            hazard = Hazard(op, self, offset_shift=new_gap - past_t_offset)
+
+        size = len(past_t_val)
+        gap = get_target_gap(self.t_offset, self.t_val)
+        if self.t_offset >= past_t_offset:
+            self.t_offset += size
+        if gap >= past_t_offset:
+            gap += size
+        self.t_val = get_target_index(self.t_offset, gap)
+        return hazard
+
+    def array_delete_transform(self, op):
+        """
+        A previously unknown op did an array delete. If the moved element was
+        deleted, this becomes a noop. Otherwise the element and its
+        destination shift back past the delete range. A destination within
+        the delete range becomes the start of that range.
+
+        The past delete gets a hazard for where its range is once this move is
+        done. When this move took an element out of that range, or put one
+        into the middle of it, ops which know about this move need the past
+        delete to delete a second range, so its changeset gets a hazard piece
+        for it.
+        """
+        past_t_path, past_t_offset, past_t_val = \
+            op.past_t_path, op.past_t_offset, op.past_t_val
+
+        if len(past_t_path) > len(self.t_path):
+            return self._get_path_hazard_for_past_op(op)
+        if not past_t_path == self.t_path:
+            return Op.array_delete_transform(self, op)
+
+        start, stop = past_t_offset, past_t_offset + past_t_val
+        if start <= self.t_offset < stop:
+            val = self.t_val
+            self.noop = True
+            self.set_value_to_nil()
+            self.add_undo_hazards_to_common_prev_ops(op, self)
+            # the rest of the range once the element is taken out, and then
+            # where the element is put back in
+            stop -= 1
+            piece = None
+            if start == stop:
+                start, stop = val, val + 1
+            elif start <= val <= stop:
+                stop += 1
+            elif val < start:
+                start += 1
+                stop += 1
+                piece = (val, 1)
+            else:
+                piece = (val - (stop - start), 1)
+            return self._get_delete_hazard(op, start, stop, piece)
+
+        # where the delete range is once the moved element is taken out, and
+        # then put back in
+        if self.t_offset < start:
+            start -= 1
+            stop -= 1
+        piece = None
+        if self.t_val <= start:
+            start += 1
+            stop += 1
+        elif self.t_val < stop:
+            # the element splits the range, and is at start once the first
+            # part is deleted
+            piece = (start + 1, stop - self.t_val)
+            stop = self.t_val
+        hazard = self._get_delete_hazard(op, start, stop, piece)
+
+        gap = get_target_gap(self.t_offset, self.t_val)
+        if self.t_offset >= past_t_offset + past_t_val:
+            self.t_offset -= past_t_val
+        if gap >= past_t_offset + past_t_val:
+            gap -= past_t_val
+        elif gap > past_t_offset:
+            gap = past_t_offset
+        self.t_val = get_target_index(self.t_offset, gap)
+        return hazard
+
+    def _get_delete_hazard(self, op, start, stop, piece):
+        """
+        Get the hazard making the past delete op delete from start to stop,
+        and add a hazard piece to its changeset for the (offset, val) range
+        in piece, if there is one.
+        """
+        if piece and self.changeset:
+            # the piece deletes nothing where it is, so other ops shift it
+            # like any other spot in the array
+            offset, val = piece
+            delete_piece = Op('ad', op.t_path, val=0, offset=offset)
+            op.get_changeset().add_hazard_piece(op, delete_piece,
+                                                self.changeset)
+            path_shift = None
+            if op.past_t_path != op.t_path:
+                path_shift = op.past_t_path
+            delete_piece.add_new_hazard(
+                Hazard(delete_piece, self, path_shift=path_shift,
+                       val_shift=val))
+        offset_shift = start - op.past_t_offset
+        val_shift = stop - start - op.past_t_val
+        if offset_shift or val_shift:
+            return Hazard(op, self, offset_shift=offset_shift,
+                          val_shift=val_shift)
+        return False
+
+    def array_move_transform(self, op):
+        """
+        A previously unknown op moved an element. When it moved the same
+        element, this move wins and the past move no longer matters to ops
+        which know about this one. Otherwise the element to move and its
+        destination follow the past move. When both elements land in the same
+        place, the one moved first goes first. A move which leaves its element
+        in place never lands anywhere.
+        """
+        past_t_path, past_t_offset, past_t_val = \
+            op.past_t_path, op.past_t_offset, op.past_t_val
+
+        if len(past_t_path) > len(self.t_path):
+            return self._get_path_hazard_for_past_op(op)
+        if not past_t_path == self.t_path:
+            return Op.array_move_transform(self, op)
+
+        if past_t_offset == self.t_offset:
+            # the destination is an index into the array without the
+            # element, which both moves agree on
+            self.t_offset = past_t_val
+            self.add_undo_hazards_to_common_prev_ops(op, op)
+            return Hazard(op, self, noop_shift=True)
+
+        # where the past move's element and destination are once this move
+        # is done. A move which leaves its element in place keeps doing so.
+        offset = move_index(past_t_offset, self.t_offset, self.t_val)
+        offset_shift = offset - past_t_offset
+        if past_t_offset == past_t_val:
+            val_shift = offset_shift
+        else:
+            gap = move_gap(get_target_gap(past_t_offset, past_t_val),
+                           self.t_offset, self.t_val)
+            val_shift = get_target_index(offset, gap) - past_t_val
+
+        gap = move_gap(get_target_gap(self.t_offset, self.t_val),
+                       past_t_offset, past_t_val, after=True)
+        if self.t_offset == self.t_val:
+            self.t_offset = self.t_val = \
+                move_index(self.t_offset, past_t_offset, past_t_val)
+        else:
+            self.t_offset = move_index(self.t_offset, past_t_offset,
+                                       past_t_val)
+            self.t_val = get_target_index(self.t_offset, gap)
+        if offset_shift or val_shift:
+            return Hazard(op, self, offset_shift=offset_shift,
+                          val_shift=val_shift)
+        return False
@@ -0,0 +1,31 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from .op import Op
+
+
+class NumberAddOp(Op):
+    __slots__ = ()
+
+    def is_number_add(self):
+        return True
+
+    def set_value_to_nil(self):
+        self.t_val = 0
+
+    def is_commutative(self):
+        # float additions round differently depending on their order
+        return isinstance(self.val, (int, long))
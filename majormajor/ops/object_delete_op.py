@@ -19,5 +19,7 @@ from .op import Op
 
 
 class ObjectDeleteOp(Op):
+    __slots__ = ()
+
     def is_object_delete(self):
         return True
@@ -19,5 +19,7 @@ from .op import Op
 
 
 class ObjectInsertOp(Op):
+    __slots__ = ()
+
     def is_object_insert(self):
         return True
@@ -22,18 +22,36 @@ class Op(object):
     offset is only used for string manipulation
 
     """
+    # Documents can hold a great many ops, so they have no __dict__. Lists
+    # which are usually empty start as an empty tuple, and only become lists
+    # once something is added.
+    __slots__ = ('action', 'path', 'val', 'offset', 'dest_path',
+                 'dest_offset', 't_action', 't_path', 't_val', 't_offset',
+                 't_dest_path', 't_dest_offset', 'noop', 'past_t_action',
+                 'past_t_path', 'past_t_val', 'past_t_offset',
+                 'past_t_dest_path', 'past_t_dest_offset', 'past_t_noop',
+                 'changeset', 'hazards', 'hazards_between_branches',
+                 'hazard_shift_cs', 'extends_at_head', 'extends_at_tail',
+                 'val_shifting_ops', 'deletion_edges')
+
     def __new__(cls, *args, **kwargs):
         subclass = {'si': StringInsertOp,
                     'sd': StringDeleteOp,
                     'sm': StringMoveOp,
                     'ai': ArrayInsertOp,
                     'ad': ArrayDeleteOp,
+                    'am': ArrayMoveOp,
                     'oi': ObjectInsertOp,
                     'od': ObjectDeleteOp,
+                    'na': NumberAddOp,
+                    'bn': BooleanNegationOp,
                     'set': SetOp }.get(args[0], cls)
 
         new_instance = object.__new__(subclass)
-        new_instance.__init__(*args, **kwargs)
+        # Python goes on to call __init__ itself, unless the new op is not an
+        # instance of cls
+        if not isinstance(new_instance, cls):
+            new_instance.__init__(*args, **kwargs)
         return new_instance
 
     def __init__(self, action, path, val=None, offset=None,
@@ -62,17 +80,18 @@ class Op(object):
 
         self.changeset = None
 
-        self.hazards = []
-        self.hazards_between_branches = []
-        self.valid_hazard_shifted_cache = False
+        self.hazards = ()
+        self.hazards_between_branches = ()
+        # The changeset the past_t_* values were last hazard shifted for.
+        self.hazard_shift_cs = None
 
         self.extends_at_head = False
         self.extends_at_tail = False
 
         self.past_t_noop = False
 
-        self.val_shifting_ops = []
-        self.deletion_edges = []
+        self.val_shifting_ops = ()
+        self.deletion_edges = ()
 
     def set_changeset(self, cs):
         self.changeset = cs
@@ -171,11 +190,22 @@ class Op(object):
         return self.noop
 
     def remove_old_hazards(self, css=[], purge=False):
+        """
+        Drop every Hazard, and every deletion edge, which was created while
+        transforming one of the changesets in css. Those changesets are about
+        to be transformed again, which will recreate whatever is still
+        needed. Interbranch hazards are dropped if either of their changesets
+        is in css.
+        """
         if purge:
-            self.hazards = []
-        else:
+            self.hazards = ()
+        elif self.hazards:
             self.hazards = [h for h in self.hazards
-                            if not h.conflict_cs in css]
+                            if not (h.conflict_cs in css or
+                                    h.interbranch_cs in css)]
+        if self.deletion_edges:
+            self.deletion_edges = [edge for edge in self.deletion_edges
+                                   if not edge[0].get_changeset() in css]
         self.reset_hazard_transformations()
 
     def hazard_is_relevant_for_ot(self, hazard, op):
@@ -186,7 +216,9 @@ class Op(object):
 
         TODO: THIS IS WHERE SHIT GETS UNUSABLY SLOW
         """
-        cs = op.get_changeset()
+        return self._hazard_is_relevant_for_cs(hazard, op.get_changeset())
+
+    def _hazard_is_relevant_for_cs(self, hazard, cs):
         if not cs:
             return False
         h = hazard
@@ -199,6 +231,8 @@ class Op(object):
         return True
 
     def add_val_shifting_op(self, op, offset_shift=0, val_shift=0):
+        if not self.val_shifting_ops:
+            self.val_shifting_ops = []
         self.val_shifting_ops.append((op, offset_shift, val_shift))
 
     def add_deletion_edge(self, op, head=None, tail=None):
@@ -208,7 +242,10 @@ class Op(object):
         at_head = not tail if head is None else head
         if not (at_head is True or at_head is False):
             raise Exception(s)
+        if not self.deletion_edges:
+            self.deletion_edges = []
         self.deletion_edges.append((op, at_head))
+        self._register_hazard_holder(op.get_changeset())
 
     def add_interbranch_hazard(self, hazard):
         conflict_ops = hazard.get_interbranch_conflict_ops()
@@ -217,10 +254,23 @@ class Op(object):
             if h.get_conflict_op() in conflict_ops:
                 index = len(self.hazards) - i
                 self.hazards.insert(index, hazard)
+                self._register_hazard(hazard)
+                self.hazard_shift_cs = None
                 break
 
+    def _register_hazard(self, hazard):
+        self._register_hazard_holder(hazard.conflict_cs)
+        self._register_hazard_holder(hazard.interbranch_cs)
+
+    def _register_hazard_holder(self, cs):
+        """
+        Let cs know this op holds something made while transforming it.
+        """
+        if cs:
+            cs.add_hazard_holder(self)
+
     def get_val_shifting_ops(self):
-        return self.val_shifting_ops[:]
+        return list(self.val_shifting_ops)
 
     def must_check_full_delete_range(self, op):
         if not op.is_noop():
@@ -277,61 +327,122 @@ class Op(object):
              'offset': self.offset}
         return s
 
+    def to_change_event(self):
+        """
+        Describe how this Op, as transformed, changes the document, as a
+        tuple of (action, path, offset, val). A string move also has its
+        destination path and offset on the end.
+        """
+        if self.is_string_move():
+            return (self.t_action, self.t_path[:], self.t_offset, self.t_val,
+                    self.t_dest_path[:], self.t_dest_offset)
+        return (self.t_action, self.t_path[:], self.t_offset, self.t_val)
+
     def reset_transformations(self):
         """
         Reset how this Op will be applied to the document by reseting its
         tranformed values to the original values. This is typically only done
         at the begining of this Op's opperational transformation.
         """
-        self.t_action = deepcopy(self.action)
-        self.t_path = deepcopy(self.path)
-        self.t_val = deepcopy(self.val)
+        # The transformed values share the originals. Transformations replace
+        # them rather than change them in place, see _shift_t_path.
+        self.t_action = self.action
+        self.t_path = self.path
+        self.t_val = self.val
         self.t_offset = self.offset
-        self.t_dest_path = deepcopy(self.dest_path)
+        self.t_dest_path = self.dest_path
         self.t_dest_offset = self.dest_offset
         self.noop = False
-        self.val_shifting_ops = []
-        self.deletion_edges = []
+        self.val_shifting_ops = ()
+        self.deletion_edges = ()
         self.extends_at_head = False
         self.extends_at_tail = False
+        self.hazard_shift_cs = None
 
     def reset_hazard_transformations(self):
         """
         Reset how this Op will be used in opperational transformation with a
         future Op.
         """
-        self.past_t_action = deepcopy(self.t_action)
-        self.past_t_path = deepcopy(self.t_path)
-        self.past_t_val = deepcopy(self.t_val)
+        self.past_t_action = self.t_action
+        self.past_t_path = self.t_path
+        self.past_t_val = self.t_val
         self.past_t_offset = self.t_offset
-        self.past_t_dest_path = deepcopy(self.t_dest_path)
+        self.past_t_dest_path = self.t_dest_path
         self.past_t_dest_offset = self.t_dest_offset
         self.past_t_noop = False
-        self.valid_hazard_shifted_cache = False
+        self.hazard_shift_cs = None
+
+    def _shift_t_path(self, index, shift):
+        """
+        Shift the piece of t_path at index. t_path may be shared with the
+        original path, or with past_t_path, so it is copied first.
+        """
+        t_path = self.t_path[:]
+        t_path[index] += shift
+        self.t_path = t_path
 
-    def ot(self, pc):
+    def ot(self, pc, split_at=None):
         """
         pc: Changeset - previous changeset which has been applied but
         was not a dependency of this operation. This operation needs
         to be transformed to accomidate pc.
+
+        split_at: Op - when this op was split off another one while it was
+        being transformed by the op split_at from pc, it is only transformed
+        by the ops of pc after that.
         """
-        for op in pc.get_ops():
+        transforms = self.get_transform_table()
+        past_ops = pc.get_ops()
+        if split_at is not None:
+            past_ops = past_ops[past_ops.index(split_at) + 1:]
+        for op in past_ops:
             #if op.is_noop():
             #    continue
-            func_name = self.json_opperations[op.action]
-            transform_function = getattr(self, func_name)
+            if op.is_commutative():
+                # never changes this op, and never holds hazards
+                continue
+            transform_function = transforms.get(op.action)
+            if transform_function is None:
+                raise Exception("No transform for a past '%s' op." % op.action)
             op.process_for_future_ot(self)
             if op.past_t_noop:
                 continue
-            hazard = transform_function(op)
+            hazard = transform_function(self, op)
             if hazard:
                 op.add_new_hazard(hazard)
 
+    @classmethod
+    def get_transform_table(cls):
+        """
+        Get the table mapping each action to the function which transforms
+        this class of Op by a past Op with that action, so ot looks up
+        transforms there instead of by name. Each class builds its own table
+        the first time it is asked for, so a subclass never ends up with its
+        parent's.
+        """
+        table = cls.__dict__.get('_transform_table')
+        if table is None:
+            table = {}
+            for action, func_name in cls.json_opperations.items():
+                table[action] = getattr(cls, func_name).__func__
+            cls._transform_table = table
+        return table
+
     def add_new_hazard(self, hazard):
         if hazard._is_between_branches:
+            if not self.hazards_between_branches:
+                self.hazards_between_branches = []
             self.hazards_between_branches.append(hazard)
         else:
+            if not self.hazards:
+                self.hazards = []
             self.hazards.append(hazard)
+            self._register_hazard(hazard)
+        # the past_t_* values stay hazard shifted for the same changeset if
+        # that changeset would have applied this hazard last anyway
+        if not self._hazard_is_relevant_for_cs(hazard, self.hazard_shift_cs):
+            self.hazard_shift_cs = None
         self.apply_hazard(hazard)
 
     def apply_hazard(self, hazard):
@@ -348,19 +459,21 @@ class Op(object):
         """
         Prepare this Op for transforming a future Op by applying all
         :class:`Hazards<Hazard>` and storing the resulting values.
+
+        Which hazards apply only depends on the future Op's changeset, so the
+        values are kept for the next Op from the same changeset, until this
+        Op's transformations or hazards change.
         """
         cs = op.get_changeset()
-        if cs and not cs.is_singly_linked_with_parent():
-            self.valid_hazard_shifted_cache = False
-        #if self.valid_hazard_shifted_cache:
-        #    return
+        if cs and cs is self.hazard_shift_cs:
+            return
         self.reset_hazard_transformations()
         for hazard in self.hazards:
-            if self.hazard_is_relevant_for_ot(hazard, op):
+            if self._hazard_is_relevant_for_cs(hazard, cs):
                 self.apply_hazard(hazard)
             if self.past_t_noop:
                 break
-        self.valid_hazard_shifted_cache = True
+        self.hazard_shift_cs = cs
 
     def set_transform(self, op):
         """
@@ -376,6 +489,22 @@ class Op(object):
         if op_path == self.t_path[:len(op_path)]:
             self.noop = True
 
+    def boolean_negation_transform(self, op):
+        """
+        Transform this opperation when a previously unknown opperation
+        negated a boolean. Negations only change the value at their own
+        path, so nothing ever needs to be done.
+        """
+        return False
+
+    def number_add_transform(self, op):
+        """
+        Transform this opperation when a previously unknown opperation
+        added to a number. Like boolean negations, nothing ever needs to be
+        done.
+        """
+        return False
+
     def string_insert_transform(self, op):
         """
         Transform this opperation when a previously unknown opperation
@@ -408,7 +537,7 @@ class Op(object):
         path_index = len(past_t_path)  # the only path peice that might move
         if past_t_path == self.t_path[:path_index]:
             if past_t_offset <= self.t_path[path_index]:
-                self.t_path[path_index] += len(past_t_val)
+                self._shift_t_path(path_index, len(past_t_val))
         return hazard
 
     def array_delete_transform(self, op):
@@ -431,7 +560,25 @@ class Op(object):
                 self.set_value_to_nil()
                 return
             if not self.t_path[path_index] < past_t_offset:
-                self.t_path[path_index] -= past_t_val
+                self._shift_t_path(path_index, -past_t_val)
+        return False
+
+    def array_move_transform(self, op):
+        """
+        Previous op moved an element of an array. If this op's path goes
+        through that array, the path follows the element it went through.
+        """
+        past_t_path, past_t_offset, past_t_val = \
+            op.past_t_path, op.past_t_offset, op.past_t_val
+
+        if len(self.t_path) <= len(past_t_path):
+            return False
+        path_index = len(past_t_path)  # the only path peice that might move
+        if past_t_path == self.t_path[:path_index]:
+            index = self.t_path[path_index]
+            new_index = move_index(index, past_t_offset, past_t_val)
+            if new_index != index:
+                self._shift_t_path(path_index, new_index - index)
         return False
 
     def object_insert_transform(self, op):
@@ -521,9 +668,47 @@ class Op(object):
             for prev_op in prev_cs.get_ops():
                 if prev_op in needed_val_shifts:
                     continue
-                h = Hazard(prev_op, op, self, offset_shift=overlap)
+                if prev_op.is_array_move():
+                    # the destination was shifted back twice as well
+                    h = Hazard(prev_op, op, self, offset_shift=overlap,
+                               val_shift=overlap)
+                else:
+                    h = Hazard(prev_op, op, self, offset_shift=overlap)
                 prev_op.add_interbranch_hazard(h)
 
+    def add_undo_hazards_to_common_prev_ops(self, op, undone_op):
+        """
+        Self and op both shifted the previous ops which neither of them
+        accounted for, but for ops which know about both, the shifts made by
+        undone_op (either self or op) do not happen, like when self and op
+        move the same element, or one deletes the element the other moves.
+        Add hazards to those previous ops undoing them.
+        """
+        cs = self.get_changeset()
+        if not cs:
+            return
+        other_op = op if undone_op is self else self
+        self_ucs = set(cs.get_unaccounted_changesets())
+        op_ucs = set(op.get_changeset().get_unaccounted_changesets())
+        for prev_cs in self_ucs.intersection(op_ucs):
+            for prev_op in prev_cs.get_ops():
+                for h in list(prev_op.hazards):
+                    if not h.get_conflict_op() is undone_op or \
+                       h.is_interbranch_hazard():
+                        continue
+                    offset_shift = h.get_offset_shift()
+                    val_shift = h.get_val_shift()
+                    if not (offset_shift or val_shift):
+                        continue
+                    if offset_shift:
+                        offset_shift = -offset_shift
+                    if val_shift:
+                        val_shift = -val_shift
+                    uh = Hazard(prev_op, undone_op, other_op,
+                                offset_shift=offset_shift,
+                                val_shift=val_shift)
+                    prev_op.add_interbranch_hazard(uh)
+
     def transform_delete_by_previous_delete(self, op,
                                             past_t_offset, past_t_val):
         """
@@ -828,6 +1013,59 @@ class Op(object):
                 self.noop = True
         return False
 
+    def compose(self, op):
+        """
+        Try to merge op, which comes right after this Op, into this Op so
+        that this one Op does the work of both. This is only done while both
+        are local ops in an open changeset, before any OT has touched them.
+        Fewer ops means fewer transformations and Hazards later on.
+
+        :param op: The next :class:`Op` in the changeset
+        :returns: True if op was merged in and can be thrown away
+        """
+        return False
+
+    def _set_composed_value(self, offset, val):
+        self.offset = offset
+        self.val = val
+        self.reset_transformations()
+        self.reset_hazard_transformations()
+
+    def _compose_insert(self, op, is_insert, is_delete):
+        """
+        Merge an insert (is_insert) landing within or right next to the
+        inserted value, or a delete (is_delete) which only removes part of
+        the inserted value.
+        """
+        if op.path != self.path:
+            return False
+        start = op.offset - self.offset
+        if is_insert and 0 <= start <= len(self.val):
+            self._set_composed_value(self.offset, self.val[:start] + op.val +
+                                     self.val[start:])
+            return True
+        if is_delete and start >= 0 and start + op.val <= len(self.val) and \
+                op.val < len(self.val):
+            self._set_composed_value(self.offset, self.val[:start] +
+                                     self.val[start + op.val:])
+            return True
+        return False
+
+    def _compose_delete(self, op, is_delete):
+        """
+        Merge a delete which picks up where this one left off, either at the
+        same offset (delete key) or just before it (backspace).
+        """
+        if not is_delete or op.path != self.path:
+            return False
+        if op.offset == self.offset:
+            self._set_composed_value(self.offset, self.val + op.val)
+            return True
+        if op.offset + op.val == self.offset:
+            self._set_composed_value(op.offset, self.val + op.val)
+            return True
+        return False
+
     def is_string_delete(self):
         return False
 
@@ -843,6 +1081,23 @@ class Op(object):
     def is_array_delete(self):
         return False
 
+    def is_array_move(self):
+        return False
+
+    def is_number_add(self):
+        return False
+
+    def is_boolean_negation(self):
+        return False
+
+    def is_commutative(self):
+        """
+        Determine if applying this Op before or after any other Op gives
+        exactly the same document. Such an Op never transforms other Ops,
+        and it can be applied out of order.
+        """
+        return False
+
     json_opperations = {
         'set': 'set_transform',
         'bn': 'boolean_negation_transform',
@@ -859,7 +1114,7 @@ class Op(object):
 
 
 class SetOp(Op):
-    pass
+    __slots__ = ()
     # def __init__(self, *args, **kwargs):
     #     super().__init__(args, kwargs)
 
@@ -868,5 +1123,9 @@ from .string_delete_op import StringDeleteOp
 from .string_move_op import StringMoveOp
 from .array_insert_op import ArrayInsertOp
 from .array_delete_op import ArrayDeleteOp
+from .array_move_op import ArrayMoveOp, move_index
 from .object_insert_op import ObjectInsertOp
 from .object_delete_op import ObjectDeleteOp
+from .number_add_op import NumberAddOp
+from .boolean_negation_op import BooleanNegationOp
+
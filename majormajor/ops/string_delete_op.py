@@ -19,12 +19,17 @@ from .op import Op
 
 
 class StringDeleteOp(Op):
+    __slots__ = ()
+
     def is_string_delete(self):
         return True
 
     def set_value_to_nil(self):
         self.t_val = 0
 
+    def compose(self, op):
+        return self._compose_delete(op, op.is_string_delete())
+
     def string_insert_transform(self, op):
         past_t_path, past_t_offset, past_t_val \
             = op.past_t_path, op.past_t_offset, op.past_t_val
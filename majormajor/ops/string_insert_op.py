@@ -19,6 +19,7 @@ from .op import Op
 
 
 class StringInsertOp(Op):
+    __slots__ = ()
 
     def is_string_insert(self):
         return True
@@ -26,6 +27,10 @@ class StringInsertOp(Op):
     def set_value_to_nil(self):
         self.t_val = ''
 
+    def compose(self, op):
+        return self._compose_insert(op, op.is_string_insert(),
+                                    op.is_string_delete())
+
     def string_insert_transform(self, op):
         past_t_path, past_t_offset, past_t_val = \
             op.past_t_path, op.past_t_offset, op.past_t_val
@@ -19,5 +19,7 @@ from .op import Op
 
 
 class StringMoveOp(Op):
+    __slots__ = ()
+
     def is_string_move(self):
         return True
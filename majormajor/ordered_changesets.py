@@ -0,0 +1,229 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+
+class _Node(object):
+    __slots__ = ['item', 'priority', 'left', 'right', 'parent', 'size']
+
+    def __init__(self, item):
+        self.item = item
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.parent = None
+        self.size = 1
+
+
+def _size(node):
+    return node.size if node else 0
+
+
+class OrderedChangesets(object):
+    """
+    The ordered list of changesets in a document, kept in a treap (a
+    randomly balanced binary tree) where each node knows the size of its
+    subtree.
+
+    It behaves like a list, but inserting at a position, getting the item at
+    a position, and finding the position of an item are all O(log n), and
+    membership is O(1). Iterating from any position costs O(log n) to get
+    started, then constant time per item. Each changeset can only appear
+    once.
+    """
+    def __init__(self, items=None):
+        self.root = None
+        self.nodes = {}
+        if items:
+            for item in items:
+                self.append(item)
+
+    def __len__(self):
+        return _size(self.root)
+
+    def __contains__(self, item):
+        return item in self.nodes
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def __reversed__(self):
+        return self.iter_reversed_from(len(self) - 1)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return list(self)[i]
+            items = []
+            for item in self.iter_from(start):
+                if len(items) >= stop - start:
+                    break
+                items.append(item)
+            return items
+        return self._get_node(i).item
+
+    def __repr__(self):
+        return "OrderedChangesets(" + repr(list(self)) + ")"
+
+    def _get_node(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError("OrderedChangesets index out of range")
+        node = self.root
+        while True:
+            left_size = _size(node.left)
+            if i < left_size:
+                node = node.left
+            elif i == left_size:
+                return node
+            else:
+                i -= left_size + 1
+                node = node.right
+
+    def index(self, item):
+        """
+        Get the position of item. Raises ValueError if it is not here.
+        """
+        if not item in self.nodes:
+            raise ValueError("Changeset is not in OrderedChangesets")
+        node = self.nodes[item]
+        i = _size(node.left)
+        while node.parent:
+            if node is node.parent.right:
+                i += _size(node.parent.left) + 1
+            node = node.parent
+        return i
+
+    def append(self, item):
+        self.insert(len(self), item)
+
+    def insert(self, i, item):
+        """
+        Insert item so that it ends up at position i. Like list.insert, a
+        position past the end appends.
+        """
+        if item in self.nodes:
+            raise ValueError("Changeset is already in OrderedChangesets")
+        n = len(self)
+        if i < 0:
+            i = max(i + n, 0)
+        i = min(i, n)
+        new_node = _Node(item)
+        self.nodes[item] = new_node
+        if self.root is None:
+            self.root = new_node
+            return
+
+        # walk down to the leaf where the new node belongs, counting it in
+        # the size of every subtree along the way.
+        node = self.root
+        while True:
+            node.size += 1
+            left_size = _size(node.left)
+            if i <= left_size:
+                if node.left is None:
+                    node.left = new_node
+                    break
+                node = node.left
+            else:
+                i -= left_size + 1
+                if node.right is None:
+                    node.right = new_node
+                    break
+                node = node.right
+        new_node.parent = node
+
+        # then rotate it up until the heap property on priorities holds.
+        while new_node.parent and \
+                new_node.priority > new_node.parent.priority:
+            self._rotate_up(new_node)
+
+    def _rotate_up(self, node):
+        parent = node.parent
+        grandparent = parent.parent
+        if node is parent.left:
+            parent.left = node.right
+            if node.right:
+                node.right.parent = parent
+            node.right = parent
+        else:
+            parent.right = node.left
+            if node.left:
+                node.left.parent = parent
+            node.left = parent
+        parent.parent = node
+        node.parent = grandparent
+        if grandparent is None:
+            self.root = node
+        elif grandparent.left is parent:
+            grandparent.left = node
+        else:
+            grandparent.right = node
+        parent.size = _size(parent.left) + _size(parent.right) + 1
+        node.size = _size(node.left) + _size(node.right) + 1
+
+    def iter_from(self, i):
+        """
+        Iterate over the changesets from position i to the end.
+        """
+        if i < 0:
+            i = max(i + len(self), 0)
+        # stack of nodes still to be visited, innermost last
+        stack = []
+        node = self.root
+        while node:
+            left_size = _size(node.left)
+            if i <= left_size:
+                stack.append(node)
+                node = node.left
+            else:
+                i -= left_size + 1
+                node = node.right
+        while stack:
+            node = stack.pop()
+            yield node.item
+            node = node.right
+            while node:
+                stack.append(node)
+                node = node.left
+
+    def iter_reversed_from(self, i):
+        """
+        Iterate backwards over the changesets from position i to the start.
+        """
+        if i >= len(self):
+            i = len(self) - 1
+        stack = []
+        node = self.root
+        while node:
+            left_size = _size(node.left)
+            if i >= left_size:
+                stack.append(node)
+                i -= left_size + 1
+                node = node.right
+            else:
+                node = node.left
+        while stack:
+            node = stack.pop()
+            yield node.item
+            node = node.left
+            while node:
+                stack.append(node)
+                node = node.right
@@ -0,0 +1,133 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+class Rope(object):
+    """
+    A string which can have text inserted and deleted without copying the
+    whole thing each time.
+
+    The text is kept as a list of chunks of about CHUNK_SIZE characters.
+    Inserting or deleting only rebuilds the chunks it touches, and finding
+    the chunk for an offset starts from wherever the last edit was, so a run
+    of nearby edits, like typing, does not have to search far. Joining the
+    chunks back into a single string only happens when it is asked for, and
+    is cached until the next edit.
+    """
+    CHUNK_SIZE = 512
+
+    def __init__(self, text=''):
+        size = self.CHUNK_SIZE
+        self.chunks = [text[i:i + size] for i in xrange(0, len(text), size)]
+        self.length = len(text)
+        self.empty = text[:0]
+        self.string_cache = text
+        # (index, offset) of the chunk where the last edit started
+        self.cursor = (0, 0)
+
+    def __len__(self):
+        return self.length
+
+    def to_string(self):
+        """
+        Get the whole text as a normal string.
+        """
+        if self.string_cache is None:
+            self.string_cache = self.empty.join(self.chunks)
+        return self.string_cache
+
+    def find_chunk(self, offset):
+        """
+        Get the index of the chunk which holds offset, and the offset at
+        which that chunk starts. An offset at the end of a chunk belongs to
+        that chunk, so text can be added onto its end.
+        """
+        chunks = self.chunks
+        i, start = self.cursor
+        if i >= len(chunks):
+            i, start = 0, 0
+        while offset < start:
+            i -= 1
+            start -= len(chunks[i])
+        while i < len(chunks) - 1 and offset > start + len(chunks[i]):
+            start += len(chunks[i])
+            i += 1
+        self.cursor = (i, start)
+        return i, start
+
+    def insert(self, offset, text):
+        if not text:
+            return
+        offset = min(max(offset, 0), self.length)
+        self.string_cache = None
+        self.length += len(text)
+        if not self.chunks:
+            self.chunks = Rope(text).chunks
+            return
+        i, start = self.find_chunk(offset)
+        chunk = self.chunks[i]
+        k = offset - start
+        chunk = chunk[:k] + text + chunk[k:]
+        if len(chunk) <= 2 * self.CHUNK_SIZE:
+            self.chunks[i] = chunk
+        else:
+            self.chunks[i:i + 1] = Rope(chunk).chunks
+
+    def delete(self, offset, length):
+        offset = min(max(offset, 0), self.length)
+        length = min(length, self.length - offset)
+        if length <= 0:
+            return
+        self.string_cache = None
+        self.length -= length
+        i, start = self.find_chunk(offset)
+        k = offset - start
+        first = i
+        while length > 0:
+            chunk = self.chunks[i]
+            removed = min(length, len(chunk) - k)
+            self.chunks[i] = chunk[:k] + chunk[k + removed:]
+            length -= removed
+            k = 0
+            i += 1
+        # drop chunks which were emptied, and merge a chunk which was left
+        # small into the next one.
+        self.chunks[first:i] = [c for c in self.chunks[first:i] if c]
+        if first < len(self.chunks) - 1 and \
+                len(self.chunks[first]) < self.CHUNK_SIZE // 2:
+            self.chunks[first:first + 2] = [self.chunks[first] +
+                                            self.chunks[first + 1]]
+
+    def slice(self, start, stop):
+        """
+        Get the text from start to stop, like slicing a string.
+        """
+        start = min(max(start, 0), self.length)
+        stop = min(max(stop, start), self.length)
+        if start == stop:
+            return self.empty
+        if self.string_cache is not None:
+            return self.string_cache[start:stop]
+        i, chunk_start = self.find_chunk(start)
+        pieces = []
+        while chunk_start < stop:
+            chunk = self.chunks[i]
+            pieces.append(chunk[max(start - chunk_start, 0):
+                                stop - chunk_start])
+            chunk_start += len(chunk)
+            i += 1
+        return self.empty.join(pieces)
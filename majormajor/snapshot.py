@@ -16,27 +16,146 @@
 
 import copy
 
+from .rope import Rope
+from .checkpoints import estimate_size
+
+
+# Strings at least this long are edited as Ropes.
+ROPE_THRESHOLD = 1024
+
 
 class Snapshot:
-    def __init__(self):
+    """
+    Strings which are long enough are stored as Ropes while they are being
+    edited, so each string insert or delete does not copy the whole
+    string. Anything reading the snapshot from outside gets normal strings,
+    since the Ropes are turned back into strings when the snapshot, or a
+    value or node in it, is asked for.
+
+    A persistent Snapshot makes copies without copying any data. A copy is
+    the current tree itself, which is frozen from then on: before an op
+    changes it, each dict and list on the op's path is copied once, and the
+    copy is changed instead. Copies share every subtree no op has touched
+    since, so checkpoints and baselines to diff against are cheap to take.
+    Nothing may change a copy, so copies must be put back with
+    set_snapshot_copy.
+    """
+    def __init__(self, persistent=False):
         self.snapshot = {}
+        self.has_ropes = False
+        self.persistent = persistent
+        # Once frozen, only dicts and lists in owned (by id) are safe to
+        # change. unshared_size estimates the data not shared with the last
+        # copy, or is None if nothing is shared.
+        self.frozen = False
+        self.owned = {}
+        self.unshared_size = None
+        self.copy_size = None
+        # How many string or array ops reached past the end of their value,
+        # and so did less than they say.
+        self.clipped_ops = 0
 
     def get_snapshot(self):
         """
         Returns a shallow copy of the document's snapshot.
         """
+        self.materialize()
         return self.snapshot
 
     def get_snapshot_copy(self):
         """
-        Returns a deep copy of the document's snapshot.
+        Returns a copy of the document's snapshot, which later ops do not
+        change. A persistent Snapshot shares the data with the copy, so the
+        copy must not be changed either.
+        """
+        self.materialize()
+        if not self.persistent:
+            return copy.deepcopy(self.snapshot)
+        if self.unshared_size is None:
+            self.unshared_size = estimate_size(self.snapshot)
+        self.copy_size = self.unshared_size
+        self.freeze()
+        return self.snapshot
+
+    def get_copy_size(self):
+        """
+        Roughly how many bytes the last copy from get_snapshot_copy takes up
+        without the data it shares with earlier copies. None if copies do not
+        share data.
         """
-        return copy.deepcopy(self.snapshot)
+        return self.copy_size
 
     def set_snapshot(self, snapshot):
         """
         """
         self.snapshot = snapshot
+        self.has_ropes = False
+        self.frozen = False
+        self.owned = {}
+        self.unshared_size = None
+
+    def set_snapshot_copy(self, snapshot):
+        """
+        Start from a copy made by get_snapshot_copy, without changing it.
+        """
+        if not self.persistent:
+            self.set_snapshot(copy.deepcopy(snapshot))
+            return
+        self.set_snapshot(snapshot)
+        self.freeze()
+
+    def freeze(self):
+        self.frozen = True
+        self.owned = {}
+        self.unshared_size = 0
+
+    def _own_path(self, path):
+        """
+        Copy every frozen dict or list from the root down to path, so the
+        copies can be changed without changing any earlier snapshot copy.
+        """
+        node = self.snapshot
+        if self._is_shared(node):
+            node = self._copy_node(node)
+            self.snapshot = node
+        for key in path:
+            child = node[key]
+            if self._is_shared(child):
+                child = self._copy_node(child)
+                node[key] = child
+            node = child
+
+    def _is_shared(self, node):
+        return isinstance(node, (dict, list)) and id(node) not in self.owned
+
+    def _copy_node(self, node):
+        new = dict(node) if isinstance(node, dict) else list(node)
+        self.owned[id(new)] = new
+        self._add_unshared(64 + 16 * len(new))
+        return new
+
+    def _add_unshared(self, size):
+        if self.unshared_size is not None:
+            self.unshared_size += size
+
+    def materialize(self):
+        """
+        Replace every Rope in the snapshot with its string.
+        """
+        if self.has_ropes:
+            self.snapshot = self._materialize_node(self.snapshot)
+            self.has_ropes = False
+
+    def _materialize_node(self, node):
+        if isinstance(node, Rope):
+            return node.to_string()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                node[key] = self._materialize_node(value)
+        elif isinstance(node, list):
+            for i, value in enumerate(node):
+                node[i] = self._materialize_node(value)
+        return node
 
     def contains_path(self, path):
         """
@@ -44,7 +163,7 @@ class Snapshot:
         """
         node = self.snapshot
         for i in path:
-            if isinstance(i, str):
+            if isinstance(i, basestring):
                 if not isinstance(node, dict):
                     return False
                 if not i in node:
@@ -58,16 +177,55 @@ class Snapshot:
         return True
 
     def get_node(self, path):
+        self.materialize()
+        return self._get_node(path)
+
+    def get_value(self, path):
+        self.materialize()
+        return self._get_value(path)
+
+    def get_value_copy(self, path, start=None, stop=None):
+        """
+        Copy the value at path, or only its characters or items from start to
+        stop, without materializing the whole snapshot. Ropes in the copy are
+        strings.
+        """
+        value = self._get_value(path)
+        if start is not None:
+            if isinstance(value, Rope):
+                return value.slice(start, stop)
+            value = value[start:stop]
+        return self._copy_out(value)
+
+    def _copy_out(self, node):
+        if isinstance(node, Rope):
+            return node.to_string()
+        if isinstance(node, dict):
+            return dict((k, self._copy_out(v)) for k, v in node.items())
+        if isinstance(node, list):
+            return [self._copy_out(v) for v in node]
+        return node
+
+    def _get_node(self, path):
         node = self.snapshot
         if len(path) != 0:
             for i in path[:-1]:
                 node = node[i]
         return node
 
-    def get_value(self, path):
+    def _get_value(self, path):
+        """
+        Like get_value, but strings being edited may be Ropes.
+        """
         if len(path) == 0:
             return self.snapshot
-        return self.get_node(path)[path[-1]]
+        return self._get_node(path)[path[-1]]
+
+    def _set_value(self, path, value):
+        if len(path) == 0:
+            self.snapshot = value
+        else:
+            self._get_node(path)[path[-1]] = value
 
     def apply_op(self, op):
         if not self.contains_path(op.t_path):
@@ -76,42 +234,236 @@ class Snapshot:
         if op.is_noop():
             return
 
+        if op.is_array_move() and not self._has_move_offset(op):
+            # there is no element to move, so the op cannot be applied
+            self.clipped_ops += 1
+            return "ERROR!"
+
+        if self.frozen:
+            self._own_path(op.t_path)
+            if op.is_string_move():
+                self._own_path(op.t_dest_path)
+
         if op.is_string_move():
             self.string_move(op)
             return
-        func_name = self.json_opperations[op.action]
-        func = getattr(self, func_name)
-        if len(op.t_path) == 0:
-            self.snapshot = func(op)
+        func = self.apply_functions[op.action]
+        self._set_value(op.t_path, func(self, op))
+
+    def get_lengths(self, paths):
+        """
+        Get the length of each string or array at one of the given paths, by
+        path as a tuple.
+        """
+        lengths = {}
+        for path in paths:
+            if self.contains_path(path):
+                value = self._get_value(path)
+                if isinstance(value, (list, basestring, Rope)):
+                    lengths[tuple(path)] = len(value)
+        return lengths
+
+    def get_key_values(self, events):
+        """
+        Get whether each key an object insert or delete among the events
+        inserts or deletes is in its object, and a copy of its value if so,
+        by the key's path as a tuple.
+        """
+        values = {}
+        for event in events:
+            if not event[0] in OBJECT_ACTIONS:
+                continue
+            path, key = event[1], event[2]
+            if self.contains_path(path) and key in self._get_value(path):
+                values[tuple(path) + (key,)] = \
+                    (True, self.get_value_copy(path + [key]))
+            else:
+                values[tuple(path) + (key,)] = (False, None)
+        return values
+
+    def get_change_events(self, old_events, new_events, old_lengths,
+                          old_values):
+        """
+        Get change events (see Op.to_change_event) which turn the snapshot as
+        it was before a run of ops was transformed again into the snapshot as
+        it is now, without needing a copy of the snapshot from before.
+
+        old_events are the run's ops as they were applied before, and
+        new_events the ops as they are applied now, both starting from the
+        same state. old_lengths are the lengths of the strings and arrays at
+        the events' paths from before, see get_lengths, or None if some of the
+        new ops were clipped, so lengths cannot be worked out from the ops.
+        old_values are whether the keys the object inserts and deletes are at
+        were there before, and what their values were, see get_key_values.
+
+        Anything neither list touches is the same before and after, so the
+        events only cover the parts the ops touch: ops on a string or array
+        give the range from the first to the last position they touch, and
+        other ops give the whole value they changed.
+        """
+        events = []
+        if old_events or new_events:
+            self._add_change_events([], old_events, new_events, old_lengths,
+                                    old_values, events)
+        return events
+
+    def _add_change_events(self, path, old_events, new_events, old_lengths,
+                           old_values, events):
+        path = _get_common_path(path, old_events + new_events)
+        if not self.contains_path(path):
+            # never existed, so every op here was skipped
+            return
+        node = self._get_value(path)
+        n = len(path)
+        actions = set([])
+        has_deeper_events = False
+        for event in old_events + new_events:
+            if len(event) > 4:
+                actions.add(event[0])
+            elif len(event[1]) == n:
+                actions.add(event[0])
+            else:
+                has_deeper_events = True
+
+        if isinstance(node, dict) and actions <= OBJECT_ACTIONS:
+            self._add_keyed_change_events(path, node, old_events,
+                                          new_events, old_lengths,
+                                          old_values, events)
+        elif isinstance(node, list) and not actions:
+            self._add_keyed_change_events(path, node, old_events,
+                                          new_events, old_lengths,
+                                          old_values, events)
+        elif isinstance(node, list) and actions <= ARRAY_ACTIONS:
+            self._add_range_change_events(path, node, old_events,
+                                          new_events, old_lengths, events,
+                                          'ai', 'ad')
+        elif isinstance(node, (basestring, Rope)) and \
+                actions <= STRING_ACTIONS and not has_deeper_events:
+            self._add_range_change_events(path, node, old_events,
+                                          new_events, old_lengths, events,
+                                          'si', 'sd')
         else:
-            node = self.get_node(op.t_path)
-            node[op.t_path[-1]] = func(op)
+            events.append(('set', path, None, self.get_value_copy(path)))
+
+    def _add_keyed_change_events(self, path, node, old_events, new_events,
+                                 old_lengths, old_values, events):
+        """
+        Keys of a dict, or indexes of an array no op inserts into or deletes
+        from, do not shift, so each one touched is looked at on its own. A key
+        an object insert or delete is at only gets an event if it is not as
+        it was before, which may be the case even though ops did change it.
+        """
+        n = len(path)
+        keys = []
+        by_key = {}
+        replaced_keys = set([])
+        for events_i, run in enumerate((old_events, new_events)):
+            for event in run:
+                if len(event[1]) == n:
+                    # object insert or delete
+                    key = event[2]
+                    replaced_keys.add(key)
+                else:
+                    key = event[1][n]
+                if not key in by_key:
+                    keys.append(key)
+                    by_key[key] = ([], [])
+                by_key[key][events_i].append(event)
+        key_events = []
+        for key in keys:
+            if key in replaced_keys:
+                old = old_values.get(tuple(path) + (key,))
+                if old is None:
+                    # no way to tell what changed
+                    events.append(('set', path, None,
+                                   self.get_value_copy(path)))
+                    return
+                was_in_node, old_value = old
+                if key in node:
+                    value = self.get_value_copy(path + [key])
+                    if not was_in_node or \
+                            not _is_same_value(old_value, value):
+                        key_events.append(('oi', path, key, value))
+                elif was_in_node:
+                    key_events.append(('od', path, key, None))
+            else:
+                old_key_events, new_key_events = by_key[key]
+                self._add_change_events(path + [key], old_key_events,
+                                        new_key_events, old_lengths,
+                                        old_values, key_events)
+        events.extend(key_events)
+
+    def _add_range_change_events(self, path, node, old_events, new_events,
+                                 old_lengths, events, insert_action,
+                                 delete_action):
+        """
+        The ops insert, delete or move within the string or array at path, or
+        change its elements. Its start up to the first position any op
+        touches, and its end from the last, are the same before and after, so
+        only the range between them is replaced.
+
+        The lengths along the way are worked out from the ops, which only
+        works if none of them were clipped. If the new ops were, there are no
+        old_lengths. If the old ops were, the old length does not come out
+        right.
+        """
+        if old_lengths is None:
+            events.append(('set', path, None, self.get_value_copy(path)))
+            return
+        n = len(path)
+        new_length = len(node)
+        start_length = new_length - sum(_get_length_change(event, n)
+                                        for event in new_events)
+        old_length = start_length + sum(_get_length_change(event, n)
+                                        for event in old_events)
+        head, tail = new_length, new_length
+        for run in (old_events, new_events):
+            length = start_length
+            for event in run:
+                touched = _get_touched_range(event, n, length)
+                if touched is None:
+                    events.append(('set', path, None,
+                                   self.get_value_copy(path)))
+                    return
+                head = min(head, touched[0])
+                tail = min(tail, touched[1])
+                length += _get_length_change(event, n)
+        if old_lengths.get(tuple(path)) != old_length:
+            events.append(('set', path, None, self.get_value_copy(path)))
+            return
+        if old_length - head - tail > 0:
+            events.append((delete_action, path, head,
+                           old_length - head - tail))
+        if new_length - head - tail > 0:
+            events.append((insert_action, path, head,
+                           self.get_value_copy(path, head,
+                                               new_length - tail)))
 
     # JSON Opperation - wholesale replacing value at a given path
     def set_value(self, op):
-        return copy.deepcopy(op.t_val)
+        return self._copy_value(op.t_val)
 
     # JSON Opperation - Flip the value of the boolean at the given path
     def boolean_negation(self, op):
-        cur = self.get_value(op.t_path)
+        cur = self._get_value(op.t_path)
         return False if cur else True
 
     # JSON Opperation - Add some constant value to the number at the given path
     def number_add(self, op):
-        return self.get_value(op.t_path) + op.val
+        return self._get_value(op.t_path) + op.val
 
     # JSON Opperation - Insert characters into a string at the given
     # path, and at the given offset within that string.
     def string_insert(self, op):
-        cur = self.get_value(op.t_path)
-        return  cur[:op.t_offset] + op.t_val + cur[op.t_offset:]
+        cur = self._get_value(op.t_path)
+        return self._insert_text(cur, op.t_offset, op.t_val)
 
     # JSON Opperation - Delete given number of characters from a
     # string at the given path, and at the given offset within that
     # string.
     def string_delete(self, op):
-        cur = self.get_value(op.t_path)
-        return cur[:op.t_offset] + cur[op.t_offset + op.t_val:]
+        cur = self._get_value(op.t_path)
+        return self._delete_text(cur, op.t_offset, op.t_val)
 
     def string_move(self, op):
         """
@@ -119,52 +471,109 @@ class Snapshot:
         The text can move within a string element, or from one string element
         to another.
         """
-        cur = self.get_value(op.t_path)
-        txt = cur[op.t_offset:op.t_offset + op.t_val]  # text to be moved.
-        remaining_txt = cur[:op.t_offset] + cur[op.t_offset + op.t_val:]
-        # first delete text where it was
-        if op.t_path == []:
-            self.snapshot = remaining_txt
+        cur = self._get_value(op.t_path)
+        # text to be moved.
+        start, stop = op.t_offset, op.t_offset + op.t_val
+        if isinstance(cur, Rope) and start >= 0 and stop >= 0:
+            txt = cur.slice(start, stop)
         else:
-            node = self.get_node(op.t_path)
-            node[op.t_path[-1]] = remaining_txt
+            txt = self._to_text(cur)[start:stop]
+        # first delete text where it was
+        self._set_value(op.t_path,
+                        self._delete_text(cur, op.t_offset, op.t_val))
         # then insert it at the destination
-        dest_v = self.get_value(op.t_dest_path)
-        new_txt = dest_v[:op.t_dest_offset] + txt + dest_v[op.t_dest_offset:]
-        if op.t_dest_path == []:
-            self.snapshot = new_txt
-        else:
-            node = self.get_node(op.t_dest_path)
-            node[op.t_dest_path[-1]] = new_txt
+        dest_v = self._get_value(op.t_dest_path)
+        self._set_value(op.t_dest_path,
+                        self._insert_text(dest_v, op.t_dest_offset, txt))
+
+    def _to_text(self, cur):
+        return cur.to_string() if isinstance(cur, Rope) else cur
 
+    def _insert_text(self, cur, offset, txt):
+        """
+        Insert txt into the string cur, returning the new value. Long
+        strings become Ropes, and Ropes are changed in place.
+        """
+        if offset < 0:
+            # counts back from the end, like slicing a string does
+            cur = self._to_text(cur)
+            return cur[:offset] + txt + cur[offset:]
+        if offset > len(cur):
+            self.clipped_ops += 1
+        if not isinstance(cur, Rope):
+            if len(cur) + len(txt) < ROPE_THRESHOLD:
+                return cur[:offset] + txt + cur[offset:]
+            self._add_unshared(estimate_size(cur))
+            cur = Rope(cur)
+            self.has_ropes = True
+        cur.insert(offset, txt)
+        return cur
+
+    def _delete_text(self, cur, offset, length):
+        if offset < 0 or length < 0:
+            cur = self._to_text(cur)
+            return cur[:offset] + cur[offset + length:]
+        if offset + length > len(cur):
+            self.clipped_ops += 1
+        if not isinstance(cur, Rope):
+            if len(cur) < ROPE_THRESHOLD:
+                return cur[:offset] + cur[offset + length:]
+            self._add_unshared(estimate_size(cur))
+            cur = Rope(cur)
+            self.has_ropes = True
+        cur.delete(offset, length)
+        return cur
+
+    # Arrays are changed in place, so the whole array is not copied for
+    # every op. Values going into the snapshot are copied, since ops keep
+    # their own values and the snapshot may change them in place later.
     def array_insert(self, op):
-        cur = self.get_value(op.t_path)
-        r = cur[:op.t_offset]
-        r.extend(op.t_val)
-        r.extend(cur[op.t_offset:])
-        return r
+        cur = self._get_value(op.t_path)
+        if op.t_offset > len(cur):
+            self.clipped_ops += 1
+        cur[op.t_offset:op.t_offset] = [self._copy_value(v) for v in op.t_val]
+        return cur
 
     def array_delete(self, op):
-        cur = self.get_value(op.t_path)
-        r = cur[:op.t_offset]
-        r.extend(cur[op.t_offset + op.t_val:])
-        return r
+        cur = self._get_value(op.t_path)
+        if op.t_offset < 0 or op.t_val < 0:
+            # keep the meaning these have when slicing
+            r = cur[:op.t_offset]
+            r.extend(cur[op.t_offset + op.t_val:])
+            return r
+        if op.t_offset + op.t_val > len(cur):
+            self.clipped_ops += 1
+        del cur[op.t_offset:op.t_offset + op.t_val]
+        return cur
+
+    def _has_move_offset(self, op):
+        cur = self._get_value(op.t_path)
+        return -len(cur) <= op.t_offset < len(cur)
 
     def array_move(self, op):
-        cur = self.get_value(op.path)
-        item = cur.pop(op.offset)
-        r = cur[:op.val]
-        r.append(item)
-        r.extend(cur[op.val:])
-        return r
+        cur = self._get_value(op.t_path)
+        item = cur.pop(op.t_offset)
+        if op.t_val > len(cur):
+            self.clipped_ops += 1
+        cur.insert(op.t_val, item)
+        return cur
 
     def object_insert(self, op):
-        cur = self.get_value(op.t_path)
-        cur[op.t_offset]  = op.t_val
+        cur = self._get_value(op.t_path)
+        cur[op.t_offset] = self._copy_value(op.t_val)
         return cur
 
+    def _copy_value(self, value):
+        if not isinstance(value, (dict, list)):
+            return value
+        new = copy.deepcopy(value)
+        if self.frozen:
+            self.owned[id(new)] = new
+            self._add_unshared(estimate_size(new))
+        return new
+
     def object_delete(self, op):
-        cur = self.get_value(op.t_path)
+        cur = self._get_value(op.t_path)
         cur.pop(op.t_offset)
         return cur
 
@@ -180,3 +589,92 @@ class Snapshot:
         'oi': 'object_insert',
         'od': 'object_delete'
     }
+
+OBJECT_ACTIONS = frozenset(['oi', 'od'])
+ARRAY_ACTIONS = frozenset(['ai', 'ad', 'am'])
+STRING_ACTIONS = frozenset(['si', 'sd'])
+
+
+def _get_common_path(path, events):
+    """
+    Extend path, which every event is within, as far as all of the events'
+    paths agree.
+    """
+    paths = []
+    for event in events:
+        paths.append(event[1])
+        if len(event) > 4:
+            paths.append(event[4])
+    path = path[:]
+    while all(len(p) > len(path) for p in paths):
+        key = paths[0][len(path)]
+        if any(p[len(path)] != key for p in paths):
+            break
+        path.append(key)
+    return path
+
+
+def _get_length_change(event, n):
+    """
+    How much the event changes the length of the string or array at a path
+    of length n, which the event is at or within.
+    """
+    if len(event[1]) > n:
+        return 0
+    action, val = event[0], event[3]
+    if action in ('si', 'ai'):
+        return len(val)
+    if action in ('sd', 'ad'):
+        return -val
+    return 0
+
+
+def _is_same_value(a, b):
+    """
+    Like a == b, except that values of different types, like True and 1, are
+    never the same.
+    """
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return len(a) == len(b) and \
+            all(k in b and _is_same_value(v, b[k]) for k, v in a.items())
+    if isinstance(a, list):
+        return len(a) == len(b) and \
+            all(_is_same_value(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _get_touched_range(event, n, length):
+    """
+    Get how many positions at the start, and how many at the end, of the
+    string or array at a path of length n the event leaves alone, when it
+    is length long. None if the event is out of range.
+    """
+    action, offset, val = event[0], event[2], event[3]
+    if len(event[1]) > n:
+        index = event[1][n]
+        if isinstance(index, bool) or not isinstance(index, (int, long)) \
+                or not 0 <= index < length:
+            return None
+        return index, length - index - 1
+    if action in ('si', 'ai'):
+        if not 0 <= offset <= length:
+            return None
+        return offset, length - offset
+    if action in ('sd', 'ad'):
+        if not (0 <= offset and 0 <= val and offset + val <= length):
+            return None
+        return offset, length - offset - val
+    if action == 'am':
+        if not (0 <= offset < length and 0 <= val < length):
+            return None
+        return min(offset, val), length - max(offset, val) - 1
+    return None
+
+
+# The functions applying each action, so apply_op need not look them up by
+# name every time.
+Snapshot.apply_functions = dict(
+    (action, getattr(Snapshot, func_name).__func__)
+    for action, func_name in Snapshot.json_opperations.items())
@@ -32,5 +32,12 @@ def build_changeset_from_dict(m, doc=None):
     for j in p['ops']:
         op = Op(j['action'],j['path'],j['val'],j['offset'])
         cs.add_op(op)
+    if 'id' in m:
+        if m['dep_ids']:
+            # only a rebased root can't work out its id from its contents
+            if cs.get_id() != m['id']:
+                raise Exception("Changeset id does not match its contents.")
+        else:
+            cs.set_id(m['id'])
     return cs
 
@@ -102,30 +102,29 @@ class TextViewWindow(Gtk.Window):
         op = Op('sd', [], offset=start.get_offset(), val=val)
         s.document.add_local_op(op)
 
-    def receive_changeset(self, opcodes):
+    def receive_changeset(self, events):
         try:
             self.block_handlers()
-            self.apply_opcodes(opcodes)
+            self.apply_events(events)
         finally:
             self.unblock_handlers()
 
-    def apply_opcodes(self, opcodes):
-        index = 0
-        for op in opcodes:
-            it = self.textbuffer.get_iter_at_offset(op[2] + index)
-            if op[0] == 'insert':
-                self.textbuffer.insert(it, op[3])
-                index += len(op[3])
-            elif op[0] == 'delete':
-                end = self.textbuffer.get_iter_at_offset(op[2] + op[3] + index)
-                self.textbuffer.delete(it, end)
-                index -= op[3]
-            elif op[0] == 'replace':
-                end = self.textbuffer.get_iter_at_offset(op[2] + op[3] + index)
+    def apply_events(self, events):
+        """
+        Apply change events, in order, to the text buffer. The document is one
+        string, so every event is at the root.
+        """
+        for event in events:
+            action, path, offset, val = event[:4]
+            if action == 'si':
+                it = self.textbuffer.get_iter_at_offset(offset)
+                self.textbuffer.insert(it, val)
+            elif action == 'sd':
+                it = self.textbuffer.get_iter_at_offset(offset)
+                end = self.textbuffer.get_iter_at_offset(offset + val)
                 self.textbuffer.delete(it, end)
-                it = self.textbuffer.get_iter_at_offset(op[2] + index)
-                self.textbuffer.insert(it, op[4])
-                index += (len(op[4]) - op[3])
+            elif action == 'set':
+                self.textbuffer.set_text(val)
 
     def test_random_insert(self):
         """
@@ -137,24 +136,25 @@ class TextViewWindow(Gtk.Window):
         if not self.random_insert:
             return True
         doc = self.document
-        old_state = doc.get_snapshot()
         n = random.randint(1, 5)
         o = random.randint(0, len(doc.get_snapshot()))
         if random.random() > .3 or len(doc.get_snapshot()) == 0:
             letters = [random.choice(string.ascii_letters + string.digits)
                        for x in range(n)]
             l = unicode(''.join(letters))
-            doc.add_local_op(Op('si', [], offset=o, val=l))
+            op = Op('si', [], offset=o, val=l)
         else:
             while o + n > len(doc.get_snapshot()):
                 n -= 1
             if o == len(doc.get_snapshot()):
                 o -= 1
                 n = 1
-            doc.add_local_op(Op('sd', [], offset=0, val=n))
+            op = Op('sd', [], offset=0, val=n)
+        # the event is taken before the op can be merged into another
+        event = op.to_change_event()
+        doc.add_local_op(op)
         doc.close_changeset()
-        opcodes = doc.get_diff_opcode(old_state)
-        self.receive_changeset(opcodes)
+        self.receive_changeset([event])
         return True
 
     def receive_snapshot(self, snapshot):
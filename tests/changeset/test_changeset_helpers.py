@@ -14,11 +14,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import random
+
 import pytest
 
 from majormajor.document import Document
 from majormajor.ops.op import Op
-from majormajor.changeset import Changeset
+from majormajor.changeset import Changeset, BranchIndex
+
+from tests.test_utils import build_changeset
 
 
 class TestChangesetHelpers:
@@ -248,3 +252,156 @@ class TestChangesetHelpers:
         assert M.has_ancestor(J)
         assert M.has_ancestor(K)
         assert M.has_ancestor(L)
+
+    def test_has_ancestor_with_missing_dependency(self):
+        """
+        Until every ancestor is known the ancestry index cannot be built, so
+        has_ancestor walks the known parents. Once the missing changeset is
+        linked in, the index takes over.
+        """
+        root = Changeset('dummy', 'user0', [])
+        A = Changeset('dummy', 'user0', [root])
+        B = Changeset('dummy', 'user1', [A, 'missing_id'])
+        assert B.has_ancestor(A)
+        assert B.has_ancestor(root)
+        assert not B.has_ancestor(self.cs0)
+
+        C = Changeset('dummy', 'user2', [root])
+        C.set_id('missing_id')
+        B.relink_parent(C)
+        assert B.has_ancestor(C)
+        assert B.has_ancestor(root)
+        assert not C.has_ancestor(A)
+        assert not A.has_ancestor(C)
+
+    @pytest.mark.parametrize('seed', range(5))
+    def test_has_ancestor_matches_get_ancestors(self, seed):
+        rand = random.Random(seed)
+        css = [Changeset('dummy', 'user0', [])]
+        for i in range(80):
+            recent = css[-10:]
+            parents = rand.sample(recent, min(rand.choice([1, 1, 2, 3]),
+                                              len(recent)))
+            css.append(Changeset('dummy', 'user0', parents))
+        rand.shuffle(css)
+        for cs in css:
+            ancestors = cs.get_ancestors()
+            for other in css:
+                assert cs.has_ancestor(other) == (other in ancestors)
+
+    def test_changesets_ops_and_hazards_are_compact(self):
+        from majormajor.hazards.hazard import Hazard
+        cs = Changeset('doc_id', 'user_id', [])
+        op = Op('si', ['s'], offset=0, val='abc')
+        cs.add_op(op)
+        h = Hazard(op, op, offset_shift=2)
+        for obj in [cs, op, h]:
+            assert not hasattr(obj, '__dict__')
+        # lists which are usually empty are not allocated until needed
+        assert op.hazards == ()
+        assert op.get_val_shifting_ops() == []
+        assert h.is_offset_hazard() and not h.is_val_hazard()
+        assert h.base_cs is cs
+
+    def test_paths_are_disjoint(self):
+        def make_cs(*ops):
+            cs = Changeset('doc_id', 'user_id', [])
+            for op in ops:
+                cs.add_op(op)
+            return cs
+
+        title = make_cs(Op('si', ['title'], offset=0, val='abc'))
+        body = make_cs(Op('sd', ['body', 2, 'text'], offset=1, val=2))
+        other_item = make_cs(Op('si', ['body', 5, 'text'], offset=0, val='x'))
+        body_list = make_cs(Op('ad', ['body'], offset=0, val=1))
+        root = make_cs(Op('set', [], val={}))
+        move = make_cs(Op('sm', ['notes'], offset=0, val=1,
+                          dest_path=['title'], dest_offset=0))
+
+        assert title.paths_are_disjoint(body)
+        assert body.paths_are_disjoint(title)
+        # array indexes may shift, so any index could meet any other
+        assert not body.paths_are_disjoint(other_item)
+        assert not body.paths_are_disjoint(body_list)
+        assert not body_list.paths_are_disjoint(body)
+        assert not root.paths_are_disjoint(title)
+        assert not title.paths_are_disjoint(move)
+        assert body.paths_are_disjoint(move)
+
+        # the summary is rebuilt when ops are added
+        title.add_op(Op('oi', ['body'], offset='k', val=1))
+        assert not title.paths_are_disjoint(body)
+
+    def test_branch_index_finds_changesets_which_are_not_disjoint(self):
+        from majormajor.changeset import BranchIndex
+        paths = [['a'], ['b', 0], ['b', 3, 'c'], [], ['d', 'e'], ['b']]
+        css = []
+        for i in range(BranchIndex.MIN_CHANGESETS):
+            cs = Changeset('doc_id', 'user_id', [])
+            cs.add_op(Op('oi', paths[i % len(paths)], offset='k', val=i))
+            css.append(cs)
+        pcs = tuple(css)
+        index = BranchIndex(pcs)
+        for path in [['a'], ['b', 7, 'c', 'x'], ['d'], ['z'], []]:
+            cs = Changeset('doc_id', 'user_id', [])
+            cs.add_op(Op('si', path, offset=0, val='x'))
+            expected = [pc for pc in pcs if not cs.paths_are_disjoint(pc)]
+            assert index.find_changesets(cs) == expected
+
+        # changesets along one branch share the index along with their
+        # unaccounted changesets
+        A = Changeset('doc_id', 'user_id', [])
+        A.add_op(Op('si', ['a'], offset=0, val='x'))
+        A.set_unaccounted_changesets(pcs)
+        assert A.get_relevant_unaccounted_changesets() == \
+            [pc for pc in pcs if not A.paths_are_disjoint(pc)]
+        B = Changeset('doc_id', 'user_id', [A])
+        B.add_op(Op('si', ['z'], offset=0, val='x'))
+        B.share_unaccounted_changesets(A)
+        # only the changesets inserting into the root object touch ['z']
+        assert B.get_relevant_unaccounted_changesets() == css[3::6]
+        assert BranchIndex.get_index(B.preceding_changesets) is \
+            BranchIndex.get_index(A.preceding_changesets)
+
+    def test_branch_index_is_built_once_per_shared_run(self, monkeypatch):
+        builds = []
+        build = BranchIndex.__init__
+
+        def counting_build(index, css):
+            builds.append(css)
+            build(index, css)
+        monkeypatch.setattr(BranchIndex, '__init__', counting_build)
+        monkeypatch.setattr(BranchIndex, '_cache', type(BranchIndex._cache)())
+
+        doc = Document('doc_id', 'u1', snapshot={'a': '', 'b': ''})
+        doc.HAS_EVENT_LOOP = False
+        root = doc.get_root_changeset()
+        # a client's branch, built while it was offline, which comes after
+        # the long branch the others built in the meantime
+        dep = root
+        offline = []
+        for i in range(5):
+            dep = build_changeset(doc, 'z%d' % i, [dep],
+                                  [Op('si', ['b'], offset=0, val='y')],
+                                  user='u2')
+            offline.append(dep)
+        for cs in offline:
+            doc.receive_changeset(cs)
+        dep = root
+        for i in range(BranchIndex.MIN_CHANGESETS + 8):
+            dep = build_changeset(doc, 'a%02d' % i, [dep],
+                                  [Op('si', ['a'], offset=0, val='x')])
+            doc.receive_changeset(dep)
+
+        # the offline branch shares one tuple of unaccounted changesets
+        pcs = offline[0].preceding_changesets
+        assert len(pcs) == BranchIndex.MIN_CHANGESETS + 8
+        for cs in offline:
+            assert cs.preceding_changesets is pcs
+        assert [id(css) for css in builds].count(id(pcs)) == 1
+        assert len(builds) == len(set(id(css) for css in builds))
+
+        # transforming again reuses it
+        n = len(builds)
+        doc.ot(0)
+        assert len(builds) == n
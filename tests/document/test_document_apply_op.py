@@ -308,3 +308,30 @@ class TestDocumentApplyOp:
                    'fifth': [55,66,{}, 'rw']}
         assert doc1.get_snapshot() == result2
 
+
+    def test_arrays_change_in_place(self):
+        doc2 = self.doc2
+        array = doc2.get_value([1])
+        doc2.apply_op(Op('ai', [1], val=[5, 6], offset=4))
+        doc2.apply_op(Op('ad', [1], val=2, offset=0))
+        doc2.apply_op(Op('am', [1], offset=0, val=3))
+        assert doc2.get_value([1]) is array
+        assert array == [4, 5, 6, 3]
+
+    def test_inserted_values_are_not_shared_with_ops(self):
+        doc0 = self.doc0
+        op1 = Op('oi', [], offset='list', val=[1, 2])
+        doc0.apply_op(op1)
+        op2 = Op('ai', [], offset=0, val=[[3], {'k': [4]}])
+        doc2 = Document()
+        doc2.snapshot.set_snapshot([])
+        doc2.apply_op(op2)
+
+        # changing the snapshot later does not change the ops' values
+        doc0.apply_op(Op('ai', ['list'], val=[0], offset=0))
+        doc2.apply_op(Op('ad', [0], val=1, offset=0))
+        doc2.apply_op(Op('ai', [1, 'k'], val=[5], offset=1))
+        assert doc0.get_snapshot() == {'list': [0, 1, 2]}
+        assert doc2.get_snapshot() == [[], {'k': [4, 5]}]
+        assert op1.t_val == [1, 2]
+        assert op2.t_val == [[3], {'k': [4]}]
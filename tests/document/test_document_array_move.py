@@ -0,0 +1,150 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from majormajor.document import Document
+from majormajor.ops.op import Op
+
+from tests.test_utils import build_changeset
+
+
+class TestDocumentArrayMove:
+
+    def setup_method(self, method):
+        doc = Document('move_doc', 'u1',
+                       snapshot={'list': ['a', 'b', 'c', 'd', 'e'],
+                                 'items': [{'s': 'x'}, {'s': 'y'}]})
+        doc.HAS_EVENT_LOOP = False
+        self.doc = doc
+        self.root = doc.get_root_changeset()
+
+    def receive_all(self, changesets):
+        for cs in changesets:
+            self.doc.receive_changeset(cs)
+        return self.doc.get_snapshot()
+
+    def assert_matches_full_ot(self):
+        doc = self.doc
+        snapshot = doc.get_snapshot_copy()
+        doc.ot(0)
+        doc.rebuild_snapshot(ignore_cache=True)
+        assert doc.get_snapshot() == snapshot
+
+    def test_apply_move(self):
+        doc = self.doc
+        doc.apply_op(Op('am', ['list'], offset=0, val=3))
+        assert doc.get_snapshot()['list'] == ['b', 'c', 'd', 'a', 'e']
+        doc.apply_op(Op('am', ['list'], offset=4, val=1))
+        assert doc.get_snapshot()['list'] == ['b', 'e', 'c', 'd', 'a']
+        doc.apply_op(Op('am', ['list'], offset=2, val=2))
+        assert doc.get_snapshot()['list'] == ['b', 'e', 'c', 'd', 'a']
+
+    def test_move_with_concurrent_insert_and_delete(self):
+        A = build_changeset(self.doc, 'A', [self.root],
+                            [Op('am', ['list'], offset=1, val=3)])
+        B = build_changeset(self.doc, 'B', [self.root],
+                            [Op('ai', ['list'], offset=2, val=['x', 'y'])])
+        C = build_changeset(self.doc, 'C', [self.root],
+                            [Op('ad', ['list'], offset=3, val=1)])
+        snapshot = self.receive_all([A, B, C])
+        # 'b' is moved after 'd' which is deleted, so it lands where 'd' was
+        assert snapshot['list'] == ['a', 'x', 'y', 'c', 'b', 'e']
+        self.assert_matches_full_ot()
+
+    def test_concurrent_moves(self):
+        A = build_changeset(self.doc, 'A', [self.root],
+                            [Op('am', ['list'], offset=0, val=4)])
+        B = build_changeset(self.doc, 'B', [self.root],
+                            [Op('am', ['list'], offset=4, val=0)])
+        snapshot = self.receive_all([A, B])
+        # the elements swap places
+        assert snapshot['list'] == ['e', 'b', 'c', 'd', 'a']
+        self.assert_matches_full_ot()
+
+        C = build_changeset(self.doc, 'C', [A, B],
+                            [Op('am', ['list'], offset=1, val=3)])
+        D = build_changeset(self.doc, 'D', [A, B],
+                            [Op('am', ['list'], offset=1, val=0)])
+        snapshot = self.receive_all([C, D])
+        # both moved 'b', so only one of the moves is kept
+        assert sorted(snapshot['list']) == ['a', 'b', 'c', 'd', 'e']
+        assert snapshot['list'] in (['e', 'c', 'd', 'b', 'a'],
+                                    ['b', 'e', 'c', 'd', 'a'])
+        self.assert_matches_full_ot()
+
+    def test_moved_element_keeps_its_edits(self):
+        A = build_changeset(self.doc, 'A', [self.root],
+                            [Op('am', ['items'], offset=0, val=1)])
+        B = build_changeset(self.doc, 'B', [self.root],
+                            [Op('si', ['items', 0, 's'], offset=1, val='z')])
+        C = build_changeset(self.doc, 'C', [B],
+                            [Op('si', ['items', 1, 's'], offset=0, val='w')])
+        snapshot = self.receive_all([A, B, C])
+        assert snapshot['items'] == [{'s': 'wy'}, {'s': 'xz'}]
+        self.assert_matches_full_ot()
+
+    def test_deleted_element_is_not_moved(self):
+        A = build_changeset(self.doc, 'A', [self.root],
+                            [Op('ad', ['list'], offset=1, val=1)])
+        B = build_changeset(self.doc, 'B', [self.root],
+                            [Op('am', ['list'], offset=1, val=4)])
+        C = build_changeset(self.doc, 'C', [self.root],
+                            [Op('am', ['list'], offset=2, val=2)])
+        snapshot = self.receive_all([A, B, C])
+        assert snapshot['list'] == ['a', 'c', 'd', 'e']
+        self.assert_matches_full_ot()
+
+    def test_invalid_move_is_not_applied(self):
+        doc = self.doc
+        assert doc.snapshot.apply_op(Op('am', ['list'], offset=5, val=0)) \
+            == "ERROR!"
+        assert doc.get_snapshot()['list'] == ['a', 'b', 'c', 'd', 'e']
+
+    def test_move_and_delete_in_either_order(self):
+        # every move against every delete, with each one ordered first
+        elements = ['a', 'b', 'c', 'd', 'e']
+        for offset in range(5):
+            for val in range(5):
+                for start in range(5):
+                    for length in range(1, 6 - start):
+                        for ids in (('1', '2'), ('2', '1')):
+                            self.setup_method(None)
+                            A = build_changeset(
+                                self.doc, ids[0], [self.root],
+                                [Op('am', ['list'], offset=offset, val=val)])
+                            B = build_changeset(
+                                self.doc, ids[1], [self.root],
+                                [Op('ad', ['list'], offset=start,
+                                    val=length)])
+                            snapshot = self.receive_all([A, B])
+                            deleted = elements[start:start + length]
+                            kept = [e for e in elements if not e in deleted]
+                            assert sorted(snapshot['list']) == kept
+                            self.assert_matches_full_ot()
+
+    def test_later_insert_inside_split_delete(self):
+        # 'a' is moved between 'c' and 'd', which are deleted along with 'b',
+        # so the delete is split around it
+        A = build_changeset(self.doc, 'A', [self.root],
+                            [Op('am', ['list'], offset=0, val=2)])
+        B = build_changeset(self.doc, 'B', [self.root],
+                            [Op('ad', ['list'], offset=1, val=3)])
+        C = build_changeset(self.doc, 'C', [A],
+                            [Op('ai', ['list'], offset=4, val=['x'])])
+        snapshot = self.receive_all([A, B, C])
+        assert snapshot['list'] == ['a', 'x', 'e']
+        self.assert_matches_full_ot()
@@ -0,0 +1,129 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import copy
+
+from majormajor.document import Document
+from majormajor.ops.op import Op
+from majormajor.snapshot import Snapshot
+
+from tests.test_utils import build_changeset
+
+
+class TestDocumentChangeEvents:
+
+    def setup_method(self, method):
+        doc = Document('events_doc', 'u1',
+                       snapshot={'text': 'abcdefghij',
+                                 'items': [{'s': 'x'}, {'s': 'y'}, {'s': 'z'}],
+                                 'obj': {'a': 1, 'b': 2}})
+        self.doc = doc
+        self.root = doc.get_root_changeset()
+
+    def apply_events(self, snapshot, events):
+        s = Snapshot()
+        s.set_snapshot(copy.deepcopy(snapshot))
+        for action, path, offset, val in events:
+            s.apply_op(Op(action, path, offset=offset, val=val))
+        return s.get_snapshot()
+
+    def pull_and_check(self, css):
+        doc = self.doc
+        before = copy.deepcopy(doc.get_snapshot())
+        for cs in css:
+            doc.receive_changeset(cs)
+        events = doc.pull_change_events()
+        assert self.apply_events(before, events) == doc.get_snapshot()
+        return events
+
+    def test_nothing_pending(self):
+        doc = self.doc
+        doc.add_local_op(Op('si', ['text'], offset=0, val='q'))
+        assert doc.pull_change_events() is None
+        # the local changeset was still closed
+        assert doc.get_open_changeset() is None
+        assert len(doc.get_send_queue()) == 1
+
+    def test_fast_forward_gives_its_ops(self):
+        A = build_changeset(self.doc, 'A', [self.root],
+                            [Op('si', ['text'], offset=2, val='XY'),
+                             Op('ad', ['items'], offset=1, val=1)], user='u2')
+        events = self.pull_and_check([A])
+        assert events == [('si', ['text'], 2, 'XY'),
+                          ('ad', ['items'], 1, 1)]
+
+    def test_transformed_string_edits(self):
+        doc = self.doc
+        doc.add_local_op(Op('sd', ['text'], offset=1, val=2))
+        doc.add_local_op(Op('si', ['text'], offset=6, val='local'))
+        doc.close_changeset()
+        A = build_changeset(self.doc, 'A', [self.root],
+                            [Op('si', ['text'], offset=4, val='AA')],
+                            user='u2')
+        events = self.pull_and_check([A])
+        assert doc.get_snapshot()['text'] == 'adAAefghlocalij'
+        # only the range from the first to the last position the ops touch is
+        # replaced, not the whole string
+        assert events == [('sd', ['text'], 1, 10),
+                          ('si', ['text'], 1, 'dAAefghlocal')]
+
+    def test_transformed_edits_in_many_places(self):
+        doc = self.doc
+        doc.add_local_op(Op('si', ['items', 2, 's'], offset=0, val='l'))
+        doc.add_local_op(Op('oi', ['obj'], offset='c', val=3))
+        doc.close_changeset()
+        A = build_changeset(self.doc, 'A', [self.root],
+                            [Op('ai', ['items'], offset=0, val=[{'s': 'w'}]),
+                             Op('od', ['obj'], offset='a'),
+                             Op('sd', ['text'], offset=0, val=1)], user='u2')
+        B = build_changeset(self.doc, 'B', [self.root],
+                            [Op('si', ['items', 1, 's'], offset=1, val='r')],
+                            user='u2')
+        events = self.pull_and_check([A, B])
+        # the local edit to the last item, and the untouched key, are left out
+        assert events == [('ad', ['items'], 0, 2),
+                          ('ai', ['items'], 0,
+                           [{'s': 'w'}, {'s': 'x'}, {'s': 'yr'}]),
+                          ('od', ['obj'], 'a', None),
+                          ('sd', ['text'], 0, 1)]
+
+    def test_both_sides_delete_the_same_key(self):
+        doc = self.doc
+        doc.add_local_op(Op('od', ['obj'], offset='a'))
+        doc.close_changeset()
+        A = build_changeset(self.doc, 'A', [self.root],
+                            [Op('od', ['obj'], offset='a')], user='u2')
+        # the key was already gone, so there is nothing to delete
+        assert self.pull_and_check([A]) == []
+        assert doc.get_snapshot()['obj'] == {'b': 2}
+
+    def test_both_sides_insert_the_same_key_and_value(self):
+        doc = self.doc
+        doc.add_local_op(Op('oi', ['obj'], offset='c', val={'d': [1]}))
+        doc.close_changeset()
+        # ordered before the local changeset, whose insert still wins
+        A = build_changeset(self.doc, '0', [self.root],
+                            [Op('oi', ['obj'], offset='c', val={'d': [1]})],
+                            user='u2')
+        assert self.pull_and_check([A]) == []
+
+        B = build_changeset(self.doc, 'B', doc.get_dependencies(),
+                            [Op('oi', ['obj'], offset='c', val={'d': [2]})],
+                            user='u2')
+        events = self.pull_and_check([B])
+        assert events == [('oi', ['obj'], 'c', {'d': [2]})]
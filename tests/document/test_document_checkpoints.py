@@ -0,0 +1,84 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from majormajor.document import Document
+from majormajor.ops.op import Op
+from majormajor.changeset import Changeset
+from majormajor.checkpoints import CheckpointPolicy, \
+    EveryNOpsCheckpointPolicy, ReplayWorkCheckpointPolicy, \
+    LogSpacedCheckpointPolicy, estimate_size
+
+
+class TestDocumentCheckpoints:
+
+    def build_doc(self, policy, n_css=20):
+        doc = Document('checkpoint_doc', 'u1', snapshot={'s': ''},
+                       checkpoint_policy=policy)
+        doc.HAS_EVENT_LOOP = False
+        for i in range(n_css):
+            doc.add_local_op(Op('si', ['s'], offset=0, val='x'))
+            doc.close_changeset()
+        return doc
+
+    def cached_indexes(self, doc):
+        return [i for i, cs in enumerate(doc.get_ordered_changesets())
+                if cs.has_valid_snapshot_cache()]
+
+    def test_new_changesets_are_not_caches(self):
+        cs = Changeset('doc_id', 'u1', [])
+        assert not cs.is_snapshot_cache()
+        doc = self.build_doc(CheckpointPolicy())
+        assert self.cached_indexes(doc) == []
+
+    def test_every_n_ops(self):
+        doc = self.build_doc(EveryNOpsCheckpointPolicy(5, memory_budget=None))
+        # the root changeset's set op counts as the first op
+        assert self.cached_indexes(doc) == [4, 9, 14, 19]
+
+        # a full rebuild places the checkpoints in the same spots
+        doc.rebuild_snapshot(ignore_cache=True)
+        assert self.cached_indexes(doc) == [4, 9, 14, 19]
+        assert doc.get_snapshot() == {'s': 'x' * 20}
+
+    def test_replayed_work(self):
+        policy = ReplayWorkCheckpointPolicy(3 * estimate_size('x'),
+                                            memory_budget=None)
+        doc = self.build_doc(policy, n_css=9)
+        # the root's set op alone is more than enough work for a checkpoint,
+        # but the root never holds one.
+        assert self.cached_indexes(doc) == [1, 4, 7]
+
+    def test_log_spaced(self):
+        policy = LogSpacedCheckpointPolicy(2, memory_budget=None)
+        doc = self.build_doc(policy, n_css=64)
+        # dense near the head, sparse further back
+        assert self.cached_indexes(doc) == [32, 48, 56, 60, 62, 64]
+
+    def test_memory_budget_evicts_least_recently_used(self):
+        size = estimate_size({'s': 'x' * 10})
+        policy = EveryNOpsCheckpointPolicy(5, memory_budget=3 * size)
+        doc = self.build_doc(policy, n_css=20)
+        # checkpoints grow with the document, so only the two newest fit
+        assert self.cached_indexes(doc) == [14, 19]
+        assert policy.memory_used <= policy.memory_budget
+
+        # restoring from a checkpoint makes it the most recently used
+        B = Changeset(doc.get_id(), 'u2', [doc.get_ordered_changesets()[14]])
+        B.add_op(Op('si', ['s'], offset=0, val='B'))
+        doc.receive_changeset(B)
+        assert sorted(doc.get_snapshot()['s']) == ['B'] + ['x'] * 20
+        ocs = doc.get_ordered_changesets()
+        assert policy.get_checkpoints()[0] is ocs[14]
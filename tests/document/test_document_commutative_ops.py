@@ -0,0 +1,98 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from majormajor.document import Document
+from majormajor.ops.op import Op
+
+from tests.test_utils import build_changeset
+
+
+class TestDocumentCommutativeOps:
+
+    def setup_method(self, method):
+        doc = Document('commutative_doc', 'u1',
+                       snapshot={'n': 0, 'flags': {'a': False},
+                                 'items': [{'v': 1}, {'v': 2}]})
+        doc.HAS_EVENT_LOOP = False
+        self.doc = doc
+        self.root = doc.get_root_changeset()
+
+    def assert_matches_full_ot(self):
+        doc = self.doc
+        snapshot = doc.get_snapshot_copy()
+        doc.ot(0)
+        doc.rebuild_snapshot(ignore_cache=True)
+        assert doc.get_snapshot() == snapshot
+
+    def test_is_commutative(self):
+        assert Op('na', ['n'], val=3).is_commutative()
+        assert Op('bn', ['flags', 'a']).is_commutative()
+        # float additions give different results in different orders
+        assert not Op('na', ['n'], val=0.5).is_commutative()
+        assert not Op('si', ['s'], offset=0, val='a').is_commutative()
+        cs = build_changeset(self.doc, 'A', [self.root],
+                             [Op('na', ['n'], val=1),
+                              Op('bn', ['flags', 'a'])])
+        assert cs.is_commutative()
+        # commutative ops never transform a future op, but past ops may
+        # still transform them
+        B = build_changeset(self.doc, 'B', [self.root],
+                            [Op('oi', ['flags'], offset='b', val=True)])
+        assert B.paths_are_disjoint(cs)
+        assert not cs.paths_are_disjoint(B)
+
+    def test_commutative_changesets_apply_out_of_order(self, monkeypatch):
+        doc = self.doc
+        A = build_changeset(self.doc, 'A', [self.root],
+                            [Op('oi', ['flags'], offset='b', val=True)])
+        B = build_changeset(self.doc, 'B', [A],
+                            [Op('si', ['s'], offset=0, val='x')])
+        C = build_changeset(self.doc, 'C', [self.root],
+                            [Op('na', ['n'], val=5), Op('bn', ['flags', 'a'])])
+        D = build_changeset(self.doc, 'D', [C], [Op('na', ['n'], val=-2)])
+        doc.receive_changeset(A)
+        doc.receive_changeset(B)
+
+        def fail(*args, **kwargs):
+            raise AssertionError('transformed or rebuilt everything')
+        monkeypatch.setattr(doc, 'ot', fail)
+        monkeypatch.setattr(doc, 'rebuild_snapshot', fail)
+        doc.receive_changeset(C)
+        doc.receive_changeset(D)
+        monkeypatch.undo()
+
+        assert set(doc.get_ordered_changesets()) == \
+            set([self.root, A, B, C, D])
+        assert doc.get_snapshot()['n'] == 3
+        assert doc.get_snapshot()['flags'] == {'a': True, 'b': True}
+        self.assert_matches_full_ot()
+
+    def test_counters_follow_array_changes(self):
+        doc = self.doc
+        A = build_changeset(self.doc, 'A', [self.root],
+                            [Op('ai', ['items'], offset=0, val=[{'v': 0}])])
+        B = build_changeset(self.doc, 'B', [self.root],
+                            [Op('na', ['items', 1, 'v'], val=5)])
+        C = build_changeset(self.doc, 'C', [self.root],
+                            [Op('ad', ['items'], offset=0, val=1)])
+        D = build_changeset(self.doc, 'D', [self.root],
+                            [Op('na', ['items', 0, 'v'], val=5)])
+        for cs in [A, B, C, D]:
+            doc.receive_changeset(cs)
+            self.assert_matches_full_ot()
+        # the counter on the deleted item is dropped
+        assert doc.get_snapshot()['items'] == [{'v': 0}, {'v': 7}]
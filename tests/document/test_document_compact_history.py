@@ -0,0 +1,176 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from majormajor.document import Document
+from majormajor.ops.op import Op
+from majormajor.changeset import Changeset
+from majormajor.checkpoints import EveryNOpsCheckpointPolicy
+from majormajor.utils import build_changeset_from_dict
+
+
+class TestDocumentCompactHistory:
+
+    def setup_method(self, method):
+        """
+                   -- B --
+                  /       \\
+        root -- A -        -- D
+                  \\       /
+                   -- C --
+
+        A, B and D are local, C comes from u2.
+        """
+        doc = Document('compact_doc', 'u1', snapshot={'s': ''})
+        doc.HAS_EVENT_LOOP = False
+        self.root = doc.get_root_changeset()
+        doc.add_local_op(Op('si', ['s'], offset=0, val='a'))
+        self.A = doc.close_changeset()
+        doc.add_local_op(Op('si', ['s'], offset=1, val='b'))
+        self.B = doc.close_changeset()
+        self.C = Changeset(doc.get_id(), 'u2', [self.A])
+        self.C.add_op(Op('si', ['s'], offset=0, val='c'))
+        doc.receive_changeset(self.C)
+        doc.add_local_op(Op('si', ['s'], offset=0, val='d'))
+        self.D = doc.close_changeset()
+        self.doc = doc
+        self.snapshot = doc.get_snapshot_copy()
+
+    def test_needs_every_peer(self):
+        doc = self.doc
+        assert doc.get_stable_frontier(peer_ids=['u2']) is None
+        assert not doc.compact_history(peer_ids=['u2'])
+        assert doc.get_root_changeset() == self.root
+
+    def test_frontier_known_by_every_peer(self):
+        doc = self.doc
+        # u2 only knows up to C, so the history can't be compacted past A
+        doc.set_peer_dependencies('u2', [self.C.get_id()])
+        assert doc.get_stable_frontier() == self.A
+        assert doc.compact_history()
+
+        assert doc.get_root_changeset() == self.A
+        assert doc.get_ordered_changesets()[0] == self.A
+        assert len(doc.get_ordered_changesets()) == 4
+        assert not doc.knows_changeset(self.root.get_id())
+        assert self.A.get_parents() == []
+        assert [op.action for op in self.A.get_ops()] == ['set']
+        assert self.A.get_ops()[0].val == {'s': 'a'}
+        assert doc.get_snapshot() == self.snapshot
+
+        # nothing changes after a full rebuild
+        doc.ot()
+        doc.rebuild_snapshot(ignore_cache=True)
+        assert doc.get_snapshot() == self.snapshot
+
+        # the dropped root is ignored if it is sent again
+        assert not doc.receive_changeset(self.root.to_dict())
+
+    def test_compact_to_head(self):
+        doc = self.doc
+        doc.set_peer_dependencies('u2', [self.D.get_id()])
+        assert doc.compact_history()
+        assert doc.get_ordered_changesets() == [self.D]
+        assert doc.get_snapshot() == self.snapshot
+        # D still has the same dependency ids
+        assert self.D.get_parents() == []
+        assert self.D.get_dependency_ids() == []
+
+        # the new root can be sent to a new collaborator, and keeps its id
+        root = build_changeset_from_dict(self.D.to_dict())
+        assert root.get_id() == self.D.get_id()
+
+        # editing carries on from the new root
+        E = Changeset(doc.get_id(), 'u2', [self.D])
+        E.add_op(Op('si', ['s'], offset=0, val='e'))
+        doc.receive_changeset(E)
+        doc.add_local_op(Op('si', ['s'], offset=0, val='f'))
+        doc.close_changeset()
+        assert doc.get_snapshot() == {'s': 'fe' + self.snapshot['s']}
+        assert not doc.compact_history()
+
+    def test_dropped_parent_keeps_dependency_ids(self):
+        doc = self.doc
+        # X lists C as a parent too, even though D already descends from it
+        X = Changeset(doc.get_id(), 'u2', [self.C, self.D])
+        X.add_op(Op('si', ['s'], offset=0, val='x'))
+        dep_ids = X.get_dependency_ids()
+        doc.receive_changeset(X)
+        snapshot = doc.get_snapshot()
+
+        doc.set_peer_dependencies('u2', [self.D.get_id()])
+        assert doc.compact_history()
+        assert doc.get_ordered_changesets() == [self.D, X]
+        assert X.get_parents() == [self.D]
+        assert X.get_dependency_ids() == dep_ids
+        assert X.has_ancestor(self.D)
+        assert doc.get_snapshot() == snapshot
+
+    def test_only_a_root_keeps_a_sent_id(self):
+        d = self.C.to_dict()
+        d['id'] = self.C.get_id()
+        assert build_changeset_from_dict(d).get_id() == self.C.get_id()
+        d['id'] = self.A.get_id()
+        with pytest.raises(Exception):
+            build_changeset_from_dict(d)
+
+    def test_frontier_needs_every_peer_ever_seen(self):
+        doc = self.doc
+        doc.set_peer_dependencies('u2', [self.D.get_id()])
+        doc.set_peer_dependencies('u3', [self.C.get_id()])
+        # u3 is not named, but once it reported it can still send changesets
+        # built on A
+        assert doc.get_stable_frontier(peer_ids=['u2']) == self.A
+        assert doc.get_stable_frontier(peer_ids=['u2', 'u4']) is None
+
+    def test_changesets_built_on_dropped_history_are_rejected(self):
+        doc = self.doc
+        doc.set_peer_dependencies('u2', [self.D.get_id()])
+        assert doc.compact_history()
+
+        # u3 never reported, and edits from B, which is gone
+        X = Changeset(doc.get_id(), 'u3', [self.B])
+        X.add_op(Op('si', ['s'], offset=0, val='x'))
+        Y = Changeset(doc.get_id(), 'u3', [X])
+        Y.add_op(Op('si', ['s'], offset=0, val='y'))
+        assert not doc.receive_changeset(X.to_dict())
+        assert not doc.receive_changeset(Y.to_dict())
+        assert not doc.knows_changeset(X.get_id())
+        assert not doc.knows_changeset(Y.get_id())
+        assert doc.get_snapshot() == self.snapshot
+
+        # they are not requested again, and don't hold up compacting
+        request_css, send_css = doc.get_sync_status([Y.get_id()])
+        assert request_css == []
+        doc.add_local_op(Op('si', ['s'], offset=0, val='e'))
+        E = doc.close_changeset()
+        doc.set_peer_dependencies('u2', [E.get_id()])
+        assert doc.compact_history()
+        assert doc.get_root_changeset() == E
+
+    def test_snapshot_at_leaves_checkpoint_counters(self):
+        policy = EveryNOpsCheckpointPolicy(3, memory_budget=None)
+        doc = Document('compact_doc', 'u1', snapshot={'s': ''},
+                       checkpoint_policy=policy)
+        doc.HAS_EVENT_LOOP = False
+        for i in range(4):
+            doc.add_local_op(Op('si', ['s'], offset=0, val=str(i)))
+            doc.close_changeset()
+        # the checkpoint is at 2, and two ops were replayed since
+        assert policy.ops_since_checkpoint == 2
+        assert doc.get_snapshot_at(3) == {'s': '210'}
+        assert policy.ops_since_checkpoint == 2
@@ -0,0 +1,168 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from majormajor.document import Document
+from majormajor.ops.op import Op
+from majormajor.changeset import Changeset
+
+
+class TestDocumentIncrementalOT:
+
+    def setup_method(self, method):
+        doc = Document(snapshot='0123456789')
+        doc.HAS_EVENT_LOOP = False
+        self.doc = doc
+        root = doc.get_root_changeset()
+
+        A0 = Changeset(doc.get_id(), 'u1', [root])
+        A0.add_op(Op('sd', [], offset=3, val=3))
+        A0.set_id('A0')
+        A1 = Changeset(doc.get_id(), 'u1', [A0])
+        A1.add_op(Op('si', [], offset=7, val='AAAAA'))
+        A1.set_id('A1')
+
+        B0 = Changeset(doc.get_id(), 'u1', [root])
+        B0.add_op(Op('sd', [], offset=4, val=3))
+        B0.set_id('B0')
+        B1 = Changeset(doc.get_id(), 'u1', [B0])
+        B1.add_op(Op('si', [], offset=7, val='BBBBB'))
+        B1.set_id('B1')
+
+        C0 = Changeset(doc.get_id(), 'u1', [root])
+        C0.add_op(Op('sd', [], offset=5, val=3))
+        C0.set_id('C0')
+        C1 = Changeset(doc.get_id(), 'u1', [C0])
+        C1.add_op(Op('si', [], offset=7, val='CCCCC'))
+        C1.set_id('C1')
+
+        self.css = [A0, A1, B0, B1, C0, C1]
+
+    def assert_matches_full_ot(self):
+        doc = self.doc
+        snapshot = doc.get_snapshot()
+        doc.ot(0)
+        doc.rebuild_snapshot()
+        assert doc.get_snapshot() == snapshot
+
+    def test_incremental_ot_matches_full_ot(self):
+        """
+        Receive the changesets one at a time, in an order which inserts some
+        of them in the middle of the ordered changesets. After each one the
+        incrementally transformed document must match a full OT.
+        """
+        doc = self.doc
+        A0, A1, B0, B1, C0, C1 = self.css
+        for cs in [C0, C1, B0, A0, B1, A1]:
+            doc.receive_changeset(cs)
+            self.assert_matches_full_ot()
+        assert doc.get_snapshot() == '01289AAAAABBBBBCCCCC'
+
+    def test_hazards_before_start_are_kept(self):
+        """
+        Changesets ordered before the start index are not transformed again,
+        so the hazards they created on earlier ops must survive.
+        """
+        doc = self.doc
+        A0, A1, B0, B1, C0, C1 = self.css
+        for cs in [A0, A1, B0, B1]:
+            doc.receive_changeset(cs)
+        a0_op = A0.get_ops()[0]
+        b1_op = B1.get_ops()[0]
+        kept_hazards = [h for h in a0_op.hazards
+                        if h.conflict_cs in [B0, B1]]
+        assert kept_hazards
+        b1_t_offset = b1_op.t_offset
+
+        doc.receive_changeset(C0)
+        index = doc.get_ordered_changesets().index(C0)
+        assert index > doc.get_ordered_changesets().index(B1)
+        for h in kept_hazards:
+            assert h in a0_op.hazards
+        assert b1_op.t_offset == b1_t_offset
+        self.assert_matches_full_ot()
+
+    def test_changesets_know_ops_holding_their_hazards(self):
+        """
+        Each changeset tracks the ops holding hazards it made, so removing
+        old hazards only has to clean those ops.
+        """
+        doc = self.doc
+        A0, A1, B0, B1, C0, C1 = self.css
+        for cs in [A0, A1, B0, B1]:
+            doc.receive_changeset(cs)
+        a0_op = A0.get_ops()[0]
+        assert a0_op in B0.hazard_holders
+        for h in a0_op.hazards:
+            assert a0_op in h.conflict_cs.hazard_holders
+
+        index = doc.get_ordered_changesets().index(B0)
+        doc.remove_old_hazards(index)
+        assert not [h for h in a0_op.hazards
+                    if h.conflict_cs in [B0, B1]]
+        assert not B0.hazard_holders
+        assert not B1.hazard_holders
+
+    def test_hazard_shifts_are_kept_for_the_same_changeset(self):
+        doc = self.doc
+        A0, A1, B0, B1, C0, C1 = self.css
+        for cs in [A0, A1, B0, B1]:
+            doc.receive_changeset(cs)
+        a0_op = A0.get_ops()[0]
+        b1_op = B1.get_ops()[0]
+        a0_op.process_for_future_ot(b1_op)
+        assert a0_op.hazard_shift_cs is B1
+        shifted = (a0_op.past_t_offset, a0_op.past_t_val)
+
+        # a different changeset shifts the op again
+        a0_op.process_for_future_ot(B0.get_ops()[0])
+        assert a0_op.hazard_shift_cs is B0
+        a0_op.process_for_future_ot(b1_op)
+        assert (a0_op.past_t_offset, a0_op.past_t_val) == shifted
+
+        # and a fresh transformation forgets the shifted values
+        a0_op.reset_transformations()
+        assert a0_op.hazard_shift_cs is None
+
+    def test_fast_forward_changesets(self, monkeypatch):
+        """
+        Changesets whose parents are the document's dependencies are just
+        appended and applied, without rebuilding the snapshot.
+        """
+        doc = self.doc
+        A0, A1, B0, B1, C0, C1 = self.css
+
+        def no_rebuild(*args, **kwargs):
+            raise AssertionError('rebuilt the snapshot')
+        monkeypatch.setattr(doc, 'rebuild_snapshot', no_rebuild)
+        doc.receive_changeset(A0)
+        doc.receive_changeset(A1)
+        assert doc.get_ordered_changesets()[-2:] == [A0, A1]
+        assert doc.get_dependencies() == [A1]
+        assert A1.get_unaccounted_changesets() == []
+        assert doc.get_snapshot() == '0126789AAAAA'
+        monkeypatch.undo()
+
+        # a changeset on another branch still needs OT
+        doc.receive_changeset(B0)
+        self.assert_matches_full_ot()
+        assert set(doc.get_dependencies()) == set([A1, B0])
+        # but one building on both can be fast forwarded again
+        D = Changeset(doc.get_id(), 'u1', [A1, B0])
+        D.add_op(Op('si', [], offset=0, val='D'))
+        D.set_id('D')
+        doc.receive_changeset(D)
+        assert doc.get_ordered_changesets()[-1] is D
+        self.assert_matches_full_ot()
@@ -80,3 +80,32 @@ class TestDocumentMissingChangesets:
         assert doc.get_ordered_changesets() == doc.tree_to_list()
 
         
+
+    def test_pending_changesets_are_indexed_by_missing_parent(self):
+        doc = Document(snapshot='')
+        doc.HAS_EVENT_LOOP = False
+        root = doc.get_root_changeset()
+
+        # B and C both wait on A. D waits on both B and C.
+        B = Changeset(doc.get_id(), "user1", ["A"])
+        B.set_id("B")
+        C = Changeset(doc.get_id(), "user1", ["A"])
+        C.set_id("C")
+        D = Changeset(doc.get_id(), "user1", ["B", "C"])
+        D.set_id("D")
+        for cs in [D, C, B]:
+            doc.receive_changeset(cs)
+        assert doc.pending_new_changesets == [D, C, B]
+        assert doc.pending_unmet_counts == {B: 1, C: 1, D: 2}
+        assert set(doc.pending_waiting_on.keys()) == set(["A", "B", "C"])
+        assert list(doc.ready_changesets) == []
+
+        A = Changeset(doc.get_id(), "user1", [root])
+        A.set_id("A")
+        doc.receive_changeset(A)
+        assert doc.pending_new_changesets == []
+        assert doc.pending_unmet_counts == {}
+        assert doc.pending_waiting_on == {}
+        assert D.get_parents() == [B, C]
+        assert doc.get_ordered_changesets() == [root, A, B, C, D]
+        assert doc.get_ordered_changesets() == doc.tree_to_list()
@@ -0,0 +1,136 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from majormajor.document import Document
+from majormajor.ops.op import Op
+from majormajor.changeset import Changeset
+from majormajor import op_columns
+
+
+class TestDocumentOpColumns:
+
+    def setup_method(self, method):
+        doc = Document('op_columns_doc', 'u1', snapshot={'s': '', 'l': []})
+        doc.HAS_EVENT_LOOP = False
+        self.doc = doc
+        doc.add_local_op(Op('si', ['s'], offset=0, val='abc'))
+        doc.close_changeset()
+        doc.add_local_op(Op('ai', ['l'], offset=0, val=[{'k': 'x'}, 2]))
+        doc.add_local_op(Op('si', ['s'], offset=3, val='d'))
+        doc.close_changeset()
+        doc.add_local_op(Op('oi', ['l', 0], offset='j', val='y'))
+        doc.close_changeset()
+
+    def assert_matches_ops(self):
+        columns = self.doc.get_op_columns()
+        ops = [op for cs in self.doc.get_ordered_changesets()
+               for op in cs.get_ops()]
+        assert columns.ops == ops
+        actions = columns.get_column('action')
+        offsets = columns.get_column('offset')
+        paths = columns.get_column('path')
+        for row, op in enumerate(ops):
+            assert op_columns.ACTIONS[actions[row]] == op.t_action
+            assert columns.get_path(paths[row]) == op.t_path
+            if isinstance(op.t_offset, int):
+                assert offsets[row] == op.t_offset
+        return columns
+
+    @pytest.fixture(params=['arrays', 'numpy'])
+    def backend(self, request, monkeypatch):
+        if request.param == 'arrays':
+            monkeypatch.setattr(op_columns, 'numpy', None)
+        elif op_columns.numpy is None:
+            pytest.skip('NumPy is not installed')
+
+    def test_columns_follow_ordered_ops(self, backend):
+        doc = self.doc
+        columns = self.assert_matches_ops()
+        assert len(columns) == 5
+        assert columns.get_changeset_rows(2) == (2, 4)
+        assert columns.find_ops(['l']) == \
+            doc.get_ordered_changesets()[2].get_ops()[:1]
+        assert len(columns.find_rows(['l'], below=True)) == 2
+        assert columns.find_rows(['l'], actions=['ad']) == []
+        assert columns.count_actions() == {'set': 1, 'si': 2, 'ai': 1,
+                                           'oi': 1}
+
+    def test_columns_are_redone_after_ot(self, backend):
+        doc = self.doc
+        self.assert_matches_ops()
+        # a changeset from another branch inserts an item before the ones the
+        # later ops work on, so their transformed paths and offsets change
+        root = doc.get_root_changeset()
+        B = Changeset(doc.get_id(), 'u2', [root])
+        B.add_op(Op('ai', ['l'], offset=0, val=['B']))
+        B.set_id('0B')
+        doc.receive_changeset(B)
+        assert doc.get_ordered_changesets()[1] is B
+        columns = self.assert_matches_ops()
+        assert len(columns) == 6
+        assert [op.t_path for op in columns.find_ops(['l', 1], below=True)] \
+            == [['l', 1]]
+
+        # and local ops are added as their changesets close
+        doc.add_local_op(Op('sd', ['s'], offset=0, val=2))
+        doc.close_changeset()
+        columns = self.assert_matches_ops()
+        assert columns.get_column('length')[-1] == 2
+
+    def test_shift_positions(self, backend):
+        doc = Document('op_columns_doc', 'u1', snapshot={'s': '0123456789'})
+        doc.HAS_EVENT_LOOP = False
+        root = doc.get_root_changeset()
+        doc.add_local_op(Op('si', ['s'], offset=3, val='XY'))
+        doc.close_changeset()
+        doc.add_local_op(Op('sd', ['s'], offset=4, val=4))
+        doc.close_changeset()
+        assert doc.get_snapshot() == {'s': '012X6789'}
+        shifted = doc.shift_positions({('s',): [0, 3, 4, 5, 7, 10],
+                                       ('t',): [2]}, root)
+        assert list(shifted[('s',)]) == [0, 4, 4, 4, 5, 8]
+        assert list(shifted[('t',)]) == [2]
+
+    @pytest.mark.parametrize('seed', range(3))
+    def test_shift_positions_follows_characters(self, backend, seed):
+        import random
+        r = random.Random(seed)
+        text = u''.join(unichr(0x100 + i) for i in range(50))
+        doc = Document('op_columns_doc', 'u1', snapshot=text)
+        doc.HAS_EVENT_LOOP = False
+        root = doc.get_root_changeset()
+        n = 0x1000
+        for i in range(40):
+            s = doc.get_snapshot()
+            offset = r.randint(0, len(s))
+            if r.random() < 0.6 or len(s) < 10:
+                val = u''.join(unichr(n + j) for j in range(r.randint(1, 4)))
+                n += len(val)
+                doc.add_local_op(Op('si', [], offset=offset, val=val))
+            else:
+                doc.add_local_op(Op('sd', [], offset=min(offset, len(s) - 1),
+                                    val=r.randint(1, 3)))
+            doc.close_changeset()
+        positions = range(len(text))
+        shifted = doc.shift_positions({(): positions}, root)[()]
+        s = doc.get_snapshot()
+        for p, new_p in zip(positions, shifted):
+            # a position before a character which is still there is still
+            # right before it
+            if text[p] in s:
+                assert s.index(text[p]) == new_p
@@ -0,0 +1,130 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+import pytest
+
+from majormajor.document import Document
+from majormajor.ops.op import Op
+from majormajor.changeset import Changeset
+from majormajor.checkpoints import EveryNOpsCheckpointPolicy
+
+
+class TestDocumentPersistentSnapshot:
+
+    def setup_method(self, method):
+        self.snapshot = {'a': {'x': 1, 'y': [1, 2, 3]},
+                         'b': {'s': 'abc', 'n': 5, 't': True},
+                         'c': [{'k': 'v'}, [4, 5]]}
+        self.doc = Document('persistent_doc', 'u1', snapshot=self.snapshot,
+                            persistent_snapshot=True)
+        self.doc.HAS_EVENT_LOOP = False
+
+    def test_copies_are_not_changed_by_later_ops(self):
+        doc = self.doc
+        copy = doc.get_snapshot_copy()
+        doc.add_local_op(Op('oi', ['a'], offset='z', val={'new': [1]}))
+        doc.add_local_op(Op('ai', ['a', 'y'], offset=1, val=[9]))
+        doc.add_local_op(Op('ad', ['c', 1], offset=0, val=1))
+        doc.add_local_op(Op('am', ['a', 'y'], offset=0, val=2))
+        doc.add_local_op(Op('od', ['c', 0], offset='k'))
+        assert copy == self.snapshot
+        copy2 = doc.get_snapshot_copy()
+        doc.add_local_op(Op('si', ['b', 's'], offset=1, val='12'))
+        doc.add_local_op(Op('na', ['b', 'n'], val=3))
+        doc.add_local_op(Op('bn', ['b', 't']))
+        doc.add_local_op(Op('set', [], val={'gone': True}))
+        assert copy == self.snapshot
+        assert copy2 == {'a': {'x': 1, 'y': [9, 2, 1, 3], 'z': {'new': [1]}},
+                         'b': {'s': 'abc', 'n': 5, 't': True},
+                         'c': [{}, [5]]}
+        assert doc.get_snapshot() == {'gone': True}
+
+    def test_copies_share_unchanged_data(self):
+        doc = self.doc
+        copy = doc.get_snapshot_copy()
+        assert doc.get_snapshot_copy() is copy
+        doc.add_local_op(Op('ai', ['a', 'y'], offset=0, val=[0]))
+        new = doc.get_snapshot()
+        # only the path down to the changed list was copied
+        assert new is not copy
+        assert new['a'] is not copy['a']
+        assert new['a']['y'] is not copy['a']['y']
+        assert new['b'] is copy['b']
+        assert new['c'] is copy['c']
+        # and once copied, the path is changed in place until the next copy
+        doc.add_local_op(Op('ai', ['a', 'y'], offset=0, val=[0]))
+        assert doc.get_snapshot()['a']['y'] is new['a']['y']
+
+    def test_restoring_a_copy_leaves_it_alone(self):
+        doc = self.doc
+        copy = doc.get_snapshot_copy()
+        doc.snapshot.set_snapshot_copy(copy)
+        doc.add_local_op(Op('oi', ['b'], offset='s', val='changed'))
+        assert copy == self.snapshot
+        assert doc.get_snapshot()['b']['s'] == 'changed'
+
+    def test_long_strings_in_copies(self):
+        text = 'abcdefghij' * 500
+        doc = Document('persistent_doc', 'u1', snapshot={'txt': text},
+                       persistent_snapshot=True)
+        doc.HAS_EVENT_LOOP = False
+        doc.add_local_op(Op('si', ['txt'], offset=3, val='123'))
+        copy = doc.get_snapshot_copy()
+        doc.add_local_op(Op('sd', ['txt'], offset=0, val=10))
+        assert copy == {'txt': text[:3] + '123' + text[3:]}
+        assert doc.get_snapshot() == {'txt': text[7:]}
+
+    @pytest.mark.parametrize('seed', range(3))
+    def test_checkpoints_match_copied_checkpoints(self, seed):
+        r = random.Random(seed)
+        docs = []
+        for persistent in [False, True]:
+            doc = Document('persistent_doc', 'u1', snapshot={'l': [], 'd': {}},
+                           checkpoint_policy=EveryNOpsCheckpointPolicy(
+                               4, memory_budget=None),
+                           persistent_snapshot=persistent)
+            doc.HAS_EVENT_LOOP = False
+            docs.append(doc)
+        for i in range(60):
+            if r.random() < 0.5:
+                args = ('ai', ['l'], 0, [{'i': i}])
+            else:
+                args = ('oi', ['d'], str(r.randint(0, 5)), [i])
+            for doc in docs:
+                action, path, offset, val = args
+                doc.add_local_op(Op(action, path, offset=offset, val=val))
+                doc.close_changeset()
+
+        # a changeset from another branch makes both rebuild from a
+        # checkpoint in the middle
+        for doc in docs:
+            dep = doc.get_ordered_changesets()[30]
+            B = Changeset(doc.get_id(), 'u2', [dep])
+            B.add_op(Op('oi', ['d'], offset='B', val={'b': 1}))
+            B.set_id('B')
+            doc.receive_changeset(B)
+        assert docs[0].get_snapshot() == docs[1].get_snapshot()
+        for doc in docs:
+            doc.rebuild_snapshot(ignore_cache=True)
+        assert docs[0].get_snapshot() == docs[1].get_snapshot()
+        for cs0, cs1 in zip(docs[0].get_ordered_changesets(),
+                            docs[1].get_ordered_changesets()):
+            assert cs0.has_valid_snapshot_cache() == \
+                cs1.has_valid_snapshot_cache()
+            if cs0.has_valid_snapshot_cache():
+                assert cs0.get_snapshot_cache() == cs1.get_snapshot_cache()
@@ -0,0 +1,82 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from majormajor.document import Document
+from majormajor.ops.op import Op
+from majormajor.changeset import Changeset
+
+
+class TestDocumentRebuildSnapshot:
+
+    def setup_method(self, method):
+        doc = Document('rebuild_doc', 'u1', snapshot={'s': '0123456789'})
+        doc.HAS_EVENT_LOOP = False
+        self.doc = doc
+        # build a linear history where every changeset is a snapshot cache
+        self.css = []
+        for i in range(5):
+            doc.add_local_op(Op('si', ['s'], offset=0, val=str(i)))
+            cs = doc.close_changeset()
+            cs.set_as_snapshot_cache(True)
+            cs.set_snapshot_cache(doc.snapshot.get_snapshot_copy())
+            cs.set_snapshot_cache_is_valid(True)
+            self.css.append(cs)
+        self.applied_ops = []
+        apply_op = doc.snapshot.apply_op
+
+        def counting_apply_op(op):
+            self.applied_ops.append(op)
+            return apply_op(op)
+        doc.snapshot.apply_op = counting_apply_op
+
+    def test_rebuild_starts_from_nearest_cache(self):
+        """
+        A remote changeset branching off the third local changeset only needs
+        the ops from the third changeset's cache onwards to be replayed.
+        """
+        doc = self.doc
+        B = Changeset(doc.get_id(), 'u2', [self.css[2]])
+        B.add_op(Op('si', ['s'], offset=3, val='BB'))
+        doc.receive_changeset(B)
+
+        expected = {'s': '43210BB0123456789'}
+        assert doc.get_snapshot() == expected
+        ocs = doc.get_ordered_changesets()
+        assert ocs.index(B) == 4
+        replayed_css = set(op.get_changeset() for op in self.applied_ops)
+        assert replayed_css == set([B, self.css[3], self.css[4]])
+
+        self.applied_ops = []
+        doc.rebuild_snapshot(ignore_cache=True)
+        assert doc.get_snapshot() == expected
+        assert len(self.applied_ops) == 7
+
+    def test_caches_after_start_are_refreshed(self):
+        doc = self.doc
+        B = Changeset(doc.get_id(), 'u2', [self.css[2]])
+        B.add_op(Op('si', ['s'], offset=0, val='BB'))
+        B.set_as_snapshot_cache(True)
+        doc.receive_changeset(B)
+
+        ocs = doc.get_ordered_changesets()
+        for cs in ocs[1:]:
+            assert cs.has_valid_snapshot_cache()
+        assert ocs[-1].get_snapshot_cache() == doc.get_snapshot()
+
+        # restoring from a cache must not share data with the cache
+        doc.rebuild_snapshot(len(ocs))
+        assert doc.get_snapshot() == ocs[-1].get_snapshot_cache()
+        assert doc.get_snapshot() is not ocs[-1].get_snapshot_cache()
@@ -0,0 +1,83 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+import pytest
+
+from majormajor.document import Document
+from majormajor.ops.op import Op
+from majormajor.rope import Rope
+from majormajor.snapshot import ROPE_THRESHOLD
+
+
+class TestDocumentRopeStrings:
+
+    def setup_method(self, method):
+        self.text = 'abcdefghij' * (ROPE_THRESHOLD // 5)
+        self.doc = Document(snapshot={'txt': self.text, 'short': 'xyz'})
+        self.doc.HAS_EVENT_LOOP = False
+
+    @pytest.mark.parametrize('seed', range(5))
+    def test_rope_matches_string(self, seed):
+        r = random.Random(seed)
+        text = u'0123456789' * 200
+        rope = Rope(text)
+        for i in range(300):
+            offset = r.randint(0, len(text))
+            if r.random() < 0.5:
+                val = u'x' * r.randint(1, 700)
+                text = text[:offset] + val + text[offset:]
+                rope.insert(offset, val)
+            else:
+                n = r.randint(1, 700)
+                text = text[:offset] + text[offset + n:]
+                rope.delete(offset, n)
+            assert len(rope) == len(text)
+            start = r.randint(0, len(text))
+            assert rope.slice(start, start + 50) == text[start:start + 50]
+        assert rope.to_string() == text
+        assert isinstance(rope.to_string(), unicode)
+
+    def test_long_strings_are_edited_as_ropes(self):
+        doc = self.doc
+        doc.add_local_op(Op('si', ['txt'], offset=3, val='123'))
+        doc.add_local_op(Op('si', ['short'], offset=3, val='!'))
+        assert isinstance(doc.snapshot.snapshot['txt'], Rope)
+        assert doc.snapshot.snapshot['short'] == 'xyz!'
+
+        # reading the snapshot gives plain strings
+        expected = self.text[:3] + '123' + self.text[3:]
+        assert doc.get_value(['txt']) == expected
+        assert doc.get_snapshot() == {'txt': expected, 'short': 'xyz!'}
+        assert not isinstance(doc.snapshot.snapshot['txt'], Rope)
+
+    def test_rebuild_with_ropes(self):
+        doc = self.doc
+        doc.add_local_op(Op('sd', ['txt'], offset=0, val=5))
+        doc.close_changeset()
+        doc.add_local_op(Op('sm', ['txt'], offset=0, val=5,
+                            dest_path=['short'], dest_offset=0))
+        doc.close_changeset()
+        for i in range(20):
+            doc.add_local_op(Op('si', ['txt'], offset=i * 7, val='+'))
+            doc.close_changeset()
+        snapshot = doc.get_snapshot()
+        assert snapshot['short'] == 'fghijxyz'
+
+        doc.rebuild_snapshot(ignore_cache=True)
+        assert isinstance(doc.snapshot.snapshot['txt'], Rope)
+        assert doc.get_snapshot() == snapshot
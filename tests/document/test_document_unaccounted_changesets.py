@@ -348,3 +348,42 @@ class TestDocumentUnaccountedChangesets:
         assert K.get_unaccounted_changesets() == [E,I]
         assert L.get_unaccounted_changesets() == [C,G,H,K]
         assert M.get_unaccounted_changesets() == []
+
+    def test_branch_shares_unaccounted_changesets(self):
+        """
+             -- A
+            /
+        root -- B1 -- B2 -- B3
+
+        A comes in after the whole B branch. Every B changeset has A as its
+        only unaccounted changeset, and they all share one copy of it.
+        """
+        doc = Document(snapshot='')
+        doc.HAS_EVENT_LOOP = False
+        root = doc.get_root_changeset()
+        B1 = Changeset(doc.get_id(), "user1", [root])
+        B1.set_id('b1')
+        doc.receive_changeset(B1)
+        B2 = Changeset(doc.get_id(), "user1", [B1])
+        B2.set_id('b2')
+        doc.receive_changeset(B2)
+        B3 = Changeset(doc.get_id(), "user1", [B2])
+        B3.set_id('b3')
+        doc.receive_changeset(B3)
+
+        A = Changeset(doc.get_id(), "user0", [root])
+        A.set_id('a')
+        doc.receive_changeset(A)
+        assert doc.get_ordered_changesets() == [root, A, B1, B2, B3]
+        assert B1.get_unaccounted_changesets() == [A]
+        assert B2.get_unaccounted_changesets() == [A]
+        assert B3.get_unaccounted_changesets() == [A]
+        assert B2.preceding_changesets is B1.preceding_changesets
+        assert B3.preceding_changesets is B1.preceding_changesets
+
+        # a new changeset on the end of the branch shares them too
+        B4 = Changeset(doc.get_id(), "user1", [B3])
+        B4.set_id('b4')
+        doc.receive_changeset(B4)
+        assert B4.get_unaccounted_changesets() == [A]
+        assert B4.preceding_changesets is B1.preceding_changesets
@@ -0,0 +1,87 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+import pytest
+
+from majormajor.document import Document
+from majormajor.ordered_changesets import OrderedChangesets
+from majormajor.ops.op import Op
+
+
+class TestOrderedChangesets:
+
+    def setup_method(self, method):
+        self.doc = Document('ordered_doc', 'u1', snapshot='')
+        self.doc.HAS_EVENT_LOOP = False
+
+    def test_acts_like_a_list(self):
+        items = ['a', 'b', 'c']
+        ocs = OrderedChangesets(items)
+        assert len(ocs) == 3
+        assert list(ocs) == items
+        assert ocs[0] == 'a'
+        assert ocs[-1] == 'c'
+        assert ocs[1:] == ['b', 'c']
+        assert list(reversed(ocs)) == ['c', 'b', 'a']
+        assert 'b' in ocs
+        assert not 'd' in ocs
+
+        ocs.insert(1, 'd')
+        ocs.append('e')
+        ocs.insert(0, 'f')
+        assert list(ocs) == ['f', 'a', 'd', 'b', 'c', 'e']
+        assert ocs.index('b') == 3
+        assert list(ocs.iter_from(4)) == ['c', 'e']
+        assert list(ocs.iter_reversed_from(2)) == ['d', 'a', 'f']
+
+        with pytest.raises(ValueError):
+            ocs.index('g')
+        with pytest.raises(ValueError):
+            ocs.append('a')
+        with pytest.raises(IndexError):
+            ocs[6]
+
+    @pytest.mark.parametrize('seed', range(10))
+    def test_random_inserts_match_list(self, seed):
+        r = random.Random(seed)
+        expected = []
+        ocs = OrderedChangesets()
+        for i in range(200):
+            position = r.randint(0, len(expected))
+            expected.insert(position, i)
+            ocs.insert(position, i)
+        assert list(ocs) == expected
+        for i, item in enumerate(expected):
+            assert ocs[i] == item
+            assert ocs.index(item) == i
+        start = r.randint(0, len(expected))
+        assert list(ocs.iter_from(start)) == expected[start:]
+        assert ocs[start:start + 10] == expected[start:start + 10]
+
+    def test_document_order(self):
+        doc = self.doc
+        root = doc.get_root_changeset()
+        doc.add_local_op(Op('si', [], offset=0, val='a'))
+        A = doc.close_changeset()
+        doc.add_local_op(Op('si', [], offset=1, val='b'))
+        B = doc.close_changeset()
+
+        assert isinstance(doc.ordered_changesets, OrderedChangesets)
+        assert doc.get_ordered_changesets() == [root, A, B]
+        assert doc.ordered_changesets.index(B) == 2
+        assert doc.get_ordered_changesets() == doc.tree_to_list()
@@ -16,6 +16,8 @@
 
 from majormajor.majormajor import MajorMajor
 from majormajor.document import Document
+from majormajor.changeset import Changeset
+from majormajor.ops.op import Op
 
 
 
@@ -30,3 +32,32 @@ class TestMajorMajorHelpers:
         assert isinstance(doc, Document)
         assert doc.get_snapshot() == {}
 
+    def test_pull_from_pending_lists(self):
+        received = []
+        self.collab0.signal_callbacks = {'receive-changeset':
+                                         [received.append]}
+        doc = self.collab0.new_document(snapshot='abc')
+        self.collab0.pull_from_pending_lists()
+        assert received == []
+
+        cs = Changeset(doc.get_id(), 'u2', [doc.get_root_changeset()])
+        cs.add_op(Op('si', [], offset=1, val='xy'))
+        cs.set_id('A')
+        doc.receive_changeset(cs)
+        self.collab0.pull_from_pending_lists()
+        assert received == [[('si', [], 1, 'xy')]]
+        assert doc.get_snapshot() == 'axybc'
+
+    def test_compact_documents_waits_for_a_peer(self):
+        doc = self.collab0.new_document(snapshot='abc')
+        root = doc.get_root_changeset()
+        doc.add_local_op(Op('si', [], offset=0, val='x'))
+        A = doc.close_changeset()
+        # no peer has said what it has, so nothing can be dropped
+        self.collab0.compact_documents()
+        assert doc.get_root_changeset() is root
+
+        doc.set_peer_dependencies('u2', [A.get_id()])
+        self.collab0.compact_documents()
+        assert doc.get_root_changeset() is A
+        assert doc.get_snapshot() == 'xabc'
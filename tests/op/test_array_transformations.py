@@ -456,3 +456,24 @@ class TestArrayTransformations:
         assert op17.t_offset == 4
         assert op17.t_val == 2
         op1.remove_old_hazards(purge=True)
+
+    def test_transformed_path_does_not_change_original(self):
+        """
+        Transformed values share the originals until a transformation needs
+        to change them, and then the original is left alone.
+        """
+        op1 = Op('ai', ['a'], offset=0, val=['X', 'Y'])
+        cs1 = Changeset('doc_id', 'author', [])
+        cs1.add_op(op1)
+
+        path = ['a', 3, 'b']
+        op2 = Op('ai', path, offset=0, val=[{'k': 'v'}])
+        assert op2.t_path is path
+        assert op2.t_val is op2.val
+        op2.ot(cs1)
+        assert op2.t_path == ['a', 5, 'b']
+        assert op2.path == ['a', 3, 'b']
+        assert path == ['a', 3, 'b']
+
+        op2.reset_transformations()
+        assert op2.t_path == ['a', 3, 'b']
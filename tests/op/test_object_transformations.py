@@ -244,3 +244,37 @@ class TestObjectTransformations:
         assert op9.t_offset == 'b'
         assert not op9.is_noop()
         op1.hazards = []
+
+    def test_ops_are_built_once_with_transform_tables(self, monkeypatch):
+        from majormajor.ops.string_insert_op import StringInsertOp
+        calls = []
+        init = Op.__init__
+
+        def counting_init(self, *args, **kwargs):
+            calls.append(args)
+            init(self, *args, **kwargs)
+        monkeypatch.setattr(Op, '__init__', counting_init)
+        op = Op('si', ['s'], offset=0, val='abc')
+        assert isinstance(op, StringInsertOp)
+        assert len(calls) == 1
+
+        # each class transforms by looking up its own functions
+        assert StringInsertOp.get_transform_table()['sd'] is \
+            StringInsertOp.__dict__['string_delete_transform']
+        assert Op.get_transform_table()['oi'] is \
+            Op.__dict__['object_insert_transform']
+
+    def test_a_later_subclass_gets_its_own_transform_table(self):
+        from majormajor.ops.string_insert_op import StringInsertOp
+
+        class LaterOp(StringInsertOp):
+            __slots__ = ()
+
+            def string_delete_transform(self, op):
+                return False
+
+        StringInsertOp.get_transform_table()
+        assert LaterOp.get_transform_table()['sd'] is \
+            LaterOp.__dict__['string_delete_transform']
+        assert StringInsertOp.get_transform_table()['sd'] is \
+            StringInsertOp.__dict__['string_delete_transform']
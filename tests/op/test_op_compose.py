@@ -0,0 +1,98 @@
+# MajorMajor - Collaborative Document Editing Library
+# Copyright (C) 2013 Ritchie Wilson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from majormajor.document import Document
+from majormajor.ops.op import Op
+
+
+class TestOpCompose:
+
+    def setup_method(self, method):
+        self.doc = Document(snapshot={'s': 'ABCDEF', 'a': [0, 1, 2, 3, 4],
+                                      't': ''})
+        self.doc.HAS_EVENT_LOOP = False
+
+    def add_ops(self, *ops):
+        for op in ops:
+            self.doc.add_local_op(op)
+        return self.doc.open_changeset.get_ops()
+
+    def test_typing(self):
+        ops = self.add_ops(Op('si', ['s'], offset=2, val='x'),
+                           Op('si', ['s'], offset=3, val='y'),
+                           Op('si', ['s'], offset=4, val='z'),
+                           # and back into the middle of the run
+                           Op('si', ['s'], offset=3, val='12'))
+        assert len(ops) == 1
+        assert ops[0].val == 'x12yz'
+        assert ops[0].offset == 2
+        assert self.doc.get_snapshot()['s'] == 'ABx12yzCDEF'
+
+    def test_backspace_and_delete(self):
+        ops = self.add_ops(Op('sd', ['s'], offset=4, val=1),
+                           Op('sd', ['s'], offset=3, val=1),
+                           Op('sd', ['s'], offset=1, val=2))
+        assert len(ops) == 1
+        assert ops[0].offset == 1
+        assert ops[0].val == 4
+        assert self.doc.get_snapshot()['s'] == 'AF'
+
+        # still touching the deleted range, on either side
+        ops = self.add_ops(Op('sd', ['s'], offset=0, val=1),
+                           Op('sd', ['s'], offset=0, val=1))
+        assert len(ops) == 1
+        assert ops[0].offset == 0
+        assert ops[0].val == 6
+        assert self.doc.get_snapshot()['s'] == ''
+
+    def test_fixing_a_typo(self):
+        ops = self.add_ops(Op('si', ['s'], offset=6, val='ghx'),
+                           Op('sd', ['s'], offset=8, val=1),
+                           Op('si', ['s'], offset=8, val='i'))
+        assert len(ops) == 1
+        assert ops[0].val == 'ghi'
+        # deleting all of the inserted text leaves them separate
+        ops = self.add_ops(Op('sd', ['s'], offset=6, val=3))
+        assert len(ops) == 2
+        assert self.doc.get_snapshot()['s'] == 'ABCDEF'
+
+    def test_not_adjacent(self):
+        ops = self.add_ops(Op('si', ['s'], offset=0, val='x'),
+                           Op('si', ['s'], offset=3, val='y'),
+                           Op('si', ['t'], offset=0, val='z'),
+                           Op('sd', ['t'], offset=0, val=1),
+                           Op('sd', ['s'], offset=0, val=1))
+        assert len(ops) == 5
+        assert self.doc.get_snapshot()['s'] == 'AByCDEF'
+
+    def test_arrays(self):
+        ops = self.add_ops(Op('ai', ['a'], offset=5, val=[5]),
+                           Op('ai', ['a'], offset=6, val=[6, 7]),
+                           Op('ad', ['a'], offset=6, val=1))
+        assert len(ops) == 1
+        assert ops[0].val == [5, 7]
+        ops = self.add_ops(Op('ad', ['a'], offset=1, val=1),
+                           Op('ad', ['a'], offset=0, val=1))
+        assert len(ops) == 2
+        assert ops[1].offset == 0
+        assert ops[1].val == 2
+        assert self.doc.get_snapshot()['a'] == [2, 3, 4, 5, 7]
+
+        # the composed ops rebuild the same snapshot
+        snapshot = self.doc.get_snapshot()
+        self.doc.close_changeset()
+        self.doc.rebuild_snapshot(ignore_cache=True)
+        assert self.doc.get_snapshot() == snapshot
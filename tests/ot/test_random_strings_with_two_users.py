@@ -34,7 +34,7 @@ class TestRandomStringsWithTwoUsers:
     def build_random_initial_document(self):
         snapshot = ''.join(random.sample(self.remaining_chars, 100))
         doc = Document(snapshot=snapshot)
-        doc.get_ordered_changesets()[0].ops[0].cheat = ""
+        self.cheats = {doc.get_ordered_changesets()[0].ops[0]: ""}
         for i, char in enumerate(snapshot):
             before = list(snapshot[:i])
             after = list(snapshot[i + 1:])
@@ -122,7 +122,7 @@ class TestRandomStringsWithTwoUsers:
             self.remaining_chars = self.remaining_chars.replace(char, '')
 
         op = Op('si', [], offset=offset, val=val)
-        op.cheat = previous_chars + " " + val + " " + subsequent_chars
+        self.cheats[op] = previous_chars + " " + val + " " + subsequent_chars
         return op
 
     def build_random_string_delete(self):
@@ -147,7 +147,7 @@ class TestRandomStringsWithTwoUsers:
         for char in deleted_chars:
             self.results[char]['deleted'] = True
         op = Op('sd', [], offset=offset, val=val)
-        op.cheat = "delete " + deleted_chars
+        self.cheats[op] = "delete " + deleted_chars
         return op
 
     @pytest.mark.parametrize(('i'), [(i) for i in xrange(1)])
@@ -197,7 +197,7 @@ class TestRandomStringsWithTwoUsers:
                      cs.get_short_id())
                 f.write(str(t))
                 f.write(',  # ')
-                f.write(op.cheat)
+                f.write(self.cheats[op])
                 f.write('\n')
             f.write('\n\n')
             f.write(str(self.results))
@@ -32,7 +32,7 @@ class TestStringsInComplexBranches:
     def build_random_initial_document(self):
         snapshot = ''.join(random.sample(self.remaining_chars, 10))
         doc = Document(snapshot=snapshot)
-        doc.get_ordered_changesets()[0].ops[0].cheat = ""
+        self.cheats = {doc.get_ordered_changesets()[0].ops[0]: ""}
         for i, char in enumerate(snapshot):
             before = list(snapshot[:i])
             after = list(snapshot[i + 1:])
@@ -128,7 +128,7 @@ class TestStringsInComplexBranches:
             self.remaining_chars = self.remaining_chars.replace(char, '')
 
         op = Op('si', [], offset=offset, val=val)
-        op.cheat = previous_chars + " " + val + " " + subsequent_chars
+        self.cheats[op] = previous_chars + " " + val + " " + subsequent_chars
         return op
 
     def build_random_string_delete(self):
@@ -153,7 +153,7 @@ class TestStringsInComplexBranches:
         for char in deleted_chars:
             self.results[char]['deleted'] = True
         op = Op('sd', [], offset=offset, val=val)
-        op.cheat = "delete " + deleted_chars
+        self.cheats[op] = "delete " + deleted_chars
         return op
 
     @pytest.mark.parametrize(('i'), [(i) for i in xrange(500)])
@@ -201,7 +201,7 @@ class TestStringsInComplexBranches:
                      cs.get_short_id())
                 f.write(str(t))
                 f.write(',  # ')
-                f.write(op.cheat)
+                f.write(self.cheats[op])
                 f.write('\n')
             f.write('\n\n')
             f.write(str(self.results))
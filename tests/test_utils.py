@@ -37,6 +37,17 @@ def build_changesets_from_tuples(css_data, doc):
     return css
 
 
+def build_changeset(doc, _id, deps, ops, user='u1'):
+    """
+    Build the changeset with the given id, dependencies and ops for doc.
+    """
+    cs = Changeset(doc.get_id(), user, deps)
+    for op in ops:
+        cs.add_op(op)
+    cs.set_id(_id)
+    return cs
+
+
 def add_switches(params, n):
     """
     When parameterizing a test, it is helpful to run all the tests one way, and